@@ -14,3 +14,8 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "projeto_simoldes.settings")
 
 application = get_asgi_application()
+
+# Só o processo do servidor grava a planilha (veja webapp/diario.py)
+from webapp.armazenamento import iniciar_servidor
+
+iniciar_servidor()
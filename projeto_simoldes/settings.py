@@ -42,6 +42,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # Primeiro da lista, para medir a requisição inteira (Server-Timing e /metrics)
+    "webapp.metricas.MedicaoMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -126,3 +128,94 @@ DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+
+# Serviço de renderização dos previews STEP (python manage.py servico_render).
+# O mesmo SQLite guarda a fila e o manifesto dos previews já gerados.
+PREVIEWS_FILA = os.path.join(MEDIA_ROOT, 'modelos', 'previews', 'fila_render.sqlite3')
+PREVIEWS_WORKERS = 2
+# Cada processo de renderização é reciclado após N jobs ou ao passar do limite de memória
+PREVIEWS_JOBS_POR_PROCESSO = 200
+PREVIEWS_LIMITE_MEMORIA_MB = 1500
+# Configuração da renderização; mudar qualquer valor invalida os previews existentes.
+# "larguras" são as versões menores (WebP e JPEG) geradas junto com cada imagem.
+PREVIEWS_RENDER = {
+    'largura': 640,
+    'altura': 480,
+    'transparencia': 0.7,
+    'deflexao': 0.5,
+    'larguras': [160, 320, 640],
+}
+
+# Onde ficam os dados dos moldes: 'banco' (tabelas Molde/Item), 'planilha'
+# (direto no moldes.xlsx) ou 'fragmentos' (um arquivo por molde em
+# media/modelos). No modo banco, rode "python manage.py importar_planilha"
+# para trazer a planilha atual; alguns segundos depois de cada alteração as
+# células de código e checkboxes que mudaram são atualizadas nela em segundo
+# plano (outras colunas, formatação e fórmulas ficam como estão). No modo
+# fragmentos, rode "python manage.py importar_planilha --destino fragmentos"
+# uma vez e "exportar_planilha" quando precisar da planilha inteira.
+ARMAZENAMENTO_MOLDES = 'banco'
+EXPORTACAO_PLANILHA_ATRASO = 5
+# Modo planilha: segundos entre cada gravação do diário de alterações no
+# moldes.xlsx. Só um processo grava a planilha: rode o servidor com um único
+# processo (ex.: uvicorn sem --workers, gunicorn -w 1); nos outros, salvar
+# responde com erro. Com vários processos use o modo 'banco'.
+DIARIO_INTERVALO = 2
+
+# Barra lateral: com o pacote watchdog as pastas de media/modelos são
+# acompanhadas por notificação; sem ele (ou com PASTAS_MODELOS_NOTIFICACOES
+# = False, útil em compartilhamentos de rede) a data de modificação das
+# pastas é conferida no máximo a cada PASTAS_MODELOS_INTERVALO segundos.
+PASTAS_MODELOS_NOTIFICACOES = True
+PASTAS_MODELOS_INTERVALO = 5
+
+# Página de modelos: intervalo (s) entre consultas à fila em cada conexão de
+# server-sent events e por quanto tempo (s) cada conexão fica aberta antes de
+# o navegador reconectar. Com SSE, rode o projeto pelo asgi.py (ex.: uvicorn
+# projeto_simoldes.asgi:application); no WSGI os eventos respondem 204 e a página
+# consulta o estado por JSON.
+PREVIEWS_EVENTOS_INTERVALO = 1
+PREVIEWS_EVENTOS_DURACAO = 300
+
+# Views assíncronas (rodando pelo asgi.py): threads para leitura da planilha/
+# banco e montagem das páginas, e quantas tarefas cada executor aceita
+# (rodando + esperando) antes de responder 503. As gravações usam uma única
+# thread, para saírem uma de cada vez.
+EXECUTOR_LEITURA_THREADS = 8
+EXECUTOR_LEITURA_FILA = 64
+EXECUTOR_GRAVACAO_FILA = 32
+
+# Itens de um molde mostrados por página (principal e checklist)
+ITENS_POR_PAGINA = 50
+
+# Intervalo (s) com que as páginas abertas de um molde buscam as alterações
+# feitas por outras pessoas
+ALTERACOES_INTERVALO = 5
+
+# python manage.py preaquecer (pode rodar pelo cron): endereço do servidor em
+# execução cujas páginas são abertas para aquecer os caches; None = só gera
+# os previews que faltam. PREAQUECER_TEMPO_MAXIMO: segundos renderizando antes
+# de parar e deixar o resto para a próxima execução (0 = sem limite)
+PREAQUECER_URL = None
+PREAQUECER_TEMPO_MAXIMO = 3600
+
+# /media/ e os estáticos são entregues pelo próprio projeto (webapp/arquivos.py),
+# também sem DEBUG; de /media/ só saem os modelos STEP e os previews.
+# Segundos que o navegador guarda CSS, JS e o logo antes de revalidar; os
+# previews têm a versão na URL e ficam guardados por um ano.
+ARQUIVOS_ESTATICOS_MAX_AGE = 3600
+
+# Mensagens dos módulos do webapp (serviço de renderização, diário, etc.) no console
+LOGGING = {
+    "version": 1,
+    "disable_existing_loggers": False,
+    "formatters": {
+        "simples": {"format": "{asctime} {levelname} {name}: {message}", "style": "{"},
+    },
+    "handlers": {
+        "console": {"class": "logging.StreamHandler", "formatter": "simples"},
+    },
+    "loggers": {
+        "webapp": {"handlers": ["console"], "level": "INFO"},
+    },
+}
@@ -18,12 +18,13 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import path
 from django.conf import settings
-from django.conf.urls.static import static
 from webapp import views 
 from webapp.views import listar_modelos_step, pagina_principal, login, checklist
 
 urlpatterns = [
     path('modelos', listar_modelos_step, name='listar_modelos_step'),
+    path('modelos/estado', views.estado_modelos, name='estado_modelos'),
+    path('modelos/eventos', views.eventos_modelos, name='eventos_modelos'),
     path('login', login, name ='login'),
     path('', login, name ='login'),
     # path('pagina_principal', pagina_principal, name='pagina_principal'),
@@ -31,6 +32,12 @@ urlpatterns = [
     path('pagina_principal', views.pagina_principal, name='pagina_principal'),
     path('atualizar/', views.atualizar_status, name='atualizar_status'),
     path('atualizar_checklist/', views.atualizar_status_checklist, name='atualizar_status_checklist'),
+    path('alternar/', views.alternar_campos, name='alternar_campos'),
+    path('alteracoes/<str:nome_aba>/', views.alteracoes_do_molde, name='alteracoes_do_molde'),
+    path('painel', views.painel, name='painel'),
+    path('metrics', views.exportar_metricas, name='metricas'),
     path('pagina/<str:nome_aba>/', views.pagina_principal, name='listar_arquivos_com_aba'),
-    path('checklist/<str:nome_aba>/', views.checklist, name='listar_arquivos_checklist')
-] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)# Vê se a pasta MEDIA existe
+    path('checklist/<str:nome_aba>/', views.checklist, name='listar_arquivos_checklist'),
+    path(settings.MEDIA_URL.lstrip('/') + '<path:caminho>', views.servir_media, name='media'),
+    path(settings.STATIC_URL.lstrip('/') + '<path:caminho>', views.servir_estatico, name='estaticos'),
+]# Vê se a pasta MEDIA existe
@@ -14,3 +14,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "projeto_simoldes.settings")
 
 application = get_wsgi_application()
+
+# Só o processo do servidor grava a planilha (veja webapp/diario.py)
+from webapp.armazenamento import iniciar_servidor
+
+iniciar_servidor()
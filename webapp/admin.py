@@ -1,3 +1,17 @@
 from django.contrib import admin
+from .models import Item, Molde
 
 # Register your models here.
+
+
+@admin.register(Molde)
+class MoldeAdmin(admin.ModelAdmin):
+    list_display = ('nome', 'ordem', 'atualizado_em')
+    search_fields = ('nome',)
+
+
+@admin.register(Item)
+class ItemAdmin(admin.ModelAdmin):
+    list_display = ('molde', 'linha', 'codigo', 'status')
+    list_filter = ('status', 'molde')
+    search_fields = ('codigo',)
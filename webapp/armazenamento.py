@@ -0,0 +1,195 @@
+import os
+from django.conf import settings
+from django.core.paginator import Paginator
+from django.db import transaction
+from .models import Item, Molde
+from . import historico
+from . import painel
+from .consulta import filtrar_queryset, itens_por_pagina
+from .diario import diario_da_planilha
+from .fragmentos import cache_de_fragmentos
+from .planilha import COLUNAS_CAMPOS, cache_da_planilha
+from .sincronizacao import agendar_exportacao
+
+# Onde ficam os dados de produção (moldes e itens). As views usam só as
+# funções deste módulo; o modo é escolhido em settings.ARMAZENAMENTO_MOLDES:
+#   'banco'    - tabelas Molde/Item do Django; a planilha é exportada em segundo plano
+#   'planilha' - direto no moldes.xlsx, com as gravações passando pelo diário
+#   'fragmentos' - um arquivo por molde em media/modelos (fragmentos.py)
+
+def caminho_planilha():
+    return os.path.join(settings.MEDIA_ROOT, 'moldes.xlsx')
+
+
+def pasta_fragmentos():
+    return os.path.join(settings.MEDIA_ROOT, 'modelos')
+
+
+class ArmazenamentoPlanilha:
+    def __init__(self, caminho):
+        self.caminho = caminho
+        self.cache = cache_da_planilha(caminho)
+        self.diario = diario_da_planilha(caminho)
+        self.diario.ao_gravar = self.cache.confirmar_gravacao
+
+    def disponivel(self):
+        return self.cache.existe()
+
+    # Nomes dos moldes (abas)
+    def abas(self):
+        return self.cache.abas()
+
+    # Itens de um molde, na ordem das linhas, já com as alterações que ainda
+    # estão só no diário
+    def linhas(self, aba):
+        pendentes = self.diario.pendentes(aba)
+        if pendentes:
+            self.cache.aplicar(aba, pendentes)
+        return self.cache.linhas(aba)
+
+    # Uma página dos itens de um molde que passam no filtro (consulta.Filtro),
+    # buscada no índice da aba sem montar a lista inteira
+    def pagina(self, aba, filtro):
+        self.linhas(aba)
+        resultado = self.cache.indice(aba).consultar(filtro)
+        return Paginator(resultado, itens_por_pagina()).get_page(filtro.pagina)
+
+    # alteracoes: {número da linha: {campo: True/False}}
+    # Grava no diário (a planilha é atualizada em segundo plano) e devolve o
+    # novo status de cada linha alterada; linhas que não existem na aba são
+    # ignoradas
+    def salvar(self, aba, alteracoes):
+        linhas = {linha.linha: linha for linha in self.linhas(aba)}
+        alteracoes = {linha: campos for linha, campos in alteracoes.items() if linha in linhas}
+        if not alteracoes:
+            return {}
+
+        self._registrar(aba, alteracoes)
+        antes = {numero: painel.contagens_item(linhas[numero]) for numero in alteracoes}
+        status = self.cache.aplicar(aba, alteracoes)
+
+        # Atualiza as contagens do painel só com a diferença das linhas alteradas
+        indice = painel.indice_da_planilha(self.caminho)
+        for numero in alteracoes:
+            indice.aplicar(aba, painel.diferenca(antes[numero], painel.contagens_item(linhas[numero])))
+        historico.registrar(aba, [linhas[numero] for numero in alteracoes])
+        return status
+
+    def _registrar(self, aba, alteracoes):
+        self.diario.registrar(aba, alteracoes)
+
+    # Contagens por molde para o painel; o índice só é montado de novo se a
+    # planilha foi alterada por fora da aplicação
+    def contagens(self):
+        abas = self.abas()
+        indice = painel.indice_da_planilha(self.caminho)
+        if not indice.montado(self.cache.geracao):
+            indice.montar({aba: self.linhas(aba) for aba in abas}, self.cache.geracao)
+        return indice.contagens()
+
+
+# Um arquivo por molde: ler ou salvar um molde só mexe no arquivo dele. A
+# gravação é feita pelo próprio cache (CacheFragmentos.aplicar), sem diário.
+class ArmazenamentoFragmentos(ArmazenamentoPlanilha):
+    def __init__(self, pasta):
+        self.caminho = pasta
+        self.cache = cache_de_fragmentos(pasta)
+
+    def linhas(self, aba):
+        return self.cache.linhas(aba)
+
+    def _registrar(self, aba, alteracoes):
+        pass
+
+    def contagens(self):
+        self.cache.conferir()
+        return super().contagens()
+
+
+class ArmazenamentoBanco:
+    def disponivel(self):
+        return True
+
+    def abas(self):
+        return list(Molde.objects.values_list('nome', flat=True))
+
+    def linhas(self, aba):
+        return list(Item.objects.filter(molde__nome=aba).order_by('linha'))
+
+    def pagina(self, aba, filtro):
+        itens = filtrar_queryset(Item.objects.filter(molde__nome=aba), filtro)
+        return Paginator(itens, itens_por_pagina()).get_page(filtro.pagina)
+
+    # Atualiza só as linhas alteradas, uma a uma, e agenda a exportação da planilha
+    def salvar(self, aba, alteracoes):
+        status = {}
+        alterados = []
+        with transaction.atomic():
+            for item in Item.objects.filter(molde__nome=aba, linha__in=list(alteracoes)):
+                antes = painel.contagens_item(item)
+                campos = alteracoes[item.linha]
+                for campo, valor in campos.items():
+                    setattr(item, campo, valor)
+                item.save(update_fields=list(campos))
+                status[item.linha] = item.status
+                alterados.append(item)
+                # Contagens do painel atualizadas na mesma transação
+                painel.aplicar_no_banco(item.molde_id, painel.diferenca(antes, painel.contagens_item(item)))
+            historico.registrar(aba, alterados)
+        if status:
+            agendar_exportacao()
+        return status
+
+    # Contagens por molde para o painel, lidas da tabela mantida a cada alteração
+    def contagens(self):
+        return painel.contagens_do_banco()
+
+
+# Chamado pelo wsgi.py e pelo asgi.py, só no processo do servidor: no modo
+# planilha, ele fica dono do diário e reaplica as alterações que ficaram
+# pendentes quando o processo anterior foi encerrado antes de gravar
+def iniciar_servidor():
+    if getattr(settings, 'ARMAZENAMENTO_MOLDES', 'planilha') == 'planilha':
+        diario_da_planilha(caminho_planilha()).recuperar()
+
+
+# Armazenamento configurado em settings.ARMAZENAMENTO_MOLDES
+def obter():
+    modo = getattr(settings, 'ARMAZENAMENTO_MOLDES', 'planilha')
+    if modo == 'banco':
+        return ArmazenamentoBanco()
+    if modo == 'planilha':
+        return ArmazenamentoPlanilha(caminho_planilha())
+    if modo == 'fragmentos':
+        return ArmazenamentoFragmentos(pasta_fragmentos())
+    raise ValueError(f"ARMAZENAMENTO_MOLDES inválido: {modo!r}")
+
+
+# Converte a lista de alterações recebida em JSON
+# ([{"linha": 3, "campo": "programa", "valor": true}, ...]) para o formato
+# aceito por salvar(). Levanta ValueError se algum item for inválido.
+def alteracoes_do_json(lista):
+    alteracoes = {}
+    for alteracao in lista:
+        try:
+            linha = int(alteracao['linha'])
+            campo = alteracao['campo']
+            valor = alteracao['valor']
+        except (KeyError, TypeError, ValueError):
+            raise ValueError(f"Alteração inválida: {alteracao!r}")
+        if campo not in COLUNAS_CAMPOS or not isinstance(valor, bool):
+            raise ValueError(f"Alteração inválida: {alteracao!r}")
+        alteracoes.setdefault(linha, {})[campo] = valor
+    return alteracoes
+
+
+# Compara os checkboxes enviados pelo formulário com os dados atuais e
+# devolve só o que mudou, no formato aceito por salvar()
+def alteracoes_do_formulario(linhas, campos, post):
+    alteracoes = {}
+    for linha in linhas:
+        for campo in campos:
+            valor = post.get(f'{campo}_{linha.linha}') == 'on'
+            if valor != getattr(linha, campo):
+                alteracoes.setdefault(linha.linha, {})[campo] = valor
+    return alteracoes
@@ -0,0 +1,215 @@
+import gzip
+import hashlib
+import mimetypes
+import os
+import posixpath
+import re
+import stat
+import threading
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.staticfiles import finders
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, Http404, HttpResponse, StreamingHttpResponse
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date
+from . import executores, fila_render
+
+# Entrega dos arquivos de /media/ (previews e modelos) e dos estáticos (CSS,
+# JS, logo) pelo próprio Django, com ou sem DEBUG e sem servidor web na frente:
+#   - ETag com o hash do conteúdo, calculado uma vez por versão do arquivo
+#     (tamanho + data), e resposta 304 para If-None-Match/If-Modified-Since;
+#   - URLs com a versão atual do arquivo (?v=..., usadas nas miniaturas dos
+#     previews) ficam um ano no cache do navegador, marcadas como immutable;
+#     uma versão velha ou inventada é tratada como URL sem versão; os estáticos ficam
+#     ARQUIVOS_ESTATICOS_MAX_AGE segundos e o resto da mídia é revalidado;
+#   - CSS, JS e SVG são comprimidos com gzip uma vez e guardados em memória;
+#   - pelo asgi.py o arquivo sai em blocos lidos em uma thread (o FileResponse
+#     seria lido inteiro para a memória antes de ser enviado).
+# Da mídia só saem os modelos STEP e as imagens dos previews; a planilha, o
+# diário, os arquivos dos moldes e a fila de renderização dão 404.
+
+UM_ANO = 365 * 24 * 3600
+COMPRIMIVEIS = {'text/css', 'text/javascript', 'application/javascript', 'image/svg+xml'}
+# Acima deste tamanho a ETag usa só tamanho e data, para não ler modelos
+# STEP enormes inteiros só para calcular o hash
+LIMITE_HASH = 16 * 1024 * 1024
+# Bloco lido de cada vez ao enviar um arquivo pelo ASGI
+TAMANHO_BLOCO = 256 * 1024
+
+# Extensões que /media/ entrega, dentro de media/modelos
+EXTENSOES_MODELOS = ('.stp', '.step')
+EXTENSOES_PREVIEWS = ('.png', '.webp', '.jpg')
+PASTA_PREVIEWS = 'modelos/previews/'
+# Tamanho gerado de um preview (ex.: 1001-160.webp), a partir de 1001.png
+VARIANTE = re.compile(r'-\d+\.(webp|jpg)$', re.IGNORECASE)
+
+
+# O que se sabe de uma versão de um arquivo
+class Versao:
+    def __init__(self, etag, tipo, comprimido=None):
+        self.etag = etag
+        self.tipo = tipo
+        # Conteúdo em gzip (só para os tipos de COMPRIMIVEIS)
+        self.comprimido = comprimido
+        # Valores de ?v= já conferidos para esta versão do arquivo
+        self.confirmadas = set()
+
+    # A parte da ETag que também vale como ?v= (o hash, sem aspas)
+    @property
+    def token(self):
+        return self.etag.removeprefix('W/').strip('"')
+
+
+# {caminho: ((tamanho, mtime), Versao)}
+_versoes = {}
+_versoes_lock = threading.Lock()
+
+
+def _versao(caminho, estado):
+    assinatura = (estado.st_size, estado.st_mtime_ns)
+    with _versoes_lock:
+        conhecida = _versoes.get(caminho)
+    if conhecida is not None and conhecida[0] == assinatura:
+        return conhecida[1]
+
+    tipo, codificacao = mimetypes.guess_type(caminho)
+    if codificacao:
+        # Ex.: arquivo.css.gz é entregue como está, não como CSS
+        tipo = 'application/octet-stream'
+    tipo = tipo or 'application/octet-stream'
+
+    if estado.st_size > LIMITE_HASH:
+        versao = Versao(f'W/"{estado.st_size:x}-{estado.st_mtime_ns:x}"', tipo)
+    elif tipo in COMPRIMIVEIS:
+        with open(caminho, 'rb') as f:
+            conteudo = f.read()
+        comprimido = gzip.compress(conteudo, mtime=0)
+        versao = Versao(
+            f'"{hashlib.sha1(conteudo).hexdigest()}"', tipo,
+            comprimido if len(comprimido) < len(conteudo) else None,
+        )
+    else:
+        versao = Versao(f'"{fila_render.hash_arquivo(caminho)}"', tipo)
+
+    with _versoes_lock:
+        _versoes[caminho] = (assinatura, versao)
+    return versao
+
+
+# Caminho dentro de pasta, sem deixar sair dela (../)
+def caminho_seguro(pasta, relativo):
+    relativo = posixpath.normpath(relativo).lstrip('/')
+    try:
+        return safe_join(pasta, relativo)
+    except SuspiciousFileOperation:
+        raise Http404
+
+
+# Indica se um caminho relativo a MEDIA_ROOT pode ser baixado:
+# modelos/**/*.stp|step e modelos/previews/**/*.png|webp|jpg
+def media_publica(relativo):
+    partes = posixpath.normpath(relativo).lstrip('/').split('/')
+    if len(partes) < 2 or partes[0] != 'modelos':
+        return False
+    extensao = posixpath.splitext(partes[-1])[1].lower()
+    if partes[1] == 'previews':
+        return len(partes) > 2 and extensao in EXTENSOES_PREVIEWS
+    return extensao in EXTENSOES_MODELOS
+
+
+# Arquivo de /media/ (só os de media_publica)
+def caminho_media(relativo):
+    if not media_publica(relativo):
+        raise Http404
+    return caminho_seguro(settings.MEDIA_ROOT, relativo)
+
+
+# Função que devolve as versões atuais (fila_render.versao_preview) de uma
+# imagem de preview, para conferir o ?v= da URL; None fora dos previews
+def versoes_da_media(relativo):
+    relativo = posixpath.normpath(relativo).lstrip('/')
+    if not relativo.startswith(PASTA_PREVIEWS):
+        return None
+    imagem = VARIANTE.sub('.png', relativo[len(PASTA_PREVIEWS):])
+    return lambda: fila_render.versoes_da_imagem(imagem)
+
+
+# Arquivo estático: STATIC_ROOT (depois do collectstatic) ou as pastas static/ dos apps
+def caminho_estatico(relativo):
+    relativo = posixpath.normpath(relativo).lstrip('/')
+    raiz = getattr(settings, 'STATIC_ROOT', None)
+    if raiz:
+        caminho = caminho_seguro(raiz, relativo)
+        if os.path.isfile(caminho):
+            return caminho
+    try:
+        caminho = finders.find(relativo)
+    except SuspiciousFileOperation:
+        caminho = None
+    if not caminho:
+        raise Http404
+    return caminho
+
+
+# Conteúdo do arquivo em blocos, para o ASGI enviar sem ler tudo de uma vez
+async def _blocos(arquivo):
+    ler = sync_to_async(arquivo.read, thread_sensitive=False)
+    try:
+        while bloco := await ler(TAMANHO_BLOCO):
+            yield bloco
+    finally:
+        arquivo.close()
+
+
+# Indica se o ?v= da URL é a versão atual do arquivo: o hash da ETag ou uma
+# das versões devolvidas por versoes (ex.: versoes_da_media)
+def _versao_atual(versao, v, versoes):
+    if v in versao.confirmadas:
+        return True
+    if v != versao.token and (versoes is None or v not in versoes()):
+        return False
+    versao.confirmadas.add(v)
+    return True
+
+
+# Resposta com o arquivo (ou 304). max_age: segundos no cache do navegador
+# para URLs sem versão (0 = revalidar sempre); versoes: veja _versao_atual
+def servir(request, caminho, max_age=0, versoes=None):
+    try:
+        estado = os.stat(caminho)
+    except OSError:
+        raise Http404
+    if not stat.S_ISREG(estado.st_mode):
+        raise Http404
+    versao = _versao(caminho, estado)
+
+    comprimido = versao.comprimido is not None and 'gzip' in request.headers.get('Accept-Encoding', '')
+    # Cada representação tem a sua ETag
+    etag = versao.etag[:-1] + '-gz"' if comprimido else versao.etag
+
+    resposta = get_conditional_response(request, etag=etag, last_modified=int(estado.st_mtime))
+    if resposta is None:
+        if comprimido:
+            resposta = HttpResponse(versao.comprimido, content_type=versao.tipo)
+            resposta['Content-Encoding'] = 'gzip'
+        elif executores.pelo_asgi(request):
+            arquivo = open(caminho, 'rb')
+            resposta = StreamingHttpResponse(_blocos(arquivo), content_type=versao.tipo)
+            resposta['Content-Length'] = os.fstat(arquivo.fileno()).st_size
+        else:
+            resposta = FileResponse(open(caminho, 'rb'), content_type=versao.tipo)
+
+    resposta['ETag'] = etag
+    resposta['Last-Modified'] = http_date(estado.st_mtime)
+    v = request.GET.get('v')
+    if v and _versao_atual(versao, v, versoes):
+        resposta['Cache-Control'] = f'public, max-age={UM_ANO}, immutable'
+    elif max_age:
+        resposta['Cache-Control'] = f'public, max-age={max_age}'
+    else:
+        resposta['Cache-Control'] = 'no-cache'
+    if versao.comprimido is not None:
+        patch_vary_headers(resposta, ('Accept-Encoding',))
+    return resposta
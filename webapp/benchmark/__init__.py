@@ -0,0 +1,2 @@
+# Ferramentas do benchmark das páginas (python manage.py benchmark_paginas):
+# geradores de planilhas e modelos STEP sintéticos e a medição das views.
@@ -0,0 +1,69 @@
+import os
+import random
+from openpyxl import Workbook
+from webapp.painel import NOMES_MAQUINAS
+
+# Dados sintéticos para o benchmark: um moldes.xlsx no mesmo formato da
+# planilha real e peças STEP pequenas com os códigos dos itens.
+
+MARCADO = '☑'
+
+CABECALHO = ['#', 'Item', 'Descrição', 'Chegada aço', 'Programa', *NOMES_MAQUINAS]
+
+
+# Código do item de uma linha (o mesmo nome usado nos arquivos .stp)
+def codigo_item(aba, numero):
+    return f'{aba}-{numero:05d}'
+
+
+# Gera a planilha com "abas" moldes de "linhas" itens cada. densidade é a
+# chance de cada checkbox de aço/programa estar marcado; as máquinas são
+# marcadas com um quarto dessa chance. Devolve os nomes das abas.
+def gerar_planilha(caminho, abas=10, linhas=500, densidade=0.5, semente=1):
+    sorteio = random.Random(semente)
+    wb = Workbook(write_only=True)
+    nomes = [f'MOLDE{indice:03d}' for indice in range(1, abas + 1)]
+    for nome in nomes:
+        ws = wb.create_sheet(nome)
+        ws.append(CABECALHO)
+        for numero in range(1, linhas + 1):
+            valores = [numero, codigo_item(nome, numero), f'Peça {numero}']
+            valores += [MARCADO if sorteio.random() < densidade else None for _ in range(2)]
+            valores += [MARCADO if sorteio.random() < densidade / 4 else None for _ in NOMES_MAQUINAS]
+            ws.append(valores)
+    os.makedirs(os.path.dirname(os.path.abspath(caminho)), exist_ok=True)
+    wb.save(caminho)
+    return nomes
+
+
+# Gera "quantidade" peças STEP em pasta_modelos/<aba>/<código>.stp para os
+# primeiros itens de cada aba: blocos de tamanhos variados com um furo, como
+# as peças de molde. Precisa da pythonocc-core. Devolve os caminhos gerados.
+def gerar_modelos(pasta_modelos, abas, quantidade, semente=1):
+    from OCC.Core.BRepAlgoAPI import BRepAlgoAPI_Cut
+    from OCC.Core.BRepPrimAPI import BRepPrimAPI_MakeBox, BRepPrimAPI_MakeCylinder
+    from OCC.Core.IFSelect import IFSelect_RetDone
+    from OCC.Core.STEPControl import STEPControl_AsIs, STEPControl_Writer
+    from OCC.Core.gp import gp_Ax2, gp_Dir, gp_Pnt
+
+    sorteio = random.Random(semente)
+    caminhos = []
+    for indice in range(quantidade):
+        aba = abas[indice % len(abas)]
+        numero = indice // len(abas) + 1
+        largura, profundidade, altura = (sorteio.uniform(20, 200) for _ in range(3))
+        raio = min(largura, profundidade) * sorteio.uniform(0.1, 0.3)
+        bloco = BRepPrimAPI_MakeBox(largura, profundidade, altura).Shape()
+        eixo = gp_Ax2(gp_Pnt(largura / 2, profundidade / 2, 0), gp_Dir(0, 0, 1))
+        furo = BRepPrimAPI_MakeCylinder(eixo, raio, altura).Shape()
+        peca = BRepAlgoAPI_Cut(bloco, furo).Shape()
+
+        pasta = os.path.join(pasta_modelos, aba)
+        os.makedirs(pasta, exist_ok=True)
+        caminho = os.path.join(pasta, codigo_item(aba, numero) + '.stp')
+        escritor = STEPControl_Writer()
+        escritor.Transfer(peca, STEPControl_AsIs)
+        if escritor.Write(caminho) != IFSelect_RetDone:
+            raise Exception(f"Erro ao gravar o arquivo STEP: {caminho}")
+        caminhos.append(caminho)
+    return caminhos
@@ -0,0 +1,47 @@
+import math
+import time
+import tracemalloc
+
+# Medição de uma view pelo Client de teste do Django: latência de cada
+# requisição (sem tracemalloc, que deixa tudo mais lento) e, numa passada
+# separada, o pico de memória alocada durante uma requisição.
+
+
+# Percentil pelo método do posto mais próximo (p entre 0 e 100)
+def percentil(valores, p):
+    ordenados = sorted(valores)
+    posicao = max(0, math.ceil(p / 100 * len(ordenados)) - 1)
+    return ordenados[posicao]
+
+
+# requisicao: função sem argumentos que faz a requisição e devolve a resposta
+def medir_view(requisicao, repeticoes):
+    # A primeira requisição paga os caches vazios (leitura da planilha etc.)
+    inicio = time.perf_counter()
+    resposta = requisicao()
+    primeira = time.perf_counter() - inicio
+    status = {resposta.status_code}
+
+    tempos = []
+    for _ in range(repeticoes):
+        inicio = time.perf_counter()
+        resposta = requisicao()
+        tempos.append(time.perf_counter() - inicio)
+        status.add(resposta.status_code)
+
+    ja_medindo = tracemalloc.is_tracing()
+    if not ja_medindo:
+        tracemalloc.start()
+    tracemalloc.reset_peak()
+    requisicao()
+    _, pico = tracemalloc.get_traced_memory()
+    if not ja_medindo:
+        tracemalloc.stop()
+
+    return {
+        'primeira': primeira,
+        'p50': percentil(tempos, 50),
+        'p95': percentil(tempos, 95),
+        'pico_memoria': pico,
+        'status': sorted(status),
+    }
@@ -0,0 +1,205 @@
+import itertools
+from urllib.parse import urlencode
+from django.conf import settings
+from django.db.models import Case, IntegerField, Value, When
+from .status import STATUS, Colunas
+from .pastas import chave_item
+
+# Paginação, filtros e ordenação dos itens de um molde nas páginas.
+#
+# No modo banco a consulta vai direto para o banco (índices por molde e
+# status). No modo planilha cada aba em cache tem um IndiceAba: colunas de
+# bytes com o status e as máquinas de cada linha e o código em minúsculas.
+# Os filtros de status e máquina viram máscaras calculadas em C (translate e
+# operações de bits) e só as linhas da página pedida são buscadas; o índice é
+# atualizado linha a linha quando um item é alterado.
+
+# Ordenações aceitas (com "-" na frente para inverter)
+ORDENS = {
+    'linha': 'Linha da planilha',
+    'item': 'Item',
+    'status': 'Status',
+}
+
+
+def itens_por_pagina():
+    return getattr(settings, 'ITENS_POR_PAGINA', 50)
+
+
+# Filtros pedidos na URL (?status=...&maquina=2&busca=...&ordem=-item&pagina=3)
+class Filtro:
+    def __init__(self, status='', maquina=0, busca='', ordem='linha', pagina=1):
+        self.status = status
+        self.maquina = maquina
+        self.busca = busca
+        self.ordem = ordem
+        self.pagina = pagina
+
+    # Lê os parâmetros da URL; valores inválidos são ignorados
+    @classmethod
+    def da_url(cls, parametros):
+        status = parametros.get('status', '')
+        try:
+            maquina = int(parametros.get('maquina') or 0)
+        except ValueError:
+            maquina = 0
+        ordem = parametros.get('ordem', 'linha')
+        return cls(
+            status=status if status in STATUS else '',
+            maquina=maquina if 1 <= maquina <= 6 else 0,
+            busca=parametros.get('busca', '').strip(),
+            ordem=ordem if ordem.lstrip('-') in ORDENS else 'linha',
+            pagina=parametros.get('pagina') or 1,
+        )
+
+    @property
+    def ativo(self):
+        return bool(self.status or self.maquina or self.busca)
+
+    @property
+    def campo_maquina(self):
+        return f'maquina_{self.maquina}' if self.maquina else None
+
+    # Parâmetros da URL para links (paginação); a página fica de fora
+    def parametros(self):
+        parametros = {}
+        if self.status:
+            parametros['status'] = self.status
+        if self.maquina:
+            parametros['maquina'] = self.maquina
+        if self.busca:
+            parametros['busca'] = self.busca
+        if self.ordem != 'linha':
+            parametros['ordem'] = self.ordem
+        return urlencode(parametros)
+
+
+# Tabela para translate: posição em STATUS -> 1 se for o status procurado
+def _tabela_status(posicao):
+    return bytes(int(indice == posicao) for indice in range(256))
+
+
+_TABELAS_STATUS = [_tabela_status(posicao) for posicao in range(len(STATUS))]
+
+
+class IndiceAba:
+    def __init__(self, linhas):
+        self.linhas = linhas
+        colunas = Colunas.de_linhas(linhas)
+        self.status = bytearray(colunas.indices())
+        self.maquinas = [bytearray(coluna) for coluna in colunas.maquinas]
+        self.codigos = [chave_item(linha.item) for linha in linhas]
+        self._posicoes = {linha.linha: posicao for posicao, linha in enumerate(linhas)}
+        # Ordenações já calculadas: {ordem: [posições]}
+        self._ordens = {}
+
+    # Item alterado: atualiza o status e as máquinas daquela linha
+    def atualizar(self, linha):
+        posicao = self._posicoes.get(linha.linha)
+        if posicao is None:
+            return
+        self.status[posicao] = STATUS.index(linha.status_custom)
+        for coluna, marcada in zip(self.maquinas, linha.maquinas):
+            coluna[posicao] = marcada
+        self._ordens = {ordem: posicoes for ordem, posicoes in self._ordens.items()
+                        if ordem.lstrip('-') != 'status'}
+
+    # 1 em cada linha que passa nos filtros de status e máquina (None = todas)
+    def _mascara(self, filtro):
+        mascaras = []
+        if filtro.status:
+            mascaras.append(self.status.translate(_TABELAS_STATUS[STATUS.index(filtro.status)]))
+        if filtro.maquina:
+            mascaras.append(self.maquinas[filtro.maquina - 1])
+        if not mascaras:
+            return None
+        if len(mascaras) == 1:
+            return bytes(mascaras[0])
+        resultado = int.from_bytes(mascaras[0], 'little') & int.from_bytes(mascaras[1], 'little')
+        return resultado.to_bytes(len(self.linhas), 'little')
+
+    def _ordem(self, ordem):
+        if ordem == 'linha':
+            return None
+        if ordem not in self._ordens:
+            campo = ordem.lstrip('-')
+            if campo == 'item':
+                chave = self.codigos.__getitem__
+            elif campo == 'status':
+                chave = self.status.__getitem__
+            else:
+                chave = None
+            self._ordens[ordem] = sorted(range(len(self.linhas)), key=chave, reverse=ordem.startswith('-'))
+        return self._ordens[ordem]
+
+    # Resultado da consulta, no formato aceito pelo Paginator do Django
+    def consultar(self, filtro):
+        mascara = self._mascara(filtro)
+        ordem = self._ordem(filtro.ordem)
+        busca = filtro.busca.lower()
+
+        # Sem busca por texto e na ordem da planilha: a máscara já diz quantas
+        # linhas passam e onde elas estão, sem olhar linha por linha
+        if not busca and ordem is None:
+            if mascara is None:
+                return ResultadoIndice(self.linhas, lambda: iter(range(len(self.linhas))), len(self.linhas))
+            return ResultadoIndice(self.linhas, lambda: _marcadas(mascara), mascara.count(1))
+
+        candidatas = ordem if ordem is not None else range(len(self.linhas))
+        posicoes = [
+            posicao for posicao in candidatas
+            if (mascara is None or mascara[posicao]) and (not busca or busca in self.codigos[posicao])
+        ]
+        return ResultadoIndice(self.linhas, lambda: iter(posicoes), len(posicoes))
+
+
+# Posições marcadas com 1 na máscara, buscadas com bytes.find
+def _marcadas(mascara):
+    posicao = mascara.find(1)
+    while posicao != -1:
+        yield posicao
+        posicao = mascara.find(1, posicao + 1)
+
+
+# Sequência "preguiçosa" para o Paginator: len() é a contagem do índice e
+# só as linhas do trecho pedido são buscadas. posicoes: função que devolve as
+# posições das linhas do resultado, em ordem
+class ResultadoIndice:
+    def __init__(self, linhas, posicoes, total):
+        self.linhas = linhas
+        self.posicoes = posicoes
+        self.total = total
+
+    def __len__(self):
+        return self.total
+
+    def count(self):
+        return self.total
+
+    def __getitem__(self, trecho):
+        if not isinstance(trecho, slice):
+            return self[trecho:trecho + 1][0]
+        posicoes = itertools.islice(self.posicoes(), trecho.start, trecho.stop)
+        return [self.linhas[posicao] for posicao in posicoes]
+
+
+# Consulta equivalente no banco (modo banco)
+def filtrar_queryset(itens, filtro):
+    if filtro.status:
+        itens = itens.filter(status=filtro.status)
+    if filtro.campo_maquina:
+        itens = itens.filter(**{filtro.campo_maquina: True})
+    if filtro.busca:
+        itens = itens.filter(codigo__icontains=filtro.busca)
+    campo = filtro.ordem.lstrip('-')
+    sinal = '-' if filtro.ordem.startswith('-') else ''
+    if campo == 'item':
+        return itens.order_by(sinal + 'codigo', 'linha')
+    if campo == 'status':
+        # Na ordem do fluxo de produção (a mesma de STATUS), não alfabética
+        posicao = Case(
+            *[When(status=status, then=Value(indice)) for indice, status in enumerate(STATUS)],
+            output_field=IntegerField(),
+        )
+        return itens.order_by(posicao.desc() if sinal else posicao.asc(), 'linha')
+    return itens.order_by(sinal + 'linha')
@@ -0,0 +1,210 @@
+import atexit
+import json
+import logging
+import os
+import threading
+from django.conf import settings
+from openpyxl import load_workbook
+from . import disco
+from .disco import travar
+from .metricas import medir
+from .planilha import COLUNAS_CAMPOS
+from .sincronizacao import salvar_planilha
+
+logger = logging.getLogger(__name__)
+
+# Diário (journal) das alterações feitas no moldes.xlsx no modo 'planilha'.
+#
+# Cada alteração é gravada em um arquivo só de acréscimos ao lado da
+# planilha (moldes.xlsx.diario, uma linha JSON por campo alterado) e a
+# requisição já recebe a resposta. Uma thread de gravação junta o que chegou
+# a cada poucos segundos, aplica tudo de uma vez na planilha (a última
+# alteração de cada campo vence), grava em um arquivo temporário e troca com
+# rename atômico; só então as entradas saem do diário. Se o processo cair no
+# meio, as entradas que sobraram são aplicadas de novo ao iniciar.
+#
+# O diário tem um único dono: o primeiro processo que precisa dele (o
+# servidor, ao iniciar, pelo wsgi.py/asgi.py) pega uma trava
+# (moldes.xlsx.diario.trava) que fica com ele até encerrar, reaplica o que
+# sobrou e é o único a gravar a planilha. Comandos que só leem (check,
+# servico_render, preaquecer) não mexem no diário; outro processo que tente
+# gravar recebe DiarioOcupado. Rode o servidor com um único processo no modo
+# 'planilha' (ou use o modo 'banco' com vários processos).
+
+
+class DiarioOcupado(Exception):
+    pass
+
+
+class DiarioPlanilha:
+    def __init__(self, caminho_planilha):
+        self.caminho_planilha = caminho_planilha
+        self.caminho = caminho_planilha + '.diario'
+        self._lock = threading.Lock()
+        self._pendentes = []
+        self._thread = None
+        self._parar = threading.Event()
+        # Trava de dono do diário (None enquanto este processo não é o dono)
+        self._trava = None
+        # Chamado depois de cada gravação com a assinatura do arquivo anterior
+        self.ao_gravar = None
+
+    # Registra as alterações no diário e devolve assim que estiverem em disco.
+    # alteracoes: {número da linha: {campo: True/False}}
+    def registrar(self, aba, alteracoes):
+        entradas = [
+            {'aba': aba, 'linha': linha, 'campo': campo, 'valor': valor}
+            for linha, campos in alteracoes.items()
+            for campo, valor in campos.items()
+        ]
+        if not self.assumir():
+            raise DiarioOcupado(
+                f"Outro processo está gravando {self.caminho_planilha}; no modo 'planilha' "
+                "rode o servidor com um único processo."
+            )
+        with self._lock:
+            with open(self.caminho, 'a', encoding='utf-8') as f:
+                for entrada in entradas:
+                    f.write(json.dumps(entrada, ensure_ascii=False) + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+            self._pendentes.extend(entradas)
+        self._iniciar()
+
+    # Alterações ainda não gravadas na planilha para uma aba, já combinadas:
+    # {número da linha: {campo: valor}}
+    def pendentes(self, aba):
+        with self._lock:
+            return _combinar(e for e in self._pendentes if e['aba'] == aba).get(aba, {})
+
+    # Torna este processo o dono do diário, se nenhum outro for, e reaplica
+    # o que uma execução anterior deixou pendente. Devolve True se é o dono.
+    def assumir(self):
+        with self._lock:
+            if self._trava is not None:
+                return True
+            trava = travar(self.caminho + '.trava')
+            if trava is None:
+                return False
+            self._trava = trava
+            entradas = self._ler()
+            self._pendentes = entradas + self._pendentes
+        if entradas:
+            logger.info("Reaplicando %s alteração(ões) pendentes do diário.", len(entradas))
+            self._iniciar()
+        return True
+
+    # Chamado ao iniciar o servidor (armazenamento.iniciar_servidor)
+    def recuperar(self):
+        if not self.assumir():
+            logger.warning(
+                "O diário de %s está com outro processo; este não vai gravar a planilha.",
+                self.caminho_planilha,
+            )
+
+    # Entradas deixadas no arquivo do diário
+    def _ler(self):
+        if not os.path.exists(self.caminho):
+            return []
+        entradas = []
+        with open(self.caminho, encoding='utf-8') as f:
+            for numero, texto in enumerate(f, start=1):
+                try:
+                    entradas.append(json.loads(texto))
+                except ValueError:
+                    # Linha cortada por uma queda no meio da escrita
+                    logger.warning("Entrada %s do diário ignorada: %r", numero, texto)
+        return entradas
+
+    def _iniciar(self):
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._laco, name='diario-planilha', daemon=True)
+            self._thread.start()
+
+    def _laco(self):
+        intervalo = getattr(settings, 'DIARIO_INTERVALO', 2)
+        while not self._parar.wait(intervalo):
+            try:
+                self.gravar()
+            except Exception:
+                # Mantém as entradas no diário e tenta de novo no próximo ciclo
+                # (ex.: planilha aberta no Excel no Windows)
+                logger.exception("Erro ao gravar o diário em %s", self.caminho_planilha)
+
+    # Aplica na planilha tudo o que está pendente e tira do diário
+    def gravar(self):
+        with self._lock:
+            lote = list(self._pendentes)
+        if not lote:
+            return 0
+
+        assinatura_anterior = disco.assinatura(self.caminho_planilha)
+        with medir('planilha_gravar'):
+            wb = load_workbook(self.caminho_planilha)
+            for aba, linhas in _combinar(lote).items():
+                if aba not in wb.sheetnames:
+                    logger.warning("Aba %r do diário não existe mais na planilha.", aba)
+                    continue
+                ws = wb[aba]
+                for linha, campos in linhas.items():
+                    for campo, valor in campos.items():
+                        ws.cell(row=linha, column=COLUNAS_CAMPOS[campo]).value = '☑' if valor else ''
+            salvar_planilha(wb, self.caminho_planilha)
+
+        # Tira do diário só o que foi aplicado; o que chegou durante a gravação fica
+        with self._lock:
+            self._pendentes = self._pendentes[len(lote):]
+            _reescrever(self.caminho, self._pendentes)
+        if self.ao_gravar is not None:
+            self.ao_gravar(assinatura_anterior)
+        return len(lote)
+
+    # Grava o que estiver pendente e para a thread (usado ao encerrar o processo)
+    def encerrar(self):
+        self._parar.set()
+        if self._trava is None:
+            return
+        try:
+            self.gravar()
+        except Exception:
+            logger.exception("Erro ao gravar o diário ao encerrar; as entradas ficam para a próxima execução")
+
+
+# Junta as entradas por aba e linha; a última alteração de cada campo vence
+def _combinar(entradas):
+    combinadas = {}
+    for entrada in entradas:
+        linhas = combinadas.setdefault(entrada['aba'], {})
+        linhas.setdefault(entrada['linha'], {})[entrada['campo']] = entrada['valor']
+    return combinadas
+
+
+def _reescrever(caminho, entradas):
+    if not entradas:
+        if os.path.exists(caminho):
+            os.remove(caminho)
+        return
+    temporario = caminho + '.tmp'
+    with open(temporario, 'w', encoding='utf-8') as f:
+        for entrada in entradas:
+            f.write(json.dumps(entrada, ensure_ascii=False) + '\n')
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temporario, caminho)
+
+
+_diarios = {}
+_diarios_lock = threading.Lock()
+
+
+# Diário único por planilha, compartilhado pelo processo
+def diario_da_planilha(caminho):
+    caminho = os.path.abspath(caminho)
+    with _diarios_lock:
+        if caminho not in _diarios:
+            diario = DiarioPlanilha(caminho)
+            atexit.register(diario.encerrar)
+            _diarios[caminho] = diario
+        return _diarios[caminho]
@@ -0,0 +1,63 @@
+import os
+import stat
+import tempfile
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+# Operações em disco usadas pelos armazenamentos (planilha, diário e arquivos
+# dos moldes) e pelos comandos.
+
+# Permissões de um arquivo novo, como o open() criaria
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
+
+# Identidade do arquivo em disco; muda quando alguém grava ou troca o arquivo
+def assinatura(caminho):
+    info = os.stat(caminho)
+    return (info.st_dev, info.st_ino, info.st_mtime_ns, info.st_size)
+
+
+# Grava um arquivo inteiro sem ninguém ver ele pela metade: escrever(temporario)
+# grava um arquivo temporário na mesma pasta, que depois toma o lugar do
+# original com rename atômico. O arquivo novo fica com as permissões do
+# original (o mkstemp cria com 0600, e outros usuários deixariam de ler).
+def gravar_atomico(caminho, escrever, sufixo='.tmp'):
+    pasta = os.path.dirname(os.path.abspath(caminho))
+    descritor, temporario = tempfile.mkstemp(suffix=sufixo, dir=pasta)
+    os.close(descritor)
+    try:
+        escrever(temporario)
+        os.chmod(temporario, _permissoes(caminho))
+        os.replace(temporario, caminho)
+    except BaseException:
+        if os.path.exists(temporario):
+            os.remove(temporario)
+        raise
+
+
+def _permissoes(caminho):
+    try:
+        return stat.S_IMODE(os.stat(caminho).st_mode)
+    except FileNotFoundError:
+        return 0o666 & ~_UMASK
+
+
+# Trava exclusiva enquanto o processo viver (o sistema a libera se ele
+# morrer). Devolve o arquivo aberto, ou None se outro processo tem a trava.
+def travar(caminho):
+    arquivo = open(caminho, 'a+')
+    try:
+        if fcntl is not None:
+            fcntl.flock(arquivo.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:
+            arquivo.seek(0)
+            msvcrt.locking(arquivo.fileno(), msvcrt.LK_NBLCK, 1)
+    except OSError:
+        arquivo.close()
+        return None
+    return arquivo
@@ -0,0 +1,113 @@
+import asyncio
+import contextvars
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.db import close_old_connections
+from django.http import HttpResponse
+
+# Threads usadas pelas views assíncronas para o trabalho que bloqueia
+# (openpyxl, disco, banco). Rodando pelo asgi.py, o processo atende muitas
+# requisições ao mesmo tempo e só essas threads ficam presas em E/S:
+#   leitura  - várias threads, para páginas e consultas
+#   gravacao - uma única thread, para as gravações saírem uma de cada vez
+# Cada executor aceita um número máximo de tarefas (rodando + esperando);
+# acima disso a requisição recebe 503 na hora em vez de ficar na fila.
+
+
+class Sobrecarregado(Exception):
+    pass
+
+
+class ExecutorLimitado:
+    def __init__(self, nome, threads, limite):
+        self.nome = nome
+        self.limite = limite
+        self._executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix=nome)
+        self._lock = threading.Lock()
+        self._ocupadas = 0
+
+    # Tarefas rodando ou esperando uma thread livre
+    @property
+    def ocupadas(self):
+        return self._ocupadas
+
+    async def executar(self, funcao, *args, **kwargs):
+        with self._lock:
+            if self._ocupadas >= self.limite:
+                raise Sobrecarregado(self.nome)
+            self._ocupadas += 1
+        # A vaga só é liberada quando a thread termina, mesmo que a requisição
+        # tenha sido cancelada antes (cliente desconectou)
+        contexto = contextvars.copy_context()
+        futuro = self._executor.submit(contexto.run, _com_conexao, funcao, *args, **kwargs)
+        futuro.add_done_callback(self._liberar)
+        return await asyncio.wrap_future(futuro)
+
+    def _liberar(self, futuro):
+        with self._lock:
+            self._ocupadas -= 1
+
+
+# As threads dos executores não passam pelo ciclo de requisição do Django;
+# fecha a conexão com o banco se ela expirou ou deu erro, como o Django faz
+# no fim de cada requisição
+def _com_conexao(funcao, *args, **kwargs):
+    close_old_connections()
+    try:
+        return funcao(*args, **kwargs)
+    finally:
+        close_old_connections()
+
+
+_executores = {}
+_executores_lock = threading.Lock()
+
+
+def _obter(nome, threads, limite):
+    with _executores_lock:
+        if nome not in _executores:
+            _executores[nome] = ExecutorLimitado(nome, threads, limite)
+        return _executores[nome]
+
+
+def leitura():
+    return _obter(
+        'leitura',
+        getattr(settings, 'EXECUTOR_LEITURA_THREADS', 8),
+        getattr(settings, 'EXECUTOR_LEITURA_FILA', 64),
+    )
+
+
+def gravacao():
+    return _obter('gravacao', 1, getattr(settings, 'EXECUTOR_GRAVACAO_FILA', 32))
+
+
+# Atalhos usados pelas views: await ler(funcao, ...) / await gravar(funcao, ...)
+async def ler(funcao, *args, **kwargs):
+    return await leitura().executar(funcao, *args, **kwargs)
+
+
+async def gravar(funcao, *args, **kwargs):
+    return await gravacao().executar(funcao, *args, **kwargs)
+
+
+# Indica se a requisição chegou pelo asgi.py. No WSGI (e no runserver) uma
+# resposta assíncrona é lida inteira antes de sair o primeiro byte.
+def pelo_asgi(request):
+    return isinstance(request, ASGIRequest)
+
+
+# Decorador das views assíncronas: executor cheio vira 503 com Retry-After
+def recusar_se_sobrecarregado(view):
+    @functools.wraps(view)
+    async def envolvida(request, *args, **kwargs):
+        try:
+            return await view(request, *args, **kwargs)
+        except Sobrecarregado:
+            resposta = HttpResponse("Servidor ocupado, tente novamente em instantes.", status=503)
+            resposta['Retry-After'] = '2'
+            return resposta
+    return envolvida
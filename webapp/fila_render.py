@@ -0,0 +1,395 @@
+import hashlib
+import json
+import os
+import sqlite3
+import time
+from contextlib import contextmanager
+from django.conf import settings
+
+# Fila de renderização e manifesto dos previews STEP, guardados em um SQLite
+# próprio ao lado das imagens. A view só enfileira e lê resultados; quem
+# renderiza é o comando "python manage.py servico_render", com um número fixo
+# de processos.
+#
+# Cada linha guarda o tamanho e a data do .stp vistos na última listagem e a
+# chave do preview gerado (hash do conteúdo + tamanho + configuração de
+# renderização). Se a data mudar mas o conteúdo não (cópia entre pastas de
+# rede, por exemplo), o serviço só confere o hash e não renderiza de novo.
+
+# Estados possíveis de um job
+PENDENTE = 'pendente'
+PROCESSANDO = 'processando'
+PRONTO = 'pronto'
+ERRO = 'erro'
+
+# Extensões das imagens geradas (PNG e as variantes WebP/JPEG)
+EXTENSOES_IMAGEM = ('.png', '.webp', '.jpg')
+
+# Modelos que ainda não têm preview passam na frente das atualizações
+PRIORIDADE_NOVO = 10
+PRIORIDADE_ATUALIZACAO = 0
+
+# Contadores acumulados pelos processos do serviço (expostos em /metrics)
+CONTADORES = {
+    'previews_renderizados_total': 'Previews renderizados.',
+    'previews_reaproveitados_total': 'Previews reaproveitados sem renderizar (mesmo conteúdo).',
+    'previews_erros_total': 'Previews que falharam.',
+    'previews_renderizacao_segundos_total': 'Tempo total gasto renderizando previews.',
+}
+
+_tabelas_criadas = set()
+
+
+# Abre uma conexão com a fila (cria o arquivo e as tabelas se precisar)
+def conectar():
+    caminho = settings.PREVIEWS_FILA
+    os.makedirs(os.path.dirname(caminho), exist_ok=True)
+    conexao = sqlite3.connect(caminho, timeout=30, isolation_level=None)
+    conexao.row_factory = sqlite3.Row
+
+    if caminho not in _tabelas_criadas:
+        conexao.execute('PRAGMA journal_mode=WAL')
+        conexao.execute('''
+            CREATE TABLE IF NOT EXISTS jobs (
+                arquivo TEXT PRIMARY KEY,
+                estado TEXT NOT NULL,
+                prioridade INTEGER NOT NULL DEFAULT 0,
+                mtime REAL NOT NULL DEFAULT 0,
+                imagem TEXT,
+                erro TEXT,
+                tentativas INTEGER NOT NULL DEFAULT 0,
+                pid INTEGER,
+                tempos TEXT,
+                tamanho INTEGER,
+                chave TEXT,
+                atualizado_em REAL NOT NULL
+            )
+        ''')
+        # Filas criadas antes de algumas colunas existirem
+        colunas = {row['name'] for row in conexao.execute('PRAGMA table_info(jobs)')}
+        for coluna, tipo in (('tempos', 'TEXT'), ('tamanho', 'INTEGER'), ('chave', 'TEXT')):
+            if coluna not in colunas:
+                conexao.execute(f'ALTER TABLE jobs ADD COLUMN {coluna} {tipo}')
+        conexao.execute(
+            'CREATE INDEX IF NOT EXISTS jobs_fila ON jobs (estado, prioridade DESC, mtime DESC)'
+        )
+        conexao.execute('CREATE INDEX IF NOT EXISTS jobs_chave ON jobs (chave)')
+        conexao.execute('CREATE INDEX IF NOT EXISTS jobs_atualizado ON jobs (atualizado_em)')
+        conexao.execute('CREATE INDEX IF NOT EXISTS jobs_imagem ON jobs (imagem)')
+        conexao.execute('''
+            CREATE TABLE IF NOT EXISTS contadores (
+                nome TEXT PRIMARY KEY,
+                valor REAL NOT NULL DEFAULT 0
+            )
+        ''')
+        _tabelas_criadas.add(caminho)
+    return conexao
+
+
+# Conexão de curta duração; com transacao=True trava a fila para escrita
+@contextmanager
+def abrir(transacao=False):
+    conexao = conectar()
+    try:
+        if transacao:
+            conexao.execute('BEGIN IMMEDIATE')
+        yield conexao
+        if transacao:
+            conexao.execute('COMMIT')
+    except BaseException:
+        if conexao.in_transaction:
+            conexao.execute('ROLLBACK')
+        raise
+    finally:
+        conexao.close()
+
+
+# Assinatura da configuração de renderização; mudar tamanho, transparência
+# etc. invalida todos os previews
+def assinatura_config():
+    config = json.dumps(settings.PREVIEWS_RENDER, sort_keys=True)
+    return hashlib.sha1(config.encode()).hexdigest()[:8]
+
+
+# Nome da imagem gerada para um arquivo .stp: o mesmo caminho relativo com
+# extensão .png, dentro da pasta de previews
+# (ex.: MOLDE A/1001.stp -> previews/MOLDE A/1001.png)
+def nome_imagem(arquivo):
+    return os.path.splitext(arquivo)[0] + '.png'
+
+
+# Versões menores geradas junto com cada imagem (ex.: 1001-160.webp)
+def nomes_variantes(imagem):
+    base = os.path.splitext(imagem)[0]
+    return [
+        f'{base}-{largura}.{extensao}'
+        for largura in settings.PREVIEWS_RENDER['larguras']
+        for extensao in ('webp', 'jpg')
+    ]
+
+
+# Hash do conteúdo de um arquivo, lido em blocos para não carregar tudo na memória
+def hash_arquivo(caminho, tamanho_bloco=1024 * 1024):
+    h = hashlib.sha1()
+    with open(caminho, 'rb') as f:
+        for bloco in iter(lambda: f.read(tamanho_bloco), b''):
+            h.update(bloco)
+    return h.hexdigest()
+
+
+# Chave do preview: só muda se a geometria ou a configuração mudarem
+def chave_preview(hash_conteudo, tamanho):
+    return f'{hash_conteudo}:{tamanho}:{assinatura_config()}'
+
+
+# Versão curta do preview, usada na URL das imagens (?v=...): muda só quando a
+# imagem muda, então o navegador pode guardá-las sem revalidar
+def versao_preview(chave):
+    return hashlib.sha1(chave.encode()).hexdigest()[:12] if chave else ''
+
+
+# Indica se o preview registrado continua valendo para o arquivo como está
+# agora em disco (mesmo tamanho, mesma data e mesma configuração)
+def em_dia(job, tamanho, mtime):
+    return (
+        job['tamanho'] == tamanho
+        and job['mtime'] == mtime
+        and job['chave'] is not None
+        and job['chave'].endswith(':' + assinatura_config())
+    )
+
+
+# Prioridade com que um modelo deve (voltar a) entrar na fila, ou None se o
+# preview registrado continua valendo. job: registro da fila (None para
+# arquivo novo). Tamanho, data ou configuração diferentes voltam para a fila,
+# e o serviço confere o hash do conteúdo antes de renderizar de novo; arquivos
+# com erro só voltam se forem alterados.
+def prioridade_na_fila(job, tamanho, mtime):
+    if job is None:
+        return PRIORIDADE_NOVO
+    if job['estado'] == PRONTO:
+        desatualizado = not em_dia(job, tamanho, mtime)
+    elif job['estado'] == ERRO:
+        desatualizado = (job['tamanho'], job['mtime']) != (tamanho, mtime)
+    else:
+        desatualizado = False
+    return PRIORIDADE_ATUALIZACAO if desatualizado else None
+
+
+# Lê o estado de todos os jobs em uma única consulta
+def estados():
+    with abrir() as conexao:
+        return {row['arquivo']: dict(row) for row in conexao.execute('SELECT * FROM jobs')}
+
+
+# Quantidade de jobs em cada estado: {estado: quantidade}
+def quantidades_por_estado():
+    with abrir() as conexao:
+        return {
+            row['estado']: row['quantidade']
+            for row in conexao.execute('SELECT estado, COUNT(*) AS quantidade FROM jobs GROUP BY estado')
+        }
+
+
+# Jobs alterados depois do instante indicado (atualizado_em), para as páginas
+# acompanharem a renderização. Devolve (jobs, instante da última alteração).
+def alterados_desde(instante):
+    with abrir() as conexao:
+        jobs = [dict(row) for row in conexao.execute(
+            'SELECT * FROM jobs WHERE atualizado_em > ? ORDER BY atualizado_em', (instante,)
+        )]
+    return jobs, (jobs[-1]['atualizado_em'] if jobs else instante)
+
+
+# Estado só dos arquivos pedidos (como estados()), em poucas consultas
+def estados_de(arquivos):
+    arquivos = list(arquivos)
+    resultado = {}
+    with abrir() as conexao:
+        # Em blocos, abaixo do limite de parâmetros do SQLite
+        for inicio in range(0, len(arquivos), 500):
+            bloco = arquivos[inicio:inicio + 500]
+            marcadores = ', '.join('?' * len(bloco))
+            for row in conexao.execute(f'SELECT * FROM jobs WHERE arquivo IN ({marcadores})', bloco):
+                resultado[row['arquivo']] = dict(row)
+    return resultado
+
+
+# Versões (versao_preview) registradas para uma imagem de preview; mais de
+# uma quando arquivos com a mesma geometria dividem a imagem
+def versoes_da_imagem(imagem):
+    with abrir() as conexao:
+        return {
+            versao_preview(row['chave'])
+            for row in conexao.execute(
+                'SELECT chave FROM jobs WHERE imagem = ? AND chave IS NOT NULL', (imagem,)
+            )
+        }
+
+
+# Coloca arquivos na fila; um arquivo já pendente ou em processamento não é
+# duplicado, só tem a prioridade aumentada se for o caso. Um job em
+# processamento mantém o tamanho e a data do arquivo que está sendo
+# renderizado: se o arquivo mudou no meio, o preview concluído não fica em
+# dia (em_dia) e a próxima listagem coloca o arquivo na fila de novo.
+def enfileirar(jobs):
+    # jobs: lista de (arquivo, tamanho, mtime, prioridade)
+    agora = time.time()
+    with abrir(transacao=True) as conexao:
+        conexao.executemany('''
+            INSERT INTO jobs (arquivo, estado, prioridade, tamanho, mtime, atualizado_em)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT (arquivo) DO UPDATE SET
+                estado = CASE WHEN jobs.estado = 'processando' THEN jobs.estado ELSE excluded.estado END,
+                prioridade = MAX(jobs.prioridade, excluded.prioridade),
+                tamanho = CASE WHEN jobs.estado = 'processando' THEN jobs.tamanho ELSE excluded.tamanho END,
+                mtime = CASE WHEN jobs.estado = 'processando' THEN jobs.mtime ELSE excluded.mtime END,
+                erro = NULL,
+                atualizado_em = excluded.atualizado_em
+        ''', [
+            (arquivo, PENDENTE, prioridade, tamanho, mtime, agora)
+            for arquivo, tamanho, mtime, prioridade in jobs
+        ])
+
+
+# Pega o próximo job pendente (maior prioridade, modelo mais novo primeiro)
+def reservar(pid=None):
+    with abrir(transacao=True) as conexao:
+        row = conexao.execute('''
+            SELECT * FROM jobs WHERE estado = ?
+            ORDER BY prioridade DESC, mtime DESC LIMIT 1
+        ''', (PENDENTE,)).fetchone()
+        if row is None:
+            return None
+        conexao.execute('''
+            UPDATE jobs SET estado = ?, tentativas = tentativas + 1, pid = ?, atualizado_em = ?
+            WHERE arquivo = ?
+        ''', (PROCESSANDO, pid, time.time(), row['arquivo']))
+        return dict(row)
+
+
+# chave: chave do preview gerado; tempos: segundos gastos em cada etapa da
+# renderização (None quando o preview foi reaproveitado)
+def concluir(arquivo, imagem, chave, tempos=None):
+    with abrir(transacao=True) as conexao:
+        conexao.execute('''
+            UPDATE jobs SET estado = ?, imagem = ?, chave = ?, erro = NULL, prioridade = 0,
+                tempos = COALESCE(?, tempos), atualizado_em = ?
+            WHERE arquivo = ?
+        ''', (PRONTO, imagem, chave, json.dumps(tempos) if tempos else None, time.time(), arquivo))
+        if tempos:
+            _contar(conexao, 'previews_renderizados_total')
+            _contar(conexao, 'previews_renderizacao_segundos_total', sum(tempos.values()))
+        else:
+            _contar(conexao, 'previews_reaproveitados_total')
+
+
+# Imagem de outro arquivo com exatamente a mesma geometria e configuração
+def imagem_com_chave(chave):
+    with abrir() as conexao:
+        row = conexao.execute(
+            'SELECT imagem FROM jobs WHERE chave = ? AND estado = ? LIMIT 1', (chave, PRONTO)
+        ).fetchone()
+    return row['imagem'] if row else None
+
+
+def falhar(arquivo, erro):
+    with abrir(transacao=True) as conexao:
+        conexao.execute('''
+            UPDATE jobs SET estado = ?, erro = ?, prioridade = 0, atualizado_em = ?
+            WHERE arquivo = ?
+        ''', (ERRO, str(erro), time.time(), arquivo))
+        _contar(conexao, 'previews_erros_total')
+
+
+# O processo morreu no meio do job (ex.: falha dentro da OCC); marca como erro
+# para o mesmo arquivo não derrubar o serviço em loop
+def abandonar(pid):
+    with abrir(transacao=True) as conexao:
+        cursor = conexao.execute('''
+            UPDATE jobs SET estado = ?, erro = ?, prioridade = 0, atualizado_em = ?
+            WHERE estado = ? AND pid = ?
+        ''', (ERRO, 'Processo de renderização encerrado durante o job', time.time(), PROCESSANDO, pid))
+        if cursor.rowcount:
+            _contar(conexao, 'previews_erros_total', cursor.rowcount)
+
+
+def _contar(conexao, nome, valor=1):
+    conexao.execute('''
+        INSERT INTO contadores (nome, valor) VALUES (?, ?)
+        ON CONFLICT (nome) DO UPDATE SET valor = valor + excluded.valor
+    ''', (nome, valor))
+
+
+# Valores atuais dos contadores: {nome: valor}
+def contadores():
+    with abrir() as conexao:
+        return {row['nome']: row['valor'] for row in conexao.execute('SELECT nome, valor FROM contadores')}
+
+
+# Jobs que um processo encerrado deixou "processando" voltam para a fila
+# (usado pelo preaquecer, que sabe quais processos eram seus)
+def devolver(pid):
+    with abrir() as conexao:
+        conexao.execute(
+            'UPDATE jobs SET estado = ? WHERE estado = ? AND pid = ?', (PENDENTE, PROCESSANDO, pid)
+        )
+
+
+# Jobs que ficaram "processando" porque o serviço caiu voltam para a fila
+def recuperar_interrompidos():
+    with abrir() as conexao:
+        conexao.execute(
+            'UPDATE jobs SET estado = ? WHERE estado = ?', (PENDENTE, PROCESSANDO)
+        )
+
+
+# Tempo médio e total de cada etapa nos previews já renderizados
+def resumo_tempos():
+    resumo = {}
+    with abrir() as conexao:
+        for row in conexao.execute('SELECT tempos FROM jobs WHERE tempos IS NOT NULL'):
+            for etapa, segundos in json.loads(row['tempos']).items():
+                total, quantidade = resumo.get(etapa, (0.0, 0))
+                resumo[etapa] = (total + segundos, quantidade + 1)
+    return {
+        etapa: {'total': total, 'media': total / quantidade, 'jobs': quantidade}
+        for etapa, (total, quantidade) in resumo.items()
+    }
+
+
+# Tira do manifesto os arquivos .stp que não existem mais e apaga os previews
+# deles. Com apagar_soltos=True também apaga imagens da pasta de previews que
+# não pertencem a nenhum arquivo do manifesto; o resto da pasta (a própria
+# fila, a trava e o estado do preaquecer, temporários) fica onde está.
+def coletar_orfaos(arquivos_existentes, pasta_previews, apagar_soltos=False):
+    arquivos_existentes = set(arquivos_existentes)
+    with abrir(transacao=True) as conexao:
+        orfaos = [
+            (row['arquivo'], row['imagem']) for row in conexao.execute('SELECT arquivo, imagem FROM jobs')
+            if row['arquivo'] not in arquivos_existentes
+        ]
+        conexao.executemany('DELETE FROM jobs WHERE arquivo = ?', [(a,) for a, _ in orfaos])
+        imagens_usadas = set()
+        for row in conexao.execute('SELECT imagem FROM jobs WHERE imagem IS NOT NULL'):
+            imagens_usadas.add(row['imagem'])
+            imagens_usadas.update(nomes_variantes(row['imagem']))
+
+    apagadas = []
+    if apagar_soltos:
+        candidatas = [
+            os.path.relpath(os.path.join(diretorio, nome), pasta_previews).replace(os.sep, '/')
+            for diretorio, _, nomes in os.walk(pasta_previews)
+            for nome in nomes
+            if nome.lower().endswith(EXTENSOES_IMAGEM)
+        ]
+    else:
+        candidatas = [nome for _, imagem in orfaos if imagem for nome in [imagem, *nomes_variantes(imagem)]]
+    for nome in candidatas:
+        if nome in imagens_usadas:
+            continue
+        caminho = os.path.join(pasta_previews, nome)
+        if os.path.isfile(caminho):
+            os.remove(caminho)
+            apagadas.append(nome)
+    return [a for a, _ in orfaos], apagadas
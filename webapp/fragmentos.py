@@ -0,0 +1,259 @@
+import json
+import os
+import threading
+from openpyxl import Workbook, load_workbook
+from .consulta import IndiceAba
+from . import disco
+from .metricas import medir
+from .models import CAMPOS_CHECKBOX
+from .planilha import COLUNAS, LinhaMolde
+from .sincronizacao import colunas_extras, salvar_planilha, valores_da_linha
+from .status import calcular_status, classificar
+
+# Dados dos moldes em um arquivo por molde (modo 'fragmentos'), ao lado das
+# pastas de modelos: media/modelos/<molde>.molde.json. Ler ou salvar um molde
+# só mexe no arquivo dele, então o custo não cresce com a quantidade de moldes
+# da fábrica, como acontece com as abas do moldes.xlsx.
+#
+# Formato (JSON compacto):
+#   {"versao": 1, "molde": "MOLDE A", "ordem": 0, "cabecalho": [...],
+#    "linhas": [[2, "1001", 3], [3, "1002", 0, {"A": 7}], ...]}
+# Cada linha é [número da linha na planilha, código, checkboxes, colunas extras];
+# os checkboxes são bits na ordem de CAMPOS_CHECKBOX (1 = chegada do aço,
+# 2 = programa, 4 = máquina 1, ...) e as colunas extras (por letra, como em
+# Item.colunas_extras) só aparecem quando existem.
+#
+# Cada gravação troca o arquivo inteiro do molde com rename atômico. Como no
+# modo 'planilha', rode o servidor com um único processo.
+
+EXTENSAO = '.molde.json'
+VERSAO_FORMATO = 1
+
+
+def caminho_fragmento(pasta, molde):
+    return os.path.join(pasta, molde + EXTENSAO)
+
+
+# Conteúdo de um arquivo de molde já convertido para LinhaMolde
+class Fragmento:
+    def __init__(self, molde, ordem=0, cabecalho=None, linhas=None, extras=None):
+        self.molde = molde
+        self.ordem = ordem
+        self.cabecalho = cabecalho or []
+        self.linhas = linhas or []
+        # {número da linha: {letra: valor}}
+        self.extras = extras or {}
+        # Identidade do arquivo em disco quando foi lido ou gravado
+        self.assinatura = None
+
+
+def _linha_molde(registro):
+    numero, codigo, marcados = registro[:3]
+    valores = [None] * COLUNAS
+    valores[1] = codigo
+    for bit in range(len(CAMPOS_CHECKBOX)):
+        valores[3 + bit] = marcados >> bit & 1
+    return LinhaMolde(numero, valores)
+
+
+def ler_fragmento(caminho):
+    with medir('fragmento_ler'):
+        assinatura = disco.assinatura(caminho)
+        with open(caminho, encoding='utf-8') as f:
+            dados = json.load(f)
+        fragmento = Fragmento(
+            dados['molde'], dados.get('ordem', 0), dados.get('cabecalho'),
+            [_linha_molde(registro) for registro in dados['linhas']],
+            {registro[0]: registro[3] for registro in dados['linhas'] if len(registro) > 3},
+        )
+    classificar(fragmento.linhas)
+    fragmento.assinatura = assinatura
+    return fragmento
+
+
+def _registro(linha, extras):
+    marcados = 0
+    for bit, campo in enumerate(CAMPOS_CHECKBOX):
+        if getattr(linha, campo):
+            marcados |= 1 << bit
+    codigo = linha.item
+    if codigo is not None and not isinstance(codigo, (str, int, float)):
+        codigo = str(codigo)
+    registro = [linha.linha, codigo, marcados]
+    if extras:
+        registro.append(extras)
+    return registro
+
+
+# Grava o arquivo do molde (temporário + rename atômico) e devolve a
+# assinatura do arquivo novo
+def gravar_fragmento(caminho, fragmento):
+    dados = {
+        'versao': VERSAO_FORMATO,
+        'molde': fragmento.molde,
+        'ordem': fragmento.ordem,
+        'cabecalho': fragmento.cabecalho,
+        'linhas': [_registro(linha, fragmento.extras.get(linha.linha)) for linha in fragmento.linhas],
+    }
+
+    def escrever(temporario):
+        with open(temporario, 'w', encoding='utf-8') as f:
+            json.dump(dados, f, ensure_ascii=False, separators=(',', ':'))
+            f.flush()
+            os.fsync(f.fileno())
+
+    with medir('fragmento_gravar'):
+        disco.gravar_atomico(caminho, escrever)
+    return disco.assinatura(caminho)
+
+
+# Cache dos arquivos de molde de uma pasta, com a mesma interface do
+# planilha.CachePlanilha. Cada molde é lido na primeira vez que alguém o abre
+# e lido de novo só se o arquivo dele mudar em disco.
+class CacheFragmentos:
+    def __init__(self, pasta):
+        self.pasta = pasta
+        self._lock = threading.Lock()
+        self._mtime_pasta = None
+        self._abas = None
+        # {molde: Fragmento}
+        self._fragmentos = {}
+        self._indices = {}
+        # Muda toda vez que algum molde é alterado por fora da aplicação
+        self.geracao = 0
+
+    def existe(self):
+        return bool(self.abas())
+
+    # Nomes dos moldes, lidos só da listagem da pasta (sem abrir os arquivos)
+    def abas(self):
+        with self._lock:
+            try:
+                mtime = os.stat(self.pasta).st_mtime_ns
+            except OSError:
+                return []
+            if self._abas is None or mtime != self._mtime_pasta:
+                abas = sorted(
+                    (entrada.name[:-len(EXTENSAO)] for entrada in os.scandir(self.pasta)
+                     if entrada.is_file() and entrada.name.endswith(EXTENSAO)),
+                    key=str.lower,
+                )
+                if self._abas is not None and abas != self._abas:
+                    self.geracao += 1
+                self._abas = abas
+                self._mtime_pasta = mtime
+            return self._abas
+
+    # Fragmento de um molde, lido de novo se o arquivo mudou desde a leitura
+    def _fragmento(self, aba):
+        caminho = caminho_fragmento(self.pasta, aba)
+        fragmento = self._fragmentos.get(aba)
+        if fragmento is not None and fragmento.assinatura == disco.assinatura(caminho):
+            return fragmento
+        if fragmento is not None:
+            self.geracao += 1
+            self._indices.pop(aba, None)
+        fragmento = self._fragmentos[aba] = ler_fragmento(caminho)
+        return fragmento
+
+    # Linhas (LinhaMolde) de um molde
+    def linhas(self, aba):
+        with self._lock:
+            return self._fragmento(aba).linhas
+
+    def indice(self, aba):
+        linhas = self.linhas(aba)
+        with self._lock:
+            indice = self._indices.get(aba)
+            if indice is None or indice.linhas is not linhas:
+                indice = self._indices[aba] = IndiceAba(linhas)
+            return indice
+
+    # Aplica as alterações nas linhas em cache e grava o arquivo do molde.
+    # Devolve o novo status de cada linha alterada.
+    # alteracoes: {número da linha: {campo: True/False}}
+    def aplicar(self, aba, alteracoes):
+        status = {}
+        with self._lock:
+            fragmento = self._fragmento(aba)
+            indice = self._indices.get(aba)
+            for linha in fragmento.linhas:
+                campos = alteracoes.get(linha.linha)
+                if campos:
+                    for campo, valor in campos.items():
+                        setattr(linha, campo, valor)
+                    linha.status_custom = calcular_status(linha)
+                    status[linha.linha] = linha.status_custom
+                    if indice is not None:
+                        indice.atualizar(linha)
+            if status:
+                fragmento.assinatura = gravar_fragmento(caminho_fragmento(self.pasta, aba), fragmento)
+        return status
+
+    # Confere todos os moldes já lidos (usado antes das contagens do painel)
+    def conferir(self):
+        for aba in self.abas():
+            with self._lock:
+                if aba in self._fragmentos:
+                    self._fragmento(aba)
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+# Cache único por pasta, compartilhado pelas views
+def cache_de_fragmentos(pasta):
+    pasta = os.path.abspath(pasta)
+    with _caches_lock:
+        if pasta not in _caches:
+            _caches[pasta] = CacheFragmentos(pasta)
+        return _caches[pasta]
+
+
+# Converte o moldes.xlsx em um arquivo por molde (uma aba = um molde).
+# Devolve {molde: quantidade de linhas}.
+def fragmentar_planilha(caminho_planilha, pasta):
+    os.makedirs(pasta, exist_ok=True)
+    resumo = {}
+    wb = load_workbook(caminho_planilha, read_only=True, data_only=True)
+    try:
+        for ordem, nome in enumerate(wb.sheetnames):
+            linhas = [
+                tuple(valores) + (None,) * (COLUNAS - len(valores))
+                for valores in wb[nome].iter_rows(max_col=COLUNAS, values_only=True)
+            ]
+            cabecalho = [None if valor is None else str(valor) for valor in (linhas[0] if linhas else ())]
+            fragmento = Fragmento(nome, ordem, cabecalho)
+            for numero, valores in enumerate(linhas[1:], start=2):
+                fragmento.linhas.append(LinhaMolde(numero, valores))
+                extras = colunas_extras(valores)
+                if extras:
+                    fragmento.extras[numero] = extras
+            gravar_fragmento(caminho_fragmento(pasta, nome), fragmento)
+            resumo[nome] = len(fragmento.linhas)
+    finally:
+        wb.close()
+    return resumo
+
+
+# Junta os arquivos de molde de volta em uma planilha (uma aba por molde, na
+# ordem da planilha original), para quem ainda trabalha com o Excel
+def exportar_fragmentos(pasta, caminho_planilha):
+    cache = cache_de_fragmentos(pasta)
+    fragmentos = [ler_fragmento(caminho_fragmento(pasta, aba)) for aba in cache.abas()]
+    wb = Workbook(write_only=True)
+    for fragmento in sorted(fragmentos, key=lambda fragmento: fragmento.ordem):
+        ws = wb.create_sheet(fragmento.molde)
+        ws.append(fragmento.cabecalho)
+        proxima_linha = 2
+        for linha in fragmento.linhas:
+            # Mantém o número de linha original, preenchendo buracos
+            while proxima_linha < linha.linha:
+                ws.append([])
+                proxima_linha += 1
+            marcados = [getattr(linha, campo) for campo in CAMPOS_CHECKBOX]
+            ws.append(valores_da_linha(linha.item, marcados, fragmento.extras.get(linha.linha, {})))
+            proxima_linha += 1
+    salvar_planilha(wb, caminho_planilha)
+    return len(fragmentos)
@@ -0,0 +1,57 @@
+from django.db.models import Max
+from .models import CAMPOS_CHECKBOX, Alteracao
+
+# Versões das alterações de cada molde, para as páginas abertas se manterem em
+# dia sem recarregar. Os dois armazenamentos registram aqui cada item
+# alterado (tabela Alteracao, no banco do Django também no modo planilha); a
+# página guarda a versão que já tem e pede só o que veio depois
+# (views.alteracoes_do_molde).
+
+# Alterações enviadas de uma vez; acima disso a página recarrega inteira
+LIMITE = 500
+
+
+# linhas: itens já alterados (Item ou LinhaMolde)
+def registrar(aba, linhas):
+    Alteracao.objects.bulk_create([
+        Alteracao(
+            molde=aba,
+            linha=linha.linha,
+            valores={campo: bool(getattr(linha, campo)) for campo in CAMPOS_CHECKBOX},
+            status=linha.status_custom,
+        )
+        for linha in linhas
+    ])
+
+
+# O molde inteiro mudou (ex.: importação da planilha): as páginas recarregam
+def registrar_recarga(aba):
+    Alteracao.objects.create(molde=aba, linha=None)
+
+
+# Última versão de um molde (0 se nunca foi alterado)
+def versao_atual(aba):
+    return Alteracao.objects.filter(molde=aba).aggregate(versao=Max('id'))['versao'] or 0
+
+
+# Alterações de um molde depois da versão indicada, só a mais recente de cada
+# linha. Devolve None se não houve nenhuma.
+def alteracoes_desde(aba, versao):
+    registros = list(
+        Alteracao.objects.filter(molde=aba, id__gt=versao).order_by('id')
+        .values('id', 'linha', 'valores', 'status')[:LIMITE + 1]
+    )
+    if not registros:
+        return None
+    if len(registros) > LIMITE or any(registro['linha'] is None for registro in registros):
+        return {'versao': versao_atual(aba), 'recarregar': True, 'alteracoes': []}
+
+    ultimas = {registro['linha']: registro for registro in registros}
+    return {
+        'versao': registros[-1]['id'],
+        'recarregar': False,
+        'alteracoes': [
+            {'linha': registro['linha'], 'status': registro['status'], 'valores': registro['valores']}
+            for registro in ultimas.values()
+        ],
+    }
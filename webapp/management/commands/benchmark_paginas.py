@@ -0,0 +1,172 @@
+import itertools
+import os
+import random
+import shutil
+import tempfile
+import time
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import Client
+from django.test.utils import override_settings, setup_test_environment, teardown_test_environment
+from webapp import fila_render
+from webapp.benchmark.geradores import gerar_modelos, gerar_planilha
+from webapp.benchmark.medicao import medir_view
+from webapp.consulta import itens_por_pagina
+from webapp.diario import diario_da_planilha
+from webapp.fragmentos import fragmentar_planilha
+from webapp.sincronizacao import importar_planilha
+
+MODOS = ('banco', 'planilha', 'fragmentos')
+
+
+class Command(BaseCommand):
+    help = ("Mede as páginas dos moldes, as gravações e a listagem de modelos com uma planilha "
+            "e peças STEP sintéticas (em uma pasta e um banco temporários).")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--abas', type=int, default=10, help="Moldes (abas) na planilha gerada.")
+        parser.add_argument('--linhas', type=int, default=500, help="Itens por aba.")
+        parser.add_argument('--densidade', type=float, default=0.5,
+                            help="Chance de cada checkbox de aço/programa estar marcado (0 a 1).")
+        parser.add_argument('--modelos', type=int, default=20,
+                            help="Peças STEP geradas (precisa da pythonocc-core; 0 para não gerar).")
+        parser.add_argument('--repeticoes', type=int, default=30, help="Requisições medidas por view.")
+        parser.add_argument('--modo', choices=[*MODOS, 'todos'], default='todos',
+                            help="Armazenamento medido (padrão: todos).")
+        parser.add_argument('--sem-renderizar', action='store_true',
+                            help="Não mede a renderização dos previews.")
+        parser.add_argument('--semente', type=int, default=1)
+        parser.add_argument('--manter', action='store_true', help="Não apaga a pasta temporária no fim.")
+
+    def handle(self, *args, **options):
+        pasta = tempfile.mkdtemp(prefix='benchmark_simoldes_')
+        pasta_modelos = os.path.join(pasta, 'modelos')
+        configuracao = dict(
+            MEDIA_ROOT=pasta,
+            PREVIEWS_FILA=os.path.join(pasta_modelos, 'previews', 'fila_render.sqlite3'),
+            # A exportação em segundo plano do modo banco não entra na medição
+            EXPORTACAO_PLANILHA_ATRASO=3600,
+        )
+        modos = MODOS if options['modo'] == 'todos' else (options['modo'],)
+
+        setup_test_environment()
+        banco_original = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            with override_settings(**configuracao):
+                caminho = os.path.join(pasta, 'moldes.xlsx')
+                inicio = time.perf_counter()
+                abas = gerar_planilha(caminho, options['abas'], options['linhas'],
+                                      options['densidade'], options['semente'])
+                self.stdout.write(f"Planilha: {len(abas)} aba(s) x {options['linhas']} linha(s) "
+                                  f"gerada em {time.perf_counter() - inicio:.1f}s")
+                modelos = self.gerar_modelos(pasta_modelos, abas, options)
+
+                for modo in modos:
+                    with override_settings(ARMAZENAMENTO_MOLDES=modo):
+                        self.medir_modo(modo, caminho, pasta_modelos, abas, options)
+
+                if modelos and not options['sem_renderizar']:
+                    self.medir_renderizacao()
+
+                # Grava o que o diário ainda tiver antes de apagar a pasta
+                diario_da_planilha(caminho).encerrar()
+        finally:
+            connection.creation.destroy_test_db(banco_original, verbosity=0)
+            teardown_test_environment()
+            if options['manter']:
+                self.stdout.write(f"Arquivos mantidos em {pasta}")
+            else:
+                shutil.rmtree(pasta, ignore_errors=True)
+
+    def gerar_modelos(self, pasta_modelos, abas, options):
+        os.makedirs(os.path.join(pasta_modelos, 'previews'), exist_ok=True)
+        if not options['modelos']:
+            return []
+        inicio = time.perf_counter()
+        try:
+            caminhos = gerar_modelos(pasta_modelos, abas, options['modelos'], options['semente'])
+        except ImportError:
+            self.stderr.write("pythonocc-core não instalada: peças STEP não geradas; "
+                              "a listagem de modelos é medida com a pasta vazia.")
+            return []
+        self.stdout.write(f"Modelos: {len(caminhos)} peça(s) STEP geradas em "
+                          f"{time.perf_counter() - inicio:.1f}s")
+        return caminhos
+
+    def medir_modo(self, modo, caminho, pasta_modelos, abas, options):
+        if modo == 'banco':
+            inicio = time.perf_counter()
+            importar_planilha(caminho)
+            self.stdout.write(f"Importação para o banco: {time.perf_counter() - inicio:.1f}s")
+        elif modo == 'fragmentos':
+            inicio = time.perf_counter()
+            fragmentar_planilha(caminho, pasta_modelos)
+            self.stdout.write(f"Conversão para um arquivo por molde: {time.perf_counter() - inicio:.1f}s")
+
+        cliente = Client()
+        sessao = cliente.session
+        sessao['usuario'] = 'admin'
+        sessao['permissao'] = 'admin'
+        sessao.save()
+
+        sorteio = random.Random(options['semente'])
+        # Cada requisição vai para o próximo molde, para os caches frios entrarem na conta
+        proxima_aba = itertools.cycle(abas).__next__
+        linhas_da_pagina = [str(numero) for numero in range(2, min(options['linhas'], itens_por_pagina()) + 2)]
+
+        def formulario(campos):
+            dados = {'nome_aba': proxima_aba(), 'linha': linhas_da_pagina}
+            for linha in linhas_da_pagina:
+                for campo in campos:
+                    if sorteio.random() < options['densidade']:
+                        dados[f'{campo}_{linha}'] = 'on'
+            return dados
+
+        maquinas = [f'maquina_{numero}' for numero in range(1, 7)]
+        views = [
+            ('pagina_principal', lambda: cliente.get(f'/pagina/{proxima_aba()}/')),
+            ('checklist', lambda: cliente.get(f'/checklist/{proxima_aba()}/')),
+            ('atualizar_status', lambda: cliente.post('/atualizar/', formulario(('chegada_aco', 'programa')))),
+            ('atualizar_status_checklist', lambda: cliente.post('/atualizar_checklist/', formulario(maquinas))),
+            ('listar_modelos_step', lambda: cliente.get('/modelos')),
+        ]
+
+        self.stdout.write('')
+        self.stdout.write(f"Modo {modo} ({options['repeticoes']} requisições por view)")
+        self.stdout.write(f"{'view':<28} {'1ª (ms)':>9} {'p50 (ms)':>9} {'p95 (ms)':>9} {'pico (MB)':>10}  status")
+        for nome, requisicao in views:
+            resultado = medir_view(requisicao, options['repeticoes'])
+            self.stdout.write(
+                f"{nome:<28} {resultado['primeira'] * 1000:>9.1f} {resultado['p50'] * 1000:>9.1f} "
+                f"{resultado['p95'] * 1000:>9.1f} {resultado['pico_memoria'] / 2 ** 20:>10.2f}  "
+                f"{','.join(map(str, resultado['status']))}"
+            )
+
+    # Renderiza no próprio processo os modelos que /modelos colocou na fila
+    def medir_renderizacao(self):
+        from webapp.previews import RenderizadorPreview, processar_preview
+
+        renderizador = RenderizadorPreview()
+        renderizados = 0
+        inicio = time.perf_counter()
+        while True:
+            job = fila_render.reservar(os.getpid())
+            if job is None:
+                break
+            try:
+                imagem, chave, tempos = processar_preview(job, renderizador)
+            except Exception as e:
+                fila_render.falhar(job['arquivo'], e)
+                continue
+            fila_render.concluir(job['arquivo'], imagem, chave, tempos)
+            renderizados += 1
+        duracao = time.perf_counter() - inicio
+
+        self.stdout.write('')
+        if not renderizados:
+            self.stdout.write("Renderização: nenhum preview gerado.")
+            return
+        self.stdout.write(f"Renderização: {renderizados} preview(s) em {duracao:.1f}s "
+                          f"({renderizados / duracao:.2f} arquivos/s)")
+        for etapa, valores in fila_render.resumo_tempos().items():
+            self.stdout.write(f"  {etapa:<15} média {valores['media'] * 1000:8.1f} ms")
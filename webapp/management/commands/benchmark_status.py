@@ -0,0 +1,63 @@
+import random
+import time
+from django.core.management.base import BaseCommand
+from webapp.planilha import COLUNAS, LinhaMolde
+from webapp.status import Colunas, calcular_status, classificar
+
+
+class Command(BaseCommand):
+    help = "Mede a classificação de status linha a linha e por aba inteira (colunas)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--linhas', type=int, nargs='+', default=[10000, 50000, 100000],
+                            help="Tamanhos de aba a medir (padrão: 10000 50000 100000).")
+        parser.add_argument('--repeticoes', type=int, default=5,
+                            help="Repetições de cada medida; vale a mais rápida (padrão: 5).")
+        parser.add_argument('--semente', type=int, default=1)
+
+    def handle(self, *args, **options):
+        sorteio = random.Random(options['semente'])
+        repeticoes = options['repeticoes']
+        self.stdout.write(f"{'linhas':>8} {'por linha':>12} {'por aba':>12} {'colunas':>12} {'ganho':>7}")
+        for tamanho in options['linhas']:
+            linhas = [LinhaMolde(numero, _valores(sorteio)) for numero in range(2, tamanho + 2)]
+            colunas = Colunas.de_linhas(linhas)
+
+            # Confere que os dois caminhos dão o mesmo resultado antes de medir
+            if colunas.status() != [calcular_status(linha) for linha in linhas]:
+                raise AssertionError("Classificação por colunas diferente da classificação por linha")
+
+            por_linha = _melhor(repeticoes, lambda: [calcular_status(linha) for linha in linhas])
+            por_aba = _melhor(repeticoes, lambda: classificar(linhas).contagens())
+            so_colunas = _melhor(repeticoes, colunas.contagens)
+            self.stdout.write(
+                f"{tamanho:>8} {_taxa(tamanho, por_linha):>12} {_taxa(tamanho, por_aba):>12} "
+                f"{_taxa(tamanho, so_colunas):>12} {por_linha / por_aba:>6.1f}x"
+            )
+        self.stdout.write("Taxas em linhas/s. 'por aba' inclui montar as colunas e gravar o status "
+                          "em cada linha; 'colunas' é só a classificação e a contagem.")
+
+
+# Valores de uma linha da planilha com cada checkbox marcado ao acaso
+def _valores(sorteio):
+    valores = [None] * COLUNAS
+    valores[1] = f'ITEM-{sorteio.randrange(10 ** 6):06d}'
+    for indice in range(3, COLUNAS):
+        # Máquinas marcadas com menos frequência que aço e programa
+        chance = 0.6 if indice < 5 else 0.1
+        valores[indice] = '☑' if sorteio.random() < chance else None
+    return valores
+
+
+def _melhor(repeticoes, funcao):
+    melhor = None
+    for _ in range(repeticoes):
+        inicio = time.perf_counter()
+        funcao()
+        duracao = time.perf_counter() - inicio
+        melhor = duracao if melhor is None else min(melhor, duracao)
+    return melhor
+
+
+def _taxa(tamanho, segundos):
+    return f'{tamanho / segundos:,.0f}'
@@ -0,0 +1,26 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from webapp.armazenamento import caminho_planilha, pasta_fragmentos
+from webapp.fragmentos import exportar_fragmentos
+from webapp.sincronizacao import exportar_planilha
+
+
+class Command(BaseCommand):
+    help = "Gera o moldes.xlsx a partir dos dados do banco ou dos arquivos de cada molde."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--arquivo', default=None, help="Planilha a gerar (padrão: media/moldes.xlsx).")
+        parser.add_argument(
+            '--origem', choices=('banco', 'fragmentos'),
+            default='fragmentos' if getattr(settings, 'ARMAZENAMENTO_MOLDES', None) == 'fragmentos' else 'banco',
+            help="De onde vêm os dados (padrão: o armazenamento configurado).",
+        )
+
+    def handle(self, *args, **options):
+        caminho = options['arquivo'] or caminho_planilha()
+        if options['origem'] == 'fragmentos':
+            quantidade = exportar_fragmentos(pasta_fragmentos(), caminho)
+            self.stdout.write(f"Planilha com {quantidade} molde(s) exportada em {caminho}")
+            return
+        exportar_planilha(caminho)
+        self.stdout.write(f"Planilha exportada em {caminho}")
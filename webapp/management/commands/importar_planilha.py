@@ -0,0 +1,52 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from webapp.armazenamento import caminho_planilha, pasta_fragmentos
+from webapp.fragmentos import fragmentar_planilha
+from webapp.sincronizacao import importar_planilha
+
+
+class Command(BaseCommand):
+    help = ("Importa o moldes.xlsx para o banco (só as abas e linhas que mudaram) "
+            "ou, com --destino fragmentos, para um arquivo por molde em media/modelos.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--arquivo', default=None, help="Planilha a importar (padrão: media/moldes.xlsx).")
+        parser.add_argument(
+            '--destino', choices=('banco', 'fragmentos'),
+            default='fragmentos' if getattr(settings, 'ARMAZENAMENTO_MOLDES', None) == 'fragmentos' else 'banco',
+            help="Para onde importar (padrão: o armazenamento configurado).",
+        )
+        parser.add_argument(
+            '--remover-ausentes', action='store_true',
+            help="Apaga do banco os moldes que não têm mais aba na planilha.",
+        )
+
+    def handle(self, *args, **options):
+        caminho = options['arquivo'] or caminho_planilha()
+        if options['destino'] == 'fragmentos':
+            return self.fragmentar(caminho)
+        try:
+            resumo = importar_planilha(caminho, remover_ausentes=options['remover_ausentes'])
+        except FileNotFoundError:
+            raise CommandError(f"Arquivo não encontrado: {caminho}")
+
+        for aba, dados in resumo.items():
+            if aba == '(removidos)':
+                self.stdout.write(f"Moldes removidos: {dados}")
+            elif dados['pulada']:
+                self.stdout.write(f"{aba}: sem alterações")
+            else:
+                self.stdout.write(
+                    f"{aba}: {dados['novos']} novo(s), {dados['alterados']} alterado(s), "
+                    f"{dados['removidos']} removido(s)"
+                )
+
+    def fragmentar(self, caminho):
+        pasta = pasta_fragmentos()
+        try:
+            resumo = fragmentar_planilha(caminho, pasta)
+        except FileNotFoundError:
+            raise CommandError(f"Arquivo não encontrado: {caminho}")
+        for aba, quantidade in resumo.items():
+            self.stdout.write(f"{aba}: {quantidade} linha(s)")
+        self.stdout.write(f"{len(resumo)} molde(s) gravados em {pasta}")
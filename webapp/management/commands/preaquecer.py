@@ -0,0 +1,237 @@
+import json
+import os
+import sys
+import time
+from importlib.util import find_spec
+from multiprocessing import Process
+from urllib.error import HTTPError, URLError
+from urllib.parse import quote
+from urllib.request import urlopen
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from webapp import armazenamento, fila_render
+from webapp.disco import travar
+from webapp.management.commands.servico_render import trabalhador
+from webapp.pastas import listar_modelos
+
+# Adianta o trabalho que hoje fica para o primeiro acesso:
+#   1. coloca na fila os modelos de media/modelos sem preview ou com preview
+#      desatualizado e renderiza a fila em paralelo (os mesmos processos do
+#      servico_render, que saem quando a fila esvazia);
+#   2. com --url, abre /modelos, /painel e as páginas de cada molde no servidor
+#      em execução, para ele ler a planilha e montar o índice das pastas.
+# Pode rodar pelo cron com o servidor no ar: uma trava impede duas execuções
+# ao mesmo tempo e a fila é a mesma do servico_render (os jobs são reservados
+# um a um, então os dois dividem o trabalho). Interrompido, continua de onde
+# parou na próxima execução.
+
+
+# "12/40 (30%), 3.1/s, faltam ~9s"
+def progresso(feitos, total, inicio):
+    texto = f"{feitos}/{total} ({100 * feitos / total:.0f}%)" if total else "0/0"
+    decorrido = time.monotonic() - inicio
+    if feitos and decorrido > 0:
+        taxa = feitos / decorrido
+        texto += f", {taxa:.1f}/s, faltam ~{(total - feitos) / taxa:.0f}s"
+    return texto
+
+
+class Command(BaseCommand):
+    help = ("Renderiza os previews que faltam ou estão desatualizados e aquece os caches "
+            "do servidor. Pode rodar pelo cron com o servidor no ar.")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers', type=int, default=getattr(settings, 'PREVIEWS_WORKERS', None) or os.cpu_count(),
+            help="Processos de renderização em paralelo.",
+        )
+        parser.add_argument(
+            '--max-jobs', type=int, default=getattr(settings, 'PREVIEWS_JOBS_POR_PROCESSO', 0),
+            help="Recicla o processo depois de renderizar essa quantidade de modelos (0 = nunca).",
+        )
+        parser.add_argument(
+            '--limite-memoria', type=int, default=getattr(settings, 'PREVIEWS_LIMITE_MEMORIA_MB', 0),
+            help="Recicla o processo quando a memória residente passar desse valor em MB (0 = sem limite).",
+        )
+        parser.add_argument(
+            '--url', default=getattr(settings, 'PREAQUECER_URL', None),
+            help="Endereço do servidor em execução (ex.: http://127.0.0.1:8000) cujas páginas serão "
+                 "abertas para aquecer os caches. Sem ele, só os previews são gerados.",
+        )
+        parser.add_argument(
+            '--tempo-maximo', type=float, default=getattr(settings, 'PREAQUECER_TEMPO_MAXIMO', 3600),
+            help="Segundos renderizando previews antes de parar e deixar o resto para a próxima "
+                 "execução (0 = sem limite).",
+        )
+        parser.add_argument('--timeout', type=float, default=120, help="Segundos de espera por página.")
+        parser.add_argument('--sem-previews', action='store_true', help="Não renderiza os previews.")
+
+    def handle(self, *args, **options):
+        pasta_previews = os.path.join(settings.MEDIA_ROOT, 'modelos', 'previews')
+        os.makedirs(pasta_previews, exist_ok=True)
+        trava = travar(os.path.join(pasta_previews, 'preaquecer.lock'))
+        if trava is None:
+            self.stdout.write("Outra execução do preaquecer está em andamento; nada a fazer.")
+            return
+        self.caminho_estado = os.path.join(pasta_previews, 'preaquecer.json')
+        # Mostra o progresso na mesma linha no terminal; no cron, uma linha a cada 10s
+        self.terminal = sys.stdout.isatty()
+        self.ultima_linha = 0
+        try:
+            self.retomar()
+            if not options['sem_previews']:
+                self.renderizar(options)
+            if options['url']:
+                self.aquecer(options['url'].rstrip('/'), options['timeout'])
+            else:
+                self.stdout.write("Sem --url: caches do servidor não aquecidos.")
+        finally:
+            trava.close()
+
+    # Jobs que uma execução interrompida deixou "processando" voltam para a fila
+    def retomar(self):
+        try:
+            with open(self.caminho_estado) as f:
+                pids = json.load(f)['pids']
+        except (OSError, ValueError, KeyError):
+            return
+        for pid in pids:
+            fila_render.devolver(pid)
+        self.apagar_estado()
+        self.stdout.write("Retomando a execução anterior, que foi interrompida.")
+
+    def salvar_estado(self, processos):
+        temporario = self.caminho_estado + '.tmp'
+        with open(temporario, 'w') as f:
+            json.dump({'pids': [processo.pid for processo in processos if processo is not None]}, f)
+        os.replace(temporario, self.caminho_estado)
+
+    def apagar_estado(self):
+        try:
+            os.remove(self.caminho_estado)
+        except FileNotFoundError:
+            pass
+
+    def mostrar(self, texto, final=False):
+        if self.terminal:
+            self.stdout.write('\r' + texto.ljust(79), ending='\n' if final else '')
+            self.stdout.flush()
+        elif final or time.monotonic() - self.ultima_linha >= 10:
+            self.stdout.write(texto)
+            self.ultima_linha = time.monotonic()
+
+    def renderizar(self, options):
+        pasta_modelos = os.path.join(settings.MEDIA_ROOT, 'modelos')
+        arquivos = listar_modelos(pasta_modelos)
+        jobs = fila_render.estados()
+        novos = []
+        for arquivo, (tamanho, mtime) in arquivos.items():
+            prioridade = fila_render.prioridade_na_fila(jobs.get(arquivo), tamanho, mtime)
+            if prioridade is not None:
+                novos.append((arquivo, tamanho, mtime, prioridade))
+        if any(arquivo not in arquivos for arquivo in jobs):
+            fila_render.coletar_orfaos(arquivos, os.path.join(pasta_modelos, 'previews'))
+        if novos:
+            fila_render.enfileirar(novos)
+
+        restantes = self.restantes()
+        self.stdout.write(f"Modelos: {len(arquivos)}; na fila para renderizar: {restantes}.")
+        if not restantes:
+            return
+        if find_spec('OCC') is None:
+            self.stderr.write("pythonocc-core não instalada: os previews ficam na fila para o servico_render.")
+            return
+
+        contadores = fila_render.contadores()
+        argumentos = (1.0, options['max_jobs'], options['limite_memoria'], True)
+        processos = [Process(target=trabalhador, args=argumentos, daemon=True)
+                     for _ in range(max(1, options['workers']))]
+        for processo in processos:
+            processo.start()
+        self.salvar_estado(processos)
+
+        inicio = time.monotonic()
+        prazo = inicio + options['tempo_maximo'] if options['tempo_maximo'] else None
+        try:
+            while True:
+                quantidades = fila_render.quantidades_por_estado()
+                pendentes = quantidades.get(fila_render.PENDENTE, 0)
+                restantes = pendentes + quantidades.get(fila_render.PROCESSANDO, 0)
+                for i, processo in enumerate(processos):
+                    if processo is None or processo.is_alive():
+                        continue
+                    # Encerrado (fila vazia, reciclado ou morto no meio de um
+                    # job): o job que ele deixou "processando" vira erro, e
+                    # outro processo entra no lugar se ainda há o que renderizar
+                    fila_render.abandonar(processo.pid)
+                    processos[i] = None
+                    if pendentes:
+                        processos[i] = Process(target=trabalhador, args=argumentos, daemon=True)
+                        processos[i].start()
+                    self.salvar_estado(processos)
+                feitos = self.concluidos_desde(contadores)
+                self.mostrar("Previews: " + progresso(feitos, feitos + restantes, inicio))
+                if not any(processos):
+                    break
+                if prazo is not None and time.monotonic() > prazo:
+                    self.parar(processos)
+                    self.mostrar(f"Tempo máximo de {options['tempo_maximo']:.0f}s atingido; o que faltou "
+                                 "fica na fila para a próxima execução.", final=True)
+                    break
+                time.sleep(1)
+        except KeyboardInterrupt:
+            self.parar(processos)
+            self.apagar_estado()
+            raise CommandError("Interrompido; rode de novo para continuar.")
+
+        self.apagar_estado()
+        erros = int(fila_render.contadores().get('previews_erros_total', 0) - contadores.get('previews_erros_total', 0))
+        self.mostrar(f"Previews: {self.concluidos_desde(contadores)} concluído(s), {erros} com erro, "
+                     f"em {time.monotonic() - inicio:.0f}s.", final=True)
+
+    # Encerra os processos de renderização e devolve para a fila os jobs
+    # que estavam com eles
+    def parar(self, processos):
+        for processo in processos:
+            if processo is not None:
+                processo.terminate()
+                processo.join()
+                fila_render.devolver(processo.pid)
+
+    def restantes(self):
+        quantidades = fila_render.quantidades_por_estado()
+        return quantidades.get(fila_render.PENDENTE, 0) + quantidades.get(fila_render.PROCESSANDO, 0)
+
+    # Jobs concluídos (gerados, reaproveitados ou com erro) desde a leitura
+    # dos contadores; inclui os do servico_render, se estiver rodando junto
+    def concluidos_desde(self, antes):
+        agora = fila_render.contadores()
+        return int(sum(
+            agora.get(nome, 0) - antes.get(nome, 0)
+            for nome in ('previews_renderizados_total', 'previews_reaproveitados_total', 'previews_erros_total')
+        ))
+
+    # Abre as páginas no servidor em execução: cada processo do servidor
+    # guarda a planilha e o índice das pastas em memória
+    def aquecer(self, url, timeout):
+        dados_moldes = armazenamento.obter()
+        abas = dados_moldes.abas() if dados_moldes.disponivel() else []
+        caminhos = ['/modelos', '/painel']
+        caminhos += [f'/pagina/{quote(aba)}/' for aba in abas]
+        caminhos += [f'/checklist/{quote(aba)}/' for aba in abas]
+
+        inicio = time.monotonic()
+        falhas = 0
+        for feitos, caminho in enumerate(caminhos, start=1):
+            try:
+                with urlopen(url + caminho, timeout=timeout) as resposta:
+                    resposta.read()
+            except HTTPError as e:
+                falhas += 1
+                self.mostrar(f"{caminho}: HTTP {e.code}", final=True)
+            except (URLError, OSError) as e:
+                self.mostrar(f"Servidor indisponível em {url}: {getattr(e, 'reason', e)}", final=True)
+                return
+            self.mostrar("Páginas: " + progresso(feitos, len(caminhos), inicio))
+        self.mostrar(f"Páginas: {len(caminhos) - falhas} aquecida(s), {falhas} com erro, "
+                     f"em {time.monotonic() - inicio:.0f}s.", final=True)
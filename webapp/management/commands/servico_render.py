@@ -0,0 +1,146 @@
+import logging
+import os
+import time
+from multiprocessing import Process, cpu_count
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from webapp import fila_render
+from webapp.pastas import listar_modelos
+
+logger = logging.getLogger(__name__)
+
+
+# Laço de cada processo do serviço: cria o renderizador uma vez, pega jobs da
+# fila e se encerra depois de N jobs ou ao passar do limite de memória (a OCC
+# vaza memória em montagens grandes); o processo principal repõe outro no lugar.
+# Com sair_quando_vazia (preaquecer) o processo termina quando a fila esvazia.
+def trabalhador(intervalo, max_jobs, limite_memoria_mb, sair_quando_vazia=False):
+    import django
+    django.setup()
+    from webapp.previews import RenderizadorPreview, processar_preview, uso_memoria_mb
+
+    renderizador = RenderizadorPreview()
+    while True:
+        job = fila_render.reservar(os.getpid())
+        if job is None:
+            if sair_quando_vazia:
+                return
+            time.sleep(intervalo)
+            continue
+        arquivo = job['arquivo']
+        try:
+            imagem, chave, tempos = processar_preview(job, renderizador)
+            fila_render.concluir(arquivo, imagem, chave, tempos)
+            if tempos is None:
+                logger.info("Preview de %s reaproveitado (conteúdo sem alteração).", arquivo)
+            else:
+                logger.info(
+                    "Preview de %s gerado: %s", arquivo,
+                    ", ".join(f"{etapa} {segundos:.3f}s" for etapa, segundos in tempos.items()),
+                )
+        except Exception as e:
+            logger.error("Erro ao gerar preview para %s: %s", arquivo, e)
+            fila_render.falhar(arquivo, e)
+
+        if max_jobs and renderizador.jobs >= max_jobs:
+            logger.info("Processo %s reciclado após %s jobs.", os.getpid(), renderizador.jobs)
+            return
+        memoria = uso_memoria_mb()
+        if limite_memoria_mb and memoria is not None and memoria > limite_memoria_mb:
+            logger.info("Processo %s reciclado com %.0f MB em uso.", os.getpid(), memoria)
+            return
+
+
+class Command(BaseCommand):
+    help = "Serviço contínuo que renderiza os previews STEP enfileirados pela página /modelos."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers', type=int, default=getattr(settings, 'PREVIEWS_WORKERS', None) or cpu_count(),
+            help="Quantidade fixa de processos de renderização.",
+        )
+        parser.add_argument(
+            '--intervalo', type=float, default=1.0,
+            help="Segundos de espera quando a fila está vazia.",
+        )
+        parser.add_argument(
+            '--max-jobs', type=int, default=getattr(settings, 'PREVIEWS_JOBS_POR_PROCESSO', 0),
+            help="Recicla o processo depois de renderizar essa quantidade de modelos (0 = nunca).",
+        )
+        parser.add_argument(
+            '--limite-memoria', type=int, default=getattr(settings, 'PREVIEWS_LIMITE_MEMORIA_MB', 0),
+            help="Recicla o processo quando a memória residente passar desse valor em MB (0 = sem limite).",
+        )
+        parser.add_argument(
+            '--intervalo-limpeza', type=float, default=600,
+            help="Segundos entre cada coleta de previews órfãos.",
+        )
+        parser.add_argument(
+            '--limpar', action='store_true',
+            help="Só apaga os previews órfãos e sai.",
+        )
+        parser.add_argument(
+            '--tempos', action='store_true',
+            help="Só mostra o tempo médio de cada etapa dos previews já gerados e sai.",
+        )
+
+    def handle(self, *args, **options):
+        if options['tempos']:
+            return self.mostrar_tempos()
+        if options['limpar']:
+            return self.limpar()
+
+        fila_render.recuperar_interrompidos()
+        self.limpar()
+        ultima_limpeza = time.monotonic()
+        argumentos = (options['intervalo'], options['max_jobs'], options['limite_memoria'])
+
+        processos = []
+        for _ in range(options['workers']):
+            processo = Process(target=trabalhador, args=argumentos, daemon=True)
+            processo.start()
+            processos.append(processo)
+        self.stdout.write(f"Serviço de renderização iniciado com {len(processos)} processo(s).")
+
+        try:
+            # Mantém o pool com tamanho fixo, repondo processos reciclados ou que morreram
+            while True:
+                for i, processo in enumerate(processos):
+                    if not processo.is_alive():
+                        fila_render.abandonar(processo.pid)
+                        processos[i] = Process(target=trabalhador, args=argumentos, daemon=True)
+                        processos[i].start()
+                if time.monotonic() - ultima_limpeza > options['intervalo_limpeza']:
+                    self.limpar()
+                    ultima_limpeza = time.monotonic()
+                time.sleep(options['intervalo'])
+        except KeyboardInterrupt:
+            self.stdout.write("Encerrando serviço de renderização.")
+        finally:
+            for processo in processos:
+                processo.terminate()
+
+    # Coleta de lixo: previews de modelos que foram apagados ou renomeados
+    def limpar(self):
+        pasta_modelos = os.path.join(settings.MEDIA_ROOT, 'modelos')
+        if not os.path.isdir(pasta_modelos):
+            return
+        arquivos_stp = listar_modelos(pasta_modelos)
+        orfaos, apagadas = fila_render.coletar_orfaos(
+            arquivos_stp, os.path.join(pasta_modelos, 'previews'), apagar_soltos=True
+        )
+        if orfaos or apagadas:
+            self.stdout.write(f"Limpeza: {len(orfaos)} registro(s) e {len(apagadas)} imagem(ns) removidos.")
+
+    def mostrar_tempos(self):
+        resumo = fila_render.resumo_tempos()
+        if not resumo:
+            self.stdout.write("Nenhum preview com tempos registrados.")
+            return
+        total_geral = sum(dados['total'] for dados in resumo.values())
+        # As etapas vêm na ordem em que foram registradas (leitura ... codificação)
+        for etapa, dados in resumo.items():
+            self.stdout.write(
+                f"{etapa:<14} média {dados['media']:.3f}s  total {dados['total']:.1f}s  "
+                f"({100 * dados['total'] / total_geral:.0f}%)  em {dados['jobs']} jobs"
+            )
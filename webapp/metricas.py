@@ -0,0 +1,171 @@
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from . import fila_render
+
+# Medição de desempenho das requisições.
+#
+# Qualquer trecho de código pode ser medido com
+#     with medir('planilha_ler'):
+#         ...
+# O tempo vai para o histograma simoldes_etapa_segundos{etapa="planilha_ler"}
+# e, se o trecho rodou dentro de uma requisição (inclusive nas threads de
+# executores.py), também para o cabeçalho Server-Timing da resposta. O
+# MedicaoMiddleware mede cada requisição inteira e a view /metrics expõe tudo
+# no formato texto do Prometheus.
+
+BALDES = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# Etapas medidas na requisição atual: {etapa: segundos}
+_etapas = contextvars.ContextVar('etapas', default=None)
+
+
+class Histograma:
+    def __init__(self, nome, ajuda, rotulos, baldes=BALDES):
+        self.nome = nome
+        self.ajuda = ajuda
+        self.rotulos = rotulos
+        self.baldes = baldes
+        self._lock = threading.Lock()
+        # {valores dos rótulos: [contagem por balde..., soma, total]}
+        self._series = {}
+
+    def observar(self, valor, *rotulos):
+        with self._lock:
+            serie = self._series.get(rotulos)
+            if serie is None:
+                serie = self._series[rotulos] = [0] * len(self.baldes) + [0.0, 0]
+            for indice, limite in enumerate(self.baldes):
+                if valor <= limite:
+                    serie[indice] += 1
+            serie[-2] += valor
+            serie[-1] += 1
+
+    def exportar(self):
+        linhas = [f'# HELP {self.nome} {self.ajuda}', f'# TYPE {self.nome} histogram']
+        with self._lock:
+            series = {rotulos: list(serie) for rotulos, serie in self._series.items()}
+        for rotulos, serie in sorted(series.items()):
+            base = list(zip(self.rotulos, rotulos))
+            for limite, quantidade in zip(self.baldes, serie):
+                linhas.append(f'{self.nome}_bucket{_rotulos(base + [("le", limite)])} {quantidade}')
+            linhas.append(f'{self.nome}_bucket{_rotulos(base + [("le", "+Inf")])} {serie[-1]}')
+            linhas.append(f'{self.nome}_sum{_rotulos(base)} {serie[-2]}')
+            linhas.append(f'{self.nome}_count{_rotulos(base)} {serie[-1]}')
+        return linhas
+
+
+def _rotulos(pares):
+    if not pares:
+        return ''
+    texto = ','.join(f'{nome}="{_escapar(valor)}"' for nome, valor in pares)
+    return '{' + texto + '}'
+
+
+def _escapar(valor):
+    return str(valor).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+REQUISICOES = Histograma(
+    'simoldes_requisicao_segundos', 'Tempo de resposta por view.', ('view', 'metodo', 'status'),
+)
+ETAPAS = Histograma(
+    'simoldes_etapa_segundos', 'Tempo de cada etapa medida com medir().', ('etapa',),
+)
+
+
+# Mede um trecho de código (veja o comentário do início do arquivo)
+@contextmanager
+def medir(etapa):
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        duracao = time.perf_counter() - inicio
+        ETAPAS.observar(duracao, etapa)
+        etapas = _etapas.get()
+        if etapas is not None:
+            etapas[etapa] = etapas.get(etapa, 0.0) + duracao
+
+
+def _server_timing(etapas, total):
+    partes = [f'{etapa};dur={segundos * 1000:.1f}' for etapa, segundos in etapas.items()]
+    partes.append(f'total;dur={total * 1000:.1f}')
+    return ', '.join(partes)
+
+
+# Mede cada requisição e acrescenta o cabeçalho Server-Timing. Funciona com
+# views síncronas e assíncronas (WSGI e ASGI).
+class MedicaoMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        token, inicio = self._iniciar()
+        try:
+            resposta = self.get_response(request)
+        finally:
+            etapas = _etapas.get()
+            _etapas.reset(token)
+        return self._concluir(request, resposta, etapas, inicio)
+
+    async def __acall__(self, request):
+        token, inicio = self._iniciar()
+        try:
+            resposta = await self.get_response(request)
+        finally:
+            etapas = _etapas.get()
+            _etapas.reset(token)
+        return self._concluir(request, resposta, etapas, inicio)
+
+    def _iniciar(self):
+        return _etapas.set({}), time.perf_counter()
+
+    def _concluir(self, request, resposta, etapas, inicio):
+        total = time.perf_counter() - inicio
+        correspondencia = getattr(request, 'resolver_match', None)
+        view = correspondencia.view_name if correspondencia else 'nao_encontrada'
+        REQUISICOES.observar(total, view, request.method, resposta.status_code)
+        # Em respostas por streaming o tempo é só até o início do envio
+        resposta['Server-Timing'] = _server_timing(etapas, total)
+        return resposta
+
+
+# Texto no formato do Prometheus com os histogramas e o cache da planilha do
+# processo e os contadores do serviço de renderização (lidos da fila, que é
+# compartilhada pelos processos do serviço)
+def exportar():
+    # planilha.py importa este módulo
+    from .planilha import estatisticas_dos_caches
+
+    linhas = REQUISICOES.exportar() + ETAPAS.exportar()
+
+    cache = estatisticas_dos_caches()
+    for nome, ajuda in (('acertos', 'Leituras da planilha atendidas pelo cache.'),
+                        ('falhas', 'Leituras da planilha que abriram o arquivo.')):
+        linhas += [f'# HELP simoldes_planilha_cache_{nome}_total {ajuda}',
+                   f'# TYPE simoldes_planilha_cache_{nome}_total counter',
+                   f'simoldes_planilha_cache_{nome}_total {cache[nome]}']
+
+    linhas += ['# HELP simoldes_previews Modelos na fila de renderização por estado.',
+               '# TYPE simoldes_previews gauge']
+    quantidades = {estado: 0 for estado in (fila_render.PENDENTE, fila_render.PROCESSANDO,
+                                             fila_render.PRONTO, fila_render.ERRO)}
+    quantidades.update(fila_render.quantidades_por_estado())
+    for estado, quantidade in sorted(quantidades.items()):
+        linhas.append(f'simoldes_previews{_rotulos([("estado", estado)])} {quantidade}')
+
+    contadores = fila_render.contadores()
+    for nome, ajuda in fila_render.CONTADORES.items():
+        linhas += [f'# HELP simoldes_{nome} {ajuda}', f'# TYPE simoldes_{nome} counter',
+                   f'simoldes_{nome} {contadores.get(nome, 0)}']
+    return '\n'.join(linhas) + '\n'
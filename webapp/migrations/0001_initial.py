@@ -0,0 +1,53 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:58
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Molde',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('nome', models.CharField(max_length=100, unique=True)),
+                ('ordem', models.PositiveIntegerField(default=0)),
+                ('cabecalho', models.JSONField(blank=True, default=list)),
+                ('assinatura', models.CharField(blank=True, max_length=40)),
+                ('atualizado_em', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'ordering': ['ordem', 'nome'],
+            },
+        ),
+        migrations.CreateModel(
+            name='Item',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('linha', models.PositiveIntegerField()),
+                ('codigo', models.CharField(blank=True, max_length=100)),
+                ('chegada_aco', models.BooleanField(default=False)),
+                ('programa', models.BooleanField(default=False)),
+                ('maquina_1', models.BooleanField(default=False)),
+                ('maquina_2', models.BooleanField(default=False)),
+                ('maquina_3', models.BooleanField(default=False)),
+                ('maquina_4', models.BooleanField(default=False)),
+                ('maquina_5', models.BooleanField(default=False)),
+                ('maquina_6', models.BooleanField(default=False)),
+                ('status', models.CharField(blank=True, max_length=40)),
+                ('colunas_extras', models.JSONField(blank=True, default=dict)),
+                ('molde', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='itens', to='webapp.molde')),
+            ],
+            options={
+                'ordering': ['molde', 'linha'],
+                'indexes': [models.Index(fields=['molde', 'status'], name='item_molde_status_idx'), models.Index(fields=['status'], name='item_status_idx')],
+                'constraints': [models.UniqueConstraint(fields=('molde', 'linha'), name='item_molde_linha_unico')],
+            },
+        ),
+    ]
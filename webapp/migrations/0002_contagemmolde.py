@@ -0,0 +1,43 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:01
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, Q
+
+
+# Preenche as contagens do painel para os itens já importados
+def preencher_contagens(apps, schema_editor):
+    Item = apps.get_model('webapp', 'Item')
+    ContagemMolde = apps.get_model('webapp', 'ContagemMolde')
+
+    contagens = []
+    for linha in Item.objects.values('molde_id', 'status').annotate(quantidade=Count('id')):
+        contagens.append(ContagemMolde(molde_id=linha['molde_id'], chave=linha['status'], quantidade=linha['quantidade']))
+    maquinas = {f'maquina_{n}': Count('id', filter=Q(**{f'maquina_{n}': True})) for n in range(1, 7)}
+    for linha in Item.objects.values('molde_id').annotate(**maquinas):
+        for chave in maquinas:
+            contagens.append(ContagemMolde(molde_id=linha['molde_id'], chave=chave, quantidade=linha[chave]))
+    ContagemMolde.objects.bulk_create(contagens)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('webapp', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ContagemMolde',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('chave', models.CharField(max_length=40)),
+                ('quantidade', models.IntegerField(default=0)),
+                ('molde', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='contagens', to='webapp.molde')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('molde', 'chave'), name='contagem_molde_chave_unica')],
+            },
+        ),
+        migrations.RunPython(preencher_contagens, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('webapp', '0002_contagemmolde'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Alteracao',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('molde', models.CharField(max_length=100)),
+                ('linha', models.PositiveIntegerField(null=True)),
+                ('valores', models.JSONField(default=dict)),
+                ('status', models.CharField(blank=True, max_length=40)),
+                ('criado_em', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['molde', 'id'], name='alteracao_molde_id_idx')],
+            },
+        ),
+    ]
@@ -1,3 +1,126 @@
 from django.db import models
+from .status import calcular_status
 
-# Create your models here.
+# Dados de produção que antes ficavam só no moldes.xlsx: um Molde por aba da
+# planilha e um Item por linha. A planilha continua existindo como
+# importação (python manage.py importar_planilha) e exportação.
+
+# Campos de checkbox de cada item, na ordem das colunas D a K da planilha
+CAMPOS_CHECKBOX = (
+    'chegada_aco', 'programa',
+    'maquina_1', 'maquina_2', 'maquina_3', 'maquina_4', 'maquina_5', 'maquina_6',
+)
+
+
+class Molde(models.Model):
+    nome = models.CharField(max_length=100, unique=True)
+    # Posição da aba na planilha, para a exportação manter a ordem
+    ordem = models.PositiveIntegerField(default=0)
+    # Valores da 1ª linha da aba, usados de novo na exportação
+    cabecalho = models.JSONField(default=list, blank=True)
+    # Hash do conteúdo da aba na última importação; aba igual é pulada
+    assinatura = models.CharField(max_length=40, blank=True)
+    atualizado_em = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['ordem', 'nome']
+
+    def __str__(self):
+        return self.nome
+
+
+class Item(models.Model):
+    molde = models.ForeignKey(Molde, on_delete=models.CASCADE, related_name='itens')
+    # Número da linha na aba da planilha (a partir da 2)
+    linha = models.PositiveIntegerField()
+    codigo = models.CharField(max_length=100, blank=True)
+    chegada_aco = models.BooleanField(default=False)
+    programa = models.BooleanField(default=False)
+    maquina_1 = models.BooleanField(default=False)
+    maquina_2 = models.BooleanField(default=False)
+    maquina_3 = models.BooleanField(default=False)
+    maquina_4 = models.BooleanField(default=False)
+    maquina_5 = models.BooleanField(default=False)
+    maquina_6 = models.BooleanField(default=False)
+    # Calculado a partir dos checkboxes sempre que o item é salvo
+    status = models.CharField(max_length=40, blank=True)
+    # Colunas da planilha que não têm campo próprio (ex.: A e C), por letra
+    colunas_extras = models.JSONField(default=dict, blank=True)
+
+    class Meta:
+        ordering = ['molde', 'linha']
+        constraints = [
+            models.UniqueConstraint(fields=['molde', 'linha'], name='item_molde_linha_unico'),
+        ]
+        indexes = [
+            models.Index(fields=['molde', 'status'], name='item_molde_status_idx'),
+            models.Index(fields=['status'], name='item_status_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.molde_id}:{self.linha} {self.codigo}'
+
+    # Nomes usados pelos templates (os mesmos das linhas lidas da planilha)
+    @property
+    def item(self):
+        return self.codigo
+
+    @property
+    def status_custom(self):
+        return self.status
+
+    @property
+    def maquinas(self):
+        return (self.maquina_1, self.maquina_2, self.maquina_3,
+                self.maquina_4, self.maquina_5, self.maquina_6)
+
+    @property
+    def em_maquina(self):
+        return any(self.maquinas)
+
+    def save(self, *args, **kwargs):
+        self.status = calcular_status(self)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'status' not in update_fields:
+            kwargs['update_fields'] = [*update_fields, 'status']
+        super().save(*args, **kwargs)
+
+
+# Contagens do painel por molde, mantidas por diferença a cada item alterado.
+# chave é um status (ex.: "Usinando") ou uma máquina (maquina_1 a maquina_6).
+class ContagemMolde(models.Model):
+    molde = models.ForeignKey(Molde, on_delete=models.CASCADE, related_name='contagens')
+    chave = models.CharField(max_length=40)
+    quantidade = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['molde', 'chave'], name='contagem_molde_chave_unica'),
+        ]
+
+    def __str__(self):
+        return f'{self.molde_id} {self.chave}: {self.quantidade}'
+
+
+# Registro de alterações, só de inclusão: cada item alterado ganha uma linha
+# com todos os checkboxes e o status depois da alteração. O id é a versão,
+# sempre crescente (AUTOINCREMENT no SQLite, que grava uma transação por vez);
+# as páginas pedem só o que veio depois da versão que já têm (historico.py).
+class Alteracao(models.Model):
+    # Nome do molde (aba), sem chave estrangeira: no modo planilha os moldes
+    # não estão no banco
+    molde = models.CharField(max_length=100)
+    # Nula quando o molde inteiro mudou (importação da planilha)
+    linha = models.PositiveIntegerField(null=True)
+    # {campo: True/False} para cada campo de CAMPOS_CHECKBOX
+    valores = models.JSONField(default=dict)
+    status = models.CharField(max_length=40, blank=True)
+    criado_em = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['molde', 'id'], name='alteracao_molde_id_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.pk} {self.molde}:{self.linha} {self.status}'
@@ -0,0 +1,142 @@
+import threading
+from collections import Counter
+from django.db import transaction
+from django.db.models import Count, F, Q
+from .models import ContagemMolde, Item
+from .status import CAMPOS_MAQUINAS, STATUS, Colunas
+
+# Contagens do painel geral: quantos itens de cada molde estão em cada
+# status e quantos estão em cada máquina. As contagens são mantidas por
+# diferença: cada item alterado soma 1 no estado novo e tira 1 do antigo, sem
+# varrer as abas de novo.
+
+# Nome de cada máquina (mesma ordem das colunas F a K / maquina_1 a maquina_6)
+NOMES_MAQUINAS = ('DMG', '600 II', '800 II', '600 I', '800 I', 'IXION II')
+
+CHAVES_MAQUINAS = CAMPOS_MAQUINAS
+
+
+# Contagens de um item: +1 no status e +1 em cada máquina marcada
+def contagens_item(item):
+    contagens = Counter({item.status_custom: 1})
+    for chave, marcada in zip(CHAVES_MAQUINAS, item.maquinas):
+        if marcada:
+            contagens[chave] += 1
+    return contagens
+
+
+# Diferença entre as contagens de um item antes e depois de uma alteração.
+# antes e depois são o resultado de contagens_item()
+def diferenca(antes, depois):
+    resultado = Counter(depois)
+    resultado.subtract(antes)
+    return {chave: valor for chave, valor in resultado.items() if valor}
+
+
+# Modo banco: aplica as diferenças na tabela ContagemMolde (dentro da mesma
+# transação que alterou os itens)
+def aplicar_no_banco(molde_id, diferencas):
+    for chave, valor in diferencas.items():
+        atualizadas = ContagemMolde.objects.filter(molde_id=molde_id, chave=chave).update(
+            quantidade=F('quantidade') + valor
+        )
+        if not atualizadas:
+            ContagemMolde.objects.create(molde_id=molde_id, chave=chave, quantidade=valor)
+
+
+# Modo banco: recalcula do zero as contagens dos moldes indicados (depois de
+# uma importação, por exemplo)
+@transaction.atomic
+def recalcular_no_banco(moldes):
+    ids = [molde.pk for molde in moldes]
+    itens = Item.objects.filter(molde_id__in=ids)
+    contagens = [
+        ContagemMolde(molde_id=linha['molde_id'], chave=linha['status'], quantidade=linha['quantidade'])
+        for linha in itens.values('molde_id', 'status').annotate(quantidade=Count('id'))
+    ]
+    maquinas = {chave: Count('id', filter=Q(**{chave: True})) for chave in CHAVES_MAQUINAS}
+    for linha in itens.values('molde_id').annotate(**maquinas):
+        for chave in CHAVES_MAQUINAS:
+            contagens.append(ContagemMolde(molde_id=linha['molde_id'], chave=chave, quantidade=linha[chave]))
+    ContagemMolde.objects.filter(molde_id__in=ids).delete()
+    ContagemMolde.objects.bulk_create(contagens)
+
+
+# Modo banco: {molde: {chave: quantidade}} lido da tabela de contagens
+def contagens_do_banco():
+    contagens = {}
+    for nome, chave, quantidade in ContagemMolde.objects.values_list('molde__nome', 'chave', 'quantidade'):
+        contagens.setdefault(nome, {})[chave] = quantidade
+    return contagens
+
+
+# Índice em memória usado no modo planilha: {molde: Counter(chave: quantidade)}
+class IndiceContagens:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._contagens = None
+        self.geracao = None
+
+    def montado(self, geracao):
+        return self._contagens is not None and self.geracao == geracao
+
+    # Monta do zero a partir de {molde: linhas}, contando cada aba de uma vez
+    def montar(self, linhas_por_molde, geracao):
+        contagens = {
+            molde: Counter(Colunas.de_linhas(linhas).contagens())
+            for molde, linhas in linhas_por_molde.items()
+        }
+        with self._lock:
+            self._contagens = contagens
+            self.geracao = geracao
+
+    # Aplica a diferença de um item alterado (só se o índice já foi montado)
+    def aplicar(self, molde, diferencas):
+        with self._lock:
+            if self._contagens is None:
+                return
+            self._contagens.setdefault(molde, Counter()).update(diferencas)
+
+    def contagens(self):
+        with self._lock:
+            return {molde: dict(total) for molde, total in (self._contagens or {}).items()}
+
+
+_indices = {}
+_indices_lock = threading.Lock()
+
+
+# Índice único por planilha, compartilhado pelo processo
+def indice_da_planilha(caminho):
+    with _indices_lock:
+        if caminho not in _indices:
+            _indices[caminho] = IndiceContagens()
+        return _indices[caminho]
+
+
+# Organiza as contagens {molde: {chave: quantidade}} para o template:
+# uma linha por molde e o total da fábrica
+def montar_resumo(contagens, moldes):
+    linhas = []
+    total = Counter()
+    for molde in moldes:
+        dados = contagens.get(molde, {})
+        total.update(dados)
+        linhas.append(_linha_resumo(molde, dados))
+    return {
+        'status': STATUS,
+        'maquinas': NOMES_MAQUINAS,
+        'moldes': linhas,
+        'total': _linha_resumo('Total', total),
+    }
+
+
+# por_status: [(status, quantidade)]; por_maquina: [(número da máquina, quantidade)]
+def _linha_resumo(nome, dados):
+    por_status = [(status, dados.get(status, 0)) for status in STATUS]
+    return {
+        'nome': nome,
+        'por_status': por_status,
+        'por_maquina': [(numero, dados.get(chave, 0)) for numero, chave in enumerate(CHAVES_MAQUINAS, start=1)],
+        'itens': sum(quantidade for _, quantidade in por_status),
+    }
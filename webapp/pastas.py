@@ -0,0 +1,350 @@
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+from django.conf import settings
+from . import fila_render
+from .metricas import medir
+
+try:
+    from watchdog.events import FileSystemEventHandler
+    from watchdog.observers import Observer
+except ImportError:
+    FileSystemEventHandler = object
+    Observer = None
+
+logger = logging.getLogger(__name__)
+
+# Índice das pastas de moldes (media/modelos/<molde>) mostradas na barra
+# lateral das páginas, e dos modelos STEP dentro delas.
+#
+# A pasta é varrida uma vez e o resultado fica em memória, com a quantidade
+# de modelos e a data da última alteração de cada molde, e o arquivo .stp de
+# cada código de item (nome do arquivo sem extensão, em qualquer subpasta do
+# molde; arquivos soltos em media/modelos valem para todos os moldes). Com o pacote
+# watchdog instalado, as alterações chegam por notificação do sistema de
+# arquivos e só a pasta do molde alterado é varrida de novo. Sem ele (ou se a
+# notificação falhar, como em alguns compartilhamentos de rede), a data de
+# modificação das pastas e dos modelos é conferida no máximo a cada
+# settings.PASTAS_MODELOS_INTERVALO segundos.
+
+# Extensões contadas como modelo
+EXTENSOES_MODELO = ('.stp', '.step')
+
+# Pastas dentro de media/modelos que não são moldes
+PASTAS_IGNORADAS = {'previews'}
+
+
+def pasta_modelos():
+    return os.path.join(settings.MEDIA_ROOT, 'modelos')
+
+
+# Código de item no formato usado como chave do índice: o nome do arquivo sem
+# extensão, sem diferenciar maiúsculas (1001, "1001" e 1001.0 são iguais)
+def chave_item(valor):
+    if valor is None:
+        return ''
+    if isinstance(valor, float) and valor.is_integer():
+        valor = int(valor)
+    return str(valor).strip().lower()
+
+
+# Caminho relativo a media/modelos, sempre com "/" (é o nome usado na fila
+# de renderização e nas URLs dos previews)
+def caminho_relativo(caminho, pasta):
+    return os.path.relpath(caminho, pasta).replace(os.sep, '/')
+
+
+# Todos os modelos da pasta e das subpastas: {caminho relativo: (tamanho, mtime)}
+def listar_modelos(pasta):
+    with medir('modelos_listar'):
+        return _listar_modelos(pasta)
+
+
+def _listar_modelos(pasta):
+    arquivos = {}
+    for diretorio, subpastas, nomes in os.walk(pasta):
+        if diretorio == pasta:
+            subpastas[:] = [nome for nome in subpastas if nome not in PASTAS_IGNORADAS]
+        for nome in nomes:
+            if nome.lower().endswith(EXTENSOES_MODELO):
+                caminho = os.path.join(diretorio, nome)
+                info = os.stat(caminho)
+                arquivos[caminho_relativo(caminho, pasta)] = (info.st_size, info.st_mtime)
+    return arquivos
+
+
+class IndicePastas:
+    def __init__(self, caminho, intervalo):
+        self.caminho = caminho
+        self.intervalo = intervalo
+        self._lock = threading.Lock()
+        # {molde: {'tipo': 'pasta', 'nome', 'modelos', 'modificado'}}; None = não montado
+        self._pastas = None
+        self._erro = None
+        # Data de modificação de cada diretório varrido, para a conferência sem watchdog
+        self._mtime_base = None
+        self._diretorios = {}
+        # {molde: {código do item: (caminho relativo, tamanho, mtime)}}; '' = arquivos soltos
+        self._modelos = {}
+        self._conferido_em = 0
+        # Avisos do watchdog: moldes a varrer de novo, ou tudo
+        self._sujas = set()
+        self._tudo_sujo = False
+        self._observador = None
+
+    # Itens da barra lateral, no formato usado pelos templates
+    def elementos(self):
+        with self._lock:
+            self._atualizar()
+            if self._erro is not None:
+                return [{'tipo': 'erro', 'nome': f"Erro: {self._erro}"}]
+            return [self._pastas[nome] for nome in sorted(self._pastas, key=str.lower)]
+
+    # Modelos de um molde: {código do item: (caminho relativo, tamanho, mtime)},
+    # incluindo os arquivos soltos em media/modelos que o molde não tem
+    def modelos(self, molde):
+        with self._lock:
+            self._atualizar()
+            return {**self._modelos.get('', {}), **self._modelos.get(molde, {})}
+
+    # Só mexe no disco (e só mede o tempo) quando há algo a conferir
+    def _atualizar(self):
+        if self._pastas is not None and not self._tudo_sujo:
+            if self._observador is not None and self._observador.is_alive():
+                if not self._sujas:
+                    return
+            elif time.monotonic() - self._conferido_em < self.intervalo:
+                return
+        with medir('pastas'):
+            self._varrer()
+
+    def _varrer(self):
+        if self._pastas is None or self._tudo_sujo:
+            self._montar()
+            return
+
+        if self._observador is not None and self._observador.is_alive():
+            for nome in self._sujas:
+                if nome == '':
+                    self._reler_raiz()
+                else:
+                    self._reler(nome)
+            self._sujas.clear()
+            return
+
+        # Sem notificações: confere as datas das pastas de tempos em tempos
+        agora = time.monotonic()
+        if agora - self._conferido_em < self.intervalo:
+            return
+        self._conferido_em = agora
+        try:
+            mtime_base = os.stat(self.caminho).st_mtime_ns
+            if mtime_base != self._mtime_base:
+                # Arquivos criados ou trocados direto em media/modelos (modelos
+                # soltos, dados dos moldes no modo fragmentos) não mudam as
+                # pastas: nesse caso só a raiz é relida
+                if set(_nomes_pastas(self.caminho)) != set(self._pastas):
+                    self._montar()
+                    return
+                self._mtime_base = mtime_base
+                self._reler_raiz()
+        except OSError:
+            self._montar()
+            return
+        for nome, diretorios in list(self._diretorios.items()):
+            if (any(_mtime(diretorio) != mtime for diretorio, mtime in diretorios.items())
+                    or self._modelos_alterados(nome)):
+                self._reler(nome)
+        if self._modelos_alterados(''):
+            self._reler_raiz()
+
+    # Um .stp sobrescrito no lugar não muda a data da pasta: confere o tamanho
+    # e a data de cada modelo já indexado
+    def _modelos_alterados(self, nome):
+        for arquivo, tamanho, mtime in self._modelos.get(nome, {}).values():
+            info = _info(os.path.join(self.caminho, arquivo))
+            if info is None or (info.st_size, info.st_mtime) != (tamanho, mtime):
+                return True
+        return False
+
+    # Varre a pasta inteira
+    def _montar(self):
+        self._conferido_em = time.monotonic()
+        self._tudo_sujo = False
+        self._sujas.clear()
+        self._pastas = {}
+        self._diretorios = {}
+        self._modelos = {}
+        try:
+            self._mtime_base = os.stat(self.caminho).st_mtime_ns
+            nomes = _nomes_pastas(self.caminho)
+        except OSError as e:
+            # Tenta de novo na próxima conferência
+            self._erro = str(e)
+            self._mtime_base = None
+            return
+        self._erro = None
+        for nome in nomes:
+            self._reler(nome)
+        self._reler_raiz()
+        self._observar()
+
+    # Varre só a pasta de um molde
+    def _reler(self, nome):
+        raiz = os.path.join(self.caminho, nome)
+        if not os.path.isdir(raiz):
+            self._pastas.pop(nome, None)
+            self._diretorios.pop(nome, None)
+            self._modelos.pop(nome, None)
+            return
+
+        modelos = {}
+        modificado = 0
+        diretorios = {}
+        for diretorio, _, arquivos in os.walk(raiz):
+            mtime = _mtime(diretorio)
+            diretorios[diretorio] = mtime
+            modificado = max(modificado, mtime or 0)
+            for arquivo in arquivos:
+                if arquivo.lower().endswith(EXTENSOES_MODELO):
+                    caminho = os.path.join(diretorio, arquivo)
+                    info = _info(caminho)
+                    if info is None:
+                        continue
+                    modificado = max(modificado, info.st_mtime_ns)
+                    codigo = chave_item(os.path.splitext(arquivo)[0])
+                    modelos[codigo] = (caminho_relativo(caminho, self.caminho), info.st_size, info.st_mtime)
+
+        self._diretorios[nome] = diretorios
+        self._modelos[nome] = modelos
+        self._pastas[nome] = {
+            'tipo': 'pasta',
+            'nome': nome,
+            'modelos': len(modelos),
+            'modificado': datetime.fromtimestamp(modificado / 1e9) if modificado else None,
+        }
+
+    # Arquivos soltos direto em media/modelos (sem pasta de molde)
+    def _reler_raiz(self):
+        modelos = {}
+        try:
+            entradas = list(os.scandir(self.caminho))
+        except OSError:
+            entradas = []
+        for entrada in entradas:
+            if entrada.is_file() and entrada.name.lower().endswith(EXTENSOES_MODELO):
+                info = entrada.stat()
+                codigo = chave_item(os.path.splitext(entrada.name)[0])
+                modelos[codigo] = (entrada.name, info.st_size, info.st_mtime)
+        self._modelos[''] = modelos
+
+    # Liga as notificações do watchdog, se disponível
+    def _observar(self):
+        if Observer is None or self._observador is not None:
+            return
+        if not getattr(settings, 'PASTAS_MODELOS_NOTIFICACOES', True):
+            return
+        try:
+            observador = Observer()
+            observador.schedule(_Avisos(self), self.caminho, recursive=True)
+            observador.daemon = True
+            observador.start()
+        except Exception:
+            logger.warning("Notificações indisponíveis em %s; conferindo as datas das pastas.",
+                           self.caminho, exc_info=True)
+            return
+        self._observador = observador
+
+    # Chamado pelo watchdog (na thread dele) para cada caminho alterado
+    def avisar(self, caminho, diretorio):
+        partes = os.path.relpath(caminho, self.caminho).split(os.sep)
+        if partes[0] in ('.', '..') or partes[0] in PASTAS_IGNORADAS:
+            # A própria pasta de modelos, ou algo fora dela
+            if partes[0] == '.':
+                with self._lock:
+                    self._tudo_sujo = True
+            return
+        with self._lock:
+            if len(partes) == 1:
+                # Molde criado, apagado ou renomeado
+                if diretorio or partes[0] in self._pastas:
+                    self._tudo_sujo = True
+                elif partes[0].lower().endswith(EXTENSOES_MODELO):
+                    self._sujas.add('')
+            else:
+                self._sujas.add(partes[0])
+
+
+class _Avisos(FileSystemEventHandler):
+    def __init__(self, indice):
+        super().__init__()
+        self.indice = indice
+
+    def on_any_event(self, event):
+        if event.event_type in ('opened', 'closed', 'closed_no_write'):
+            return
+        # Diretório "modificado" só repete o aviso do arquivo criado/apagado nele
+        if event.is_directory and event.event_type == 'modified':
+            return
+        self.indice.avisar(event.src_path, event.is_directory)
+        if getattr(event, 'dest_path', ''):
+            self.indice.avisar(event.dest_path, event.is_directory)
+
+
+# Pastas de moldes dentro de media/modelos
+def _nomes_pastas(caminho):
+    return [
+        entrada.name for entrada in os.scandir(caminho)
+        if entrada.is_dir() and entrada.name not in PASTAS_IGNORADAS
+    ]
+
+
+def _info(caminho):
+    try:
+        return os.stat(caminho)
+    except OSError:
+        return None
+
+
+def _mtime(caminho):
+    info = _info(caminho)
+    return None if info is None else info.st_mtime_ns
+
+
+_indices = {}
+_indices_lock = threading.Lock()
+
+
+# Índice único por pasta, compartilhado pelas views
+def indice_de_pastas(caminho=None):
+    caminho = os.path.abspath(caminho or pasta_modelos())
+    with _indices_lock:
+        if caminho not in _indices:
+            _indices[caminho] = IndicePastas(caminho, getattr(settings, 'PASTAS_MODELOS_INTERVALO', 5))
+        return _indices[caminho]
+
+
+# Previews dos itens de uma página: {código do item: (imagem, versão)}, resolvidos
+# com o índice em memória e uma única consulta à fila de renderização, só para
+# os códigos pedidos. Tamanho e data vêm do índice, que já vê os modelos
+# sobrescritos no lugar; novos ou alterados são colocados na fila, como em /modelos.
+def previews_do_molde(molde, codigos):
+    indexados = indice_de_pastas().modelos(molde)
+    modelos = {codigo: indexados[codigo] for codigo in map(chave_item, codigos) if codigo in indexados}
+    if not modelos:
+        return {}
+    jobs = fila_render.estados_de(arquivo for arquivo, _, _ in modelos.values())
+    novos = []
+    for arquivo, tamanho, mtime in modelos.values():
+        prioridade = fila_render.prioridade_na_fila(jobs.get(arquivo), tamanho, mtime)
+        if prioridade is not None:
+            novos.append((arquivo, tamanho, mtime, prioridade))
+    if novos:
+        fila_render.enfileirar(novos)
+    return {
+        codigo: (jobs[arquivo]['imagem'], fila_render.versao_preview(jobs[arquivo]['chave']))
+        for codigo, (arquivo, _, _) in modelos.items()
+        if arquivo in jobs and jobs[arquivo]['imagem']
+    }
@@ -0,0 +1,219 @@
+import os
+import threading
+import zipfile
+from xml.etree import ElementTree
+from openpyxl import load_workbook
+from . import disco
+from .consulta import IndiceAba
+from .metricas import medir
+from .status import calcular_status, classificar
+
+# Acesso aos dados do moldes.xlsx usado pelas views.
+#
+# A leitura é feita em modo streaming (read_only), só da aba pedida e só das
+# 11 primeiras colunas; os nomes das abas vêm do índice do arquivo
+# (xl/workbook.xml), sem carregar nenhuma aba.
+#
+# O cache, compartilhado por todas as requisições do processo, guarda as
+# linhas já lidas. Cada aba só é lida na primeira vez que alguém abre aquele
+# molde; tudo é descartado quando o arquivo muda em disco (data, tamanho ou
+# identidade diferentes). Alterações feitas pela aplicação são aplicadas
+# direto nas linhas em cache (veja diario.py).
+
+# Quantidade de colunas lidas de cada linha (item, aço, programa, máquinas 1 a 6)
+COLUNAS = 11
+
+# Coluna da planilha de cada campo de checkbox
+COLUNAS_CAMPOS = {
+    'chegada_aco': 4,
+    'programa': 5,
+    'maquina_1': 6,
+    'maquina_2': 7,
+    'maquina_3': 8,
+    'maquina_4': 9,
+    'maquina_5': 10,
+    'maquina_6': 11,
+}
+
+
+# Uma linha da aba de um molde. As posições seguem as colunas da planilha:
+# B = item, D = chegada do aço, E = programa, F a K = máquinas 1 a 6
+class LinhaMolde:
+    __slots__ = (
+        'linha', 'item', 'chegada_aco', 'programa',
+        'maquina_1', 'maquina_2', 'maquina_3', 'maquina_4', 'maquina_5', 'maquina_6',
+        'status_custom',
+    )
+
+    def __init__(self, linha, valores):
+        self.linha = linha
+        self.item = valores[1]
+        self.chegada_aco = bool(valores[3])
+        self.programa = bool(valores[4])
+        (self.maquina_1, self.maquina_2, self.maquina_3,
+         self.maquina_4, self.maquina_5, self.maquina_6) = (bool(v) for v in valores[5:11])
+        # Preenchido por status.classificar(), para a aba inteira de uma vez
+        self.status_custom = None
+
+    @property
+    def maquinas(self):
+        return (self.maquina_1, self.maquina_2, self.maquina_3,
+                self.maquina_4, self.maquina_5, self.maquina_6)
+
+    @property
+    def em_maquina(self):
+        return any(self.maquinas)
+
+
+# Nomes das abas lidos direto do índice do arquivo (xl/workbook.xml)
+def nomes_abas(caminho):
+    with medir('planilha_abas'), zipfile.ZipFile(caminho) as arquivo:
+        raiz = ElementTree.fromstring(arquivo.read('xl/workbook.xml'))
+    # Compara só o nome local da tag para aceitar os dois namespaces do formato
+    return [
+        elemento.get('name') for elemento in raiz.iter()
+        if elemento.tag.rsplit('}', 1)[-1] == 'sheet'
+    ]
+
+
+# Lê uma aba em modo streaming, a partir da 2ª linha (a 1ª é o cabeçalho), e
+# calcula o status de todas as linhas de uma vez
+def ler_aba(caminho, aba):
+    with medir('planilha_abrir'):
+        wb = load_workbook(caminho, read_only=True, data_only=True)
+    try:
+        with medir('planilha_ler'):
+            valores = wb[aba].iter_rows(min_row=2, max_col=COLUNAS, values_only=True)
+            linhas = [LinhaMolde(numero, v) for numero, v in enumerate(valores, start=2)]
+    finally:
+        # Em modo read_only o arquivo fica aberto até fechar o workbook
+        wb.close()
+    classificar(linhas)
+    return linhas
+
+
+class CachePlanilha:
+    def __init__(self, caminho):
+        self.caminho = caminho
+        self._lock = threading.Lock()
+        self._assinatura = None
+        self._abas = None
+        self._linhas = {}
+        # Índices de consulta (consulta.IndiceAba) das abas já lidas
+        self._indices = {}
+        # Muda toda vez que o cache é descartado (arquivo alterado por fora)
+        self.geracao = 0
+        self.acertos = 0
+        self.falhas = 0
+
+    # Identidade do arquivo em disco; muda quando alguém salva a planilha
+    def _assinatura_atual(self):
+        return disco.assinatura(self.caminho)
+
+    # Descarta o que estiver em cache se o arquivo mudou desde a leitura
+    def _conferir(self):
+        assinatura = self._assinatura_atual()
+        if assinatura != self._assinatura:
+            self._assinatura = assinatura
+            self._abas = None
+            self._linhas = {}
+            self._indices = {}
+            self.geracao += 1
+
+    def existe(self):
+        return os.path.exists(self.caminho)
+
+    # Nomes das abas (um molde por aba)
+    def abas(self):
+        with self._lock:
+            self._conferir()
+            if self._abas is None:
+                self.falhas += 1
+                self._abas = nomes_abas(self.caminho)
+            else:
+                self.acertos += 1
+            return self._abas
+
+    # Linhas (LinhaMolde) de uma aba
+    def linhas(self, aba):
+        with self._lock:
+            return self._ler_linhas(aba)
+
+    # Chamado com self._lock
+    def _ler_linhas(self, aba):
+        self._conferir()
+        if aba in self._linhas:
+            self.acertos += 1
+            return self._linhas[aba]
+
+        self.falhas += 1
+        linhas = ler_aba(self.caminho, aba)
+        self._linhas[aba] = linhas
+        return linhas
+
+    # Índice de consulta de uma aba (filtros e paginação), montado uma vez por
+    # leitura da aba e atualizado a cada alteração
+    def indice(self, aba):
+        linhas = self.linhas(aba)
+        with self._lock:
+            indice = self._indices.get(aba)
+            if indice is None or indice.linhas is not linhas:
+                indice = self._indices[aba] = IndiceAba(linhas)
+            return indice
+
+    # Aplica alterações ainda não gravadas na planilha (diário) nas linhas em
+    # cache e devolve o novo status de cada linha alterada.
+    # alteracoes: {número da linha: {campo: True/False}}
+    def aplicar(self, aba, alteracoes):
+        status = {}
+        with self._lock:
+            linhas = self._ler_linhas(aba)
+            indice = self._indices.get(aba)
+            for linha in linhas:
+                campos = alteracoes.get(linha.linha)
+                if campos:
+                    for campo, valor in campos.items():
+                        setattr(linha, campo, valor)
+                    linha.status_custom = calcular_status(linha)
+                    status[linha.linha] = linha.status_custom
+                    if indice is not None:
+                        indice.atualizar(linha)
+        return status
+
+    # Chamado depois que o diário grava a planilha: se o cache estava em dia
+    # com o arquivo anterior, ele já tem as alterações gravadas e só passa a
+    # aceitar o arquivo novo, sem ler tudo de novo
+    def confirmar_gravacao(self, assinatura_anterior):
+        with self._lock:
+            if self._assinatura == assinatura_anterior:
+                self._assinatura = self._assinatura_atual()
+
+    def estatisticas(self):
+        return {
+            'acertos': self.acertos,
+            'falhas': self.falhas,
+            'abas_em_cache': len(self._linhas),
+        }
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+# Cache único por arquivo, compartilhado pelas views
+def cache_da_planilha(caminho):
+    caminho = os.path.abspath(caminho)
+    with _caches_lock:
+        if caminho not in _caches:
+            _caches[caminho] = CachePlanilha(caminho)
+        return _caches[caminho]
+
+
+# Acertos e falhas somados dos caches do processo (expostos em /metrics)
+def estatisticas_dos_caches():
+    with _caches_lock:
+        estatisticas = [cache.estatisticas() for cache in _caches.values()]
+    return {
+        'acertos': sum(cache['acertos'] for cache in estatisticas),
+        'falhas': sum(cache['falhas'] for cache in estatisticas),
+    }
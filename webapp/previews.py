@@ -0,0 +1,158 @@
+import os
+import shutil
+import time
+from django.conf import settings
+from . import fila_render
+# Bibliotecas da OCC (OpenCascade) para ler arquivos STEP e renderizar imagens
+from OCC.Core.STEPControl import STEPControl_Reader
+from OCC.Core.IFSelect import IFSelect_RetDone
+from OCC.Core.BRepMesh import BRepMesh_IncrementalMesh
+from OCC.Display.OCCViewer import OffscreenRenderer
+# Pillow gera as versões menores (WebP/JPEG) a partir da imagem renderizada
+from PIL import Image
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+# Pastas usadas pelo visualizador de modelos
+def pasta_modelos():
+    return os.path.join(settings.MEDIA_ROOT, 'modelos')
+
+
+def pasta_previews():
+    return os.path.join(pasta_modelos(), 'previews')
+
+
+# Nome da imagem gerada para um arquivo .stp
+nome_imagem = fila_render.nome_imagem
+
+
+# Gera, a partir da imagem renderizada, as versões em cada largura de
+# PREVIEWS_RENDER['larguras'] em WebP e JPEG (ex.: peca-160.webp, peca-160.jpg)
+def gerar_variantes(caminho_png):
+    base = os.path.splitext(caminho_png)[0]
+    with Image.open(caminho_png) as original:
+        original = original.convert('RGB')
+        for largura in settings.PREVIEWS_RENDER['larguras']:
+            if largura < original.width:
+                altura = round(original.height * largura / original.width)
+                imagem = original.resize((largura, altura), Image.LANCZOS)
+            else:
+                imagem = original
+            imagem.save(f'{base}-{largura}.webp', 'WEBP', quality=80, method=4)
+            imagem.save(f'{base}-{largura}.jpg', 'JPEG', quality=82, optimize=True, progressive=True)
+
+
+# Garante que as versões menores existem (previews gerados antes delas)
+def conferir_variantes(caminho_png):
+    pasta = os.path.dirname(caminho_png)
+    variantes = fila_render.nomes_variantes(os.path.basename(caminho_png))
+    if not all(os.path.exists(os.path.join(pasta, nome)) for nome in variantes):
+        gerar_variantes(caminho_png)
+
+
+# Memória residente do processo atual em MB (None se não for possível medir)
+def uso_memoria_mb():
+    if psutil is not None:
+        return psutil.Process().memory_info().rss / (1024 * 1024)
+    try:
+        with open('/proc/self/statm') as f:
+            paginas = int(f.read().split()[1])
+        return paginas * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024)
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+# Renderizador que mantém o contexto gráfico offscreen aberto entre modelos.
+# Criar o OffscreenRenderer é a parte cara; cada processo do serviço cria um
+# só e limpa a cena antes de cada peça.
+class RenderizadorPreview:
+    def __init__(self):
+        config = settings.PREVIEWS_RENDER
+        self.renderer = OffscreenRenderer(screen_size=(config['largura'], config['altura']))
+        self.transparencia = config['transparencia']
+        self.deflexao = config['deflexao']
+        self.jobs = 0
+
+    # Gera a imagem do arquivo .stp e devolve o tempo (em segundos) de cada etapa:
+    # leitura, transferencia, tesselacao, renderizacao e codificacao
+    def renderizar(self, caminho_stp, caminho_png):
+        tempos = {}
+        inicio = time.perf_counter()
+
+        def marcar(etapa):
+            nonlocal inicio
+            agora = time.perf_counter()
+            tempos[etapa] = agora - inicio
+            inicio = agora
+
+        # Lê o arquivo STEP
+        reader = STEPControl_Reader()
+        status = reader.ReadFile(caminho_stp)
+        if status != IFSelect_RetDone:
+            raise Exception(f"Erro ao ler o arquivo STEP: {caminho_stp}")
+        marcar('leitura')
+
+        # Transfere o conteúdo do arquivo STEP para a variável shape (forma 3D)
+        reader.TransferRoots()
+        shape = reader.OneShape()
+        marcar('transferencia')
+
+        # Gera a malha antes de exibir, para medir essa etapa separadamente
+        BRepMesh_IncrementalMesh(shape, self.deflexao, False, 0.5, True)
+        marcar('tesselacao')
+
+        # Limpa a peça anterior e exibe a nova, reaproveitando o mesmo contexto
+        self.renderer.EraseAll()
+        self.renderer.DisplayShape(shape, transparency=self.transparencia, update=True, dump_image=False)
+        marcar('renderizacao')
+
+        # Salva a imagem no caminho indicado e as versões menores
+        self.renderer.View.Dump(caminho_png)
+        gerar_variantes(caminho_png)
+        marcar('codificacao')
+
+        # Solta a peça da cena para a memória não acumular até o próximo job
+        self.renderer.EraseAll()
+        self.jobs += 1
+        return tempos
+
+
+# Função mantida para quem precisa gerar um único preview avulso
+def gerar_preview_stp_para_png(caminho_stp, caminho_png):
+    return RenderizadorPreview().renderizar(caminho_stp, caminho_png)
+
+
+# Gera o preview de um job da fila. Antes de renderizar confere o hash do
+# conteúdo: se a geometria é a mesma do preview atual (ou de outro arquivo já
+# renderizado), só reaproveita a imagem.
+# Devolve o nome da imagem, a chave do preview e os tempos de cada etapa
+# (None quando não houve renderização).
+def processar_preview(job, renderizador=None):
+    arquivo = job['arquivo']
+    caminho_stp = os.path.join(pasta_modelos(), arquivo)
+    imagem = nome_imagem(arquivo)
+    caminho_png = os.path.join(pasta_previews(), imagem)
+    os.makedirs(os.path.dirname(caminho_png), exist_ok=True)
+
+    chave = fila_render.chave_preview(fila_render.hash_arquivo(caminho_stp), os.path.getsize(caminho_stp))
+
+    # Mesmo conteúdo do preview atual: nada a renderizar
+    if job['chave'] == chave and os.path.exists(caminho_png):
+        conferir_variantes(caminho_png)
+        return imagem, chave, None
+
+    # Outro arquivo com a mesma geometria já tem preview: copia a imagem
+    imagem_igual = fila_render.imagem_com_chave(chave)
+    if imagem_igual and os.path.exists(os.path.join(pasta_previews(), imagem_igual)):
+        if imagem_igual != imagem:
+            shutil.copyfile(os.path.join(pasta_previews(), imagem_igual), caminho_png)
+            gerar_variantes(caminho_png)
+        return imagem, chave, None
+
+    if renderizador is None:
+        renderizador = RenderizadorPreview()
+    tempos = renderizador.renderizar(caminho_stp, caminho_png)
+    return imagem, chave, tempos
@@ -0,0 +1,245 @@
+import hashlib
+import logging
+import os
+import threading
+from datetime import date, datetime, time
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from openpyxl import Workbook, load_workbook
+from openpyxl.utils import get_column_letter
+from .models import CAMPOS_CHECKBOX, Item, Molde
+from . import historico
+from .disco import gravar_atomico
+from .metricas import medir
+from .painel import recalcular_no_banco
+from .planilha import COLUNAS, LinhaMolde
+from .status import classificar
+
+logger = logging.getLogger(__name__)
+
+# Importação do moldes.xlsx para o banco e exportação do banco de volta para
+# a planilha, para quem ainda trabalha com o Excel.
+
+# Colunas que têm campo próprio no Item (B = código, D a K = checkboxes)
+COLUNAS_MODELADAS = {1} | set(range(3, COLUNAS))
+
+# Valor gravado na planilha para um checkbox marcado
+MARCADO = '☑'
+
+
+# Valores das colunas sem campo próprio, por letra, em formato que cabe em JSON
+def colunas_extras(valores):
+    extras = {}
+    for indice, valor in enumerate(valores):
+        if indice in COLUNAS_MODELADAS or valor is None:
+            continue
+        if isinstance(valor, (datetime, date, time)):
+            valor = valor.isoformat()
+        elif not isinstance(valor, (str, int, float, bool)):
+            valor = str(valor)
+        extras[get_column_letter(indice + 1)] = valor
+    return extras
+
+
+def _campos_item(linha_molde, valores):
+    campos = {campo: getattr(linha_molde, campo) for campo in CAMPOS_CHECKBOX}
+    campos['codigo'] = '' if linha_molde.item is None else str(linha_molde.item)
+    campos['status'] = linha_molde.status_custom
+    campos['colunas_extras'] = colunas_extras(valores)
+    return campos
+
+
+# Valores de uma linha da planilha (colunas A a K) a partir do código, dos
+# checkboxes (na ordem de CAMPOS_CHECKBOX) e das colunas extras por letra
+def valores_da_linha(codigo, marcados, extras):
+    valores = [None] * COLUNAS
+    valores[1] = codigo
+    for indice, marcado in enumerate(marcados, start=3):
+        valores[indice] = MARCADO if marcado else None
+    for letra, valor in extras.items():
+        indice = ord(letra) - ord('A')
+        if 0 <= indice < COLUNAS:
+            valores[indice] = valor
+    return valores
+
+
+# Salva em um arquivo temporário e troca de uma vez, com rename atômico, para
+# ninguém abrir uma planilha pela metade
+def salvar_planilha(wb, caminho):
+    gravar_atomico(caminho, wb.save, sufixo='.xlsx')
+
+
+# Importa a planilha de forma incremental: abas sem alteração desde a última
+# importação são puladas e, nas outras, só as linhas novas ou alteradas são
+# gravadas. Devolve um resumo com o que foi feito em cada aba.
+def importar_planilha(caminho, remover_ausentes=False):
+    with medir('planilha_importar'):
+        return _importar_planilha(caminho, remover_ausentes)
+
+
+def _importar_planilha(caminho, remover_ausentes):
+    resumo = {}
+    wb = load_workbook(caminho, read_only=True, data_only=True)
+    try:
+        nomes = list(wb.sheetnames)
+        for ordem, nome in enumerate(nomes):
+            linhas = [
+                tuple(valores) + (None,) * (COLUNAS - len(valores))
+                for valores in wb[nome].iter_rows(max_col=COLUNAS, values_only=True)
+            ]
+            resumo[nome] = _importar_aba(nome, ordem, linhas)
+    finally:
+        wb.close()
+
+    if remover_ausentes:
+        removidos, _ = Molde.objects.exclude(nome__in=nomes).delete()
+        resumo['(removidos)'] = removidos
+    return resumo
+
+
+@transaction.atomic
+def _importar_aba(nome, ordem, linhas):
+    assinatura = hashlib.sha1(repr(linhas).encode()).hexdigest()
+    molde, criado = Molde.objects.get_or_create(nome=nome, defaults={'ordem': ordem})
+    if not criado and molde.assinatura == assinatura:
+        if molde.ordem != ordem:
+            molde.ordem = ordem
+            molde.save(update_fields=['ordem'])
+        return {'novos': 0, 'alterados': 0, 'removidos': 0, 'pulada': True}
+
+    existentes = {item.linha: item for item in molde.itens.all()}
+    novos, alterados = [], []
+    linhas_molde = [LinhaMolde(numero, valores) for numero, valores in enumerate(linhas[1:], start=2)]
+    classificar(linhas_molde)
+    for linha_molde, valores in zip(linhas_molde, linhas[1:]):
+        numero = linha_molde.linha
+        campos = _campos_item(linha_molde, valores)
+        item = existentes.pop(numero, None)
+        if item is None:
+            novos.append(Item(molde=molde, linha=numero, **campos))
+        elif any(getattr(item, campo) != valor for campo, valor in campos.items()):
+            for campo, valor in campos.items():
+                setattr(item, campo, valor)
+            alterados.append(item)
+
+    Item.objects.bulk_create(novos, batch_size=500)
+    Item.objects.bulk_update(
+        alterados, [*CAMPOS_CHECKBOX, 'codigo', 'status', 'colunas_extras'], batch_size=500
+    )
+    removidos = len(existentes)
+    if existentes:
+        Item.objects.filter(pk__in=[item.pk for item in existentes.values()]).delete()
+
+    molde.ordem = ordem
+    molde.cabecalho = [None if valor is None else str(valor) for valor in (linhas[0] if linhas else ())]
+    molde.assinatura = assinatura
+    molde.save()
+    recalcular_no_banco([molde])
+    # Páginas abertas deste molde recarregam
+    historico.registrar_recarga(nome)
+    return {'novos': len(novos), 'alterados': len(alterados), 'removidos': removidos, 'pulada': False}
+
+
+# Leva o banco para a planilha e troca o arquivo de uma vez, com rename
+# atômico, para ninguém abrir um arquivo pela metade. Se a planilha já existe,
+# só as células de código e checkboxes que mudaram são reescritas; as outras
+# colunas, a formatação, as fórmulas e as abas que não estão no banco ficam
+# como estão. Sem planilha, gera uma nova (uma aba por molde).
+def exportar_planilha(caminho):
+    with medir('planilha_exportar'):
+        if os.path.exists(caminho):
+            _atualizar_planilha(caminho)
+        else:
+            _gerar_planilha(caminho)
+
+
+# Moldes do banco com os itens de cada um: [(molde, [itens na ordem das linhas])]
+def _itens_por_molde():
+    itens_por_molde = {}
+    for item in Item.objects.order_by('molde_id', 'linha'):
+        itens_por_molde.setdefault(item.molde_id, []).append(item)
+    return [(molde, itens_por_molde.get(molde.pk, [])) for molde in Molde.objects.all()]
+
+
+def _valores_do_item(item):
+    marcados = [getattr(item, campo) for campo in CAMPOS_CHECKBOX]
+    return valores_da_linha(item.codigo or None, marcados, item.colunas_extras)
+
+
+def _gerar_planilha(caminho):
+    wb = Workbook(write_only=True)
+    for molde, itens in _itens_por_molde():
+        ws = wb.create_sheet(molde.nome)
+        ws.append(molde.cabecalho or [])
+        proxima_linha = 2
+        for item in itens:
+            # Mantém o número de linha original, preenchendo buracos
+            while proxima_linha < item.linha:
+                ws.append([])
+                proxima_linha += 1
+            ws.append(_valores_do_item(item))
+            proxima_linha += 1
+
+    salvar_planilha(wb, caminho)
+
+
+# Indica se a célula já tem o valor do banco (checkboxes pelo que o import
+# entende como marcado, código pelo texto)
+def _mesmo_valor(indice, atual, valor):
+    if indice >= 3:
+        return bool(atual) == bool(valor)
+    if indice == 1:
+        return ('' if atual is None else str(atual)) == ('' if valor is None else str(valor))
+    return atual == valor
+
+
+def _atualizar_planilha(caminho):
+    wb = load_workbook(caminho)
+    alteradas = 0
+    for molde, itens in _itens_por_molde():
+        # Molde que ainda não está na planilha: aba nova, com todas as colunas
+        nova = molde.nome not in wb.sheetnames
+        if nova:
+            ws = wb.create_sheet(molde.nome)
+            ws.append(molde.cabecalho or [])
+        ws = wb[molde.nome]
+        colunas = range(COLUNAS) if nova else sorted(COLUNAS_MODELADAS)
+        for item in itens:
+            valores = _valores_do_item(item)
+            for indice in colunas:
+                celula = ws.cell(row=item.linha, column=indice + 1)
+                if not _mesmo_valor(indice, celula.value, valores[indice]):
+                    celula.value = valores[indice]
+                    alteradas += 1
+    if alteradas:
+        salvar_planilha(wb, caminho)
+
+
+_exportacao_lock = threading.Lock()
+_exportacao_timer = None
+
+
+# Agenda a exportação em segundo plano. Várias alterações seguidas geram uma
+# só exportação, alguns segundos depois da última.
+def agendar_exportacao(atraso=None):
+    global _exportacao_timer
+    if atraso is None:
+        atraso = getattr(settings, 'EXPORTACAO_PLANILHA_ATRASO', 5)
+    caminho = os.path.join(settings.MEDIA_ROOT, 'moldes.xlsx')
+
+    with _exportacao_lock:
+        if _exportacao_timer is not None:
+            _exportacao_timer.cancel()
+        _exportacao_timer = threading.Timer(atraso, _exportar_em_segundo_plano, args=(caminho,))
+        _exportacao_timer.daemon = True
+        _exportacao_timer.start()
+
+
+def _exportar_em_segundo_plano(caminho):
+    try:
+        exportar_planilha(caminho)
+    except Exception:
+        logger.exception("Erro ao exportar %s", caminho)
+    finally:
+        # A thread abre a própria conexão com o banco; fecha ao terminar
+        close_old_connections()
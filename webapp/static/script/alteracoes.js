@@ -0,0 +1,67 @@
+// Mantém a página de um molde em dia com as alterações feitas por outras
+// pessoas, sem recarregar: consulta data-alteracoes-url a cada data-intervalo
+// segundos pedindo só o que veio depois de data-versao (304 quando não há
+// nada) e atualiza os checkboxes e o status das linhas exibidas. Checkboxes
+// mexidos aqui e ainda não salvos ficam como o usuário deixou.
+document.addEventListener("DOMContentLoaded", function () {
+  const form = document.querySelector("form[data-alteracoes-url]");
+  if (!form) {
+    return;
+  }
+
+  const url = form.dataset.alteracoesUrl;
+  const intervalo = Number(form.dataset.intervalo || 5) * 1000;
+  let versao = form.dataset.versao || "0";
+
+  function aplicar(alteracao) {
+    Object.keys(alteracao.valores).forEach(function (campo) {
+      const checkbox = form.querySelector("input[name='" + campo + "_" + alteracao.linha + "']");
+      if (!checkbox) {
+        return;
+      }
+      const valor = alteracao.valores[campo];
+      // defaultChecked guarda o último valor salvo que a página conhece
+      if (checkbox.checked !== checkbox.defaultChecked && checkbox.checked !== valor) {
+        return;
+      }
+      checkbox.checked = valor;
+      checkbox.defaultChecked = valor;
+    });
+    const celula = document.querySelector("[data-status-linha='" + alteracao.linha + "']");
+    if (celula) {
+      celula.textContent = alteracao.status;
+    }
+  }
+
+  function consultar() {
+    // Aba do navegador em segundo plano: espera ela voltar
+    if (document.hidden) {
+      setTimeout(consultar, intervalo);
+      return;
+    }
+    fetch(url + "?desde=" + encodeURIComponent(versao), { headers: { Accept: "application/json" } })
+      .then(function (resposta) {
+        // 304: nada mudou
+        return resposta.status === 200 ? resposta.json() : null;
+      })
+      .then(function (dados) {
+        if (!dados) {
+          return;
+        }
+        if (dados.recarregar) {
+          window.location.reload();
+          return;
+        }
+        dados.alteracoes.forEach(aplicar);
+        versao = String(dados.versao);
+      })
+      .catch(function () {
+        // Servidor fora do ar ou ocupado: tenta de novo na próxima vez
+      })
+      .then(function () {
+        setTimeout(consultar, intervalo);
+      });
+  }
+
+  setTimeout(consultar, intervalo);
+});
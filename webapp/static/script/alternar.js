@@ -0,0 +1,75 @@
+// Salva cada checkbox assim que ele é marcado ou desmarcado, enviando só o
+// que mudou para o endpoint indicado em data-alternar-url no formulário.
+// Alterações feitas em sequência rápida vão juntas em uma requisição.
+document.addEventListener("DOMContentLoaded", function () {
+  const form = document.querySelector("form[data-alternar-url]");
+  if (!form) {
+    return;
+  }
+
+  const url = form.dataset.alternarUrl;
+  const aba = form.querySelector("input[name='nome_aba']").value;
+  const csrf = form.querySelector("input[name='csrfmiddlewaretoken']").value;
+  let pendentes = [];
+  let timer = null;
+
+  function enviar() {
+    const lote = pendentes;
+    pendentes = [];
+    timer = null;
+
+    fetch(url, {
+      method: "POST",
+      headers: { "Content-Type": "application/json", "X-CSRFToken": csrf },
+      body: JSON.stringify({
+        aba: aba,
+        alteracoes: lote.map(function (item) {
+          return { linha: item.linha, campo: item.campo, valor: item.checkbox.checked };
+        }),
+      }),
+    })
+      .then(function (resposta) {
+        if (!resposta.ok) {
+          throw new Error("HTTP " + resposta.status);
+        }
+        return resposta.json();
+      })
+      .then(function (dados) {
+        // Atualiza a coluna de status das linhas alteradas
+        Object.keys(dados.status_custom).forEach(function (linha) {
+          const celula = document.querySelector("[data-status-linha='" + linha + "']");
+          if (celula) {
+            celula.textContent = dados.status_custom[linha];
+          }
+        });
+      })
+      .catch(function () {
+        // Volta os checkboxes para o estado anterior e avisa
+        lote.forEach(function (item) {
+          item.checkbox.checked = !item.checkbox.checked;
+        });
+        alert("Não foi possível salvar a alteração. Tente novamente.");
+      });
+  }
+
+  form.addEventListener("change", function (evento) {
+    const checkbox = evento.target;
+    const partes = checkbox.type === "checkbox" && checkbox.name.match(/^(.+)_(\d+)$/);
+    if (!partes) {
+      return;
+    }
+    // Marcar e desmarcar de novo antes do envio cancela a alteração
+    const anterior = pendentes.findIndex(function (item) {
+      return item.checkbox === checkbox;
+    });
+    if (anterior >= 0) {
+      pendentes.splice(anterior, 1);
+    } else {
+      pendentes.push({ linha: Number(partes[2]), campo: partes[1], checkbox: checkbox });
+    }
+    if (timer) {
+      clearTimeout(timer);
+    }
+    timer = setTimeout(enviar, 300);
+  });
+});
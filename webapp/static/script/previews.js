@@ -0,0 +1,120 @@
+// Atualiza a página de modelos conforme o serviço de renderização termina
+// cada preview. Usa server-sent events (data-eventos-url) e, se o navegador
+// ou o servidor não suportarem (no WSGI o servidor responde 204), consulta
+// data-estado-url a cada poucos segundos. Para quando não há mais nenhum
+// preview aguardando.
+document.addEventListener("DOMContentLoaded", function () {
+  const grade = document.getElementById("previews");
+  if (!grade) {
+    return;
+  }
+
+  let desde = grade.dataset.desde || "0";
+  let fonte = null;
+  let conectou = false;
+
+  function cartao(arquivo) {
+    const cartoes = grade.querySelectorAll("[data-arquivo]");
+    for (let i = 0; i < cartoes.length; i++) {
+      if (cartoes[i].dataset.arquivo === arquivo) {
+        return cartoes[i];
+      }
+    }
+    // Modelo que entrou na fila depois de a página abrir
+    const novo = document.createElement("div");
+    novo.className = "item";
+    novo.dataset.arquivo = arquivo;
+    novo.style.cssText = "margin: 10px; display: inline-block; text-align: center;";
+    const nome = document.createElement("p");
+    nome.textContent = arquivo;
+    novo.appendChild(document.createElement("div"));
+    novo.appendChild(nome);
+    grade.appendChild(novo);
+    return novo;
+  }
+
+  function atualizar(modelo) {
+    const item = cartao(modelo.nome);
+    let conteudo;
+    if (modelo.html) {
+      conteudo = document.createElement("a");
+      conteudo.href = modelo.imagem_url;
+      conteudo.target = "_blank";
+      conteudo.innerHTML = modelo.html;
+    } else {
+      conteudo = document.createElement("div");
+      conteudo.className = "aguardando";
+      if (modelo.estado === "erro") {
+        conteudo.className += " erro";
+        conteudo.title = modelo.erro || "";
+        conteudo.textContent = "Erro ao gerar";
+      } else {
+        conteudo.textContent = "Gerando preview...";
+      }
+    }
+    item.replaceChild(conteudo, item.firstElementChild);
+  }
+
+  function aguardando() {
+    return grade.querySelector(".aguardando:not(.erro)") !== null;
+  }
+
+  function aplicar(dados) {
+    desde = String(dados.desde);
+    dados.modelos.forEach(atualizar);
+  }
+
+  function consultar() {
+    if (!aguardando()) {
+      return;
+    }
+    fetch(grade.dataset.estadoUrl + "?desde=" + encodeURIComponent(desde))
+      .then(function (resposta) {
+        return resposta.json();
+      })
+      .then(aplicar)
+      .catch(function () {})
+      .then(function () {
+        setTimeout(consultar, 3000);
+      });
+  }
+
+  function desistir() {
+    fonte.close();
+    consultar();
+  }
+
+  function ouvir() {
+    fonte = new EventSource(grade.dataset.eventosUrl + "?desde=" + encodeURIComponent(desde));
+    // Conexão que não abre em poucos segundos (ex.: proxy segurando a
+    // resposta): passa a consultar por JSON
+    const espera = setTimeout(desistir, 5000);
+    fonte.onopen = function () {
+      conectou = true;
+      clearTimeout(espera);
+    };
+    fonte.onmessage = function (evento) {
+      aplicar(JSON.parse(evento.data));
+      if (!aguardando()) {
+        fonte.close();
+      }
+    };
+    fonte.onerror = function () {
+      // Se nunca conectou, o servidor provavelmente não suporta SSE; se já
+      // conectou, o EventSource reconecta sozinho
+      if (!conectou) {
+        clearTimeout(espera);
+        desistir();
+      }
+    };
+  }
+
+  if (!aguardando()) {
+    return;
+  }
+  if (window.EventSource) {
+    ouvir();
+  } else {
+    consultar();
+  }
+});
@@ -0,0 +1,118 @@
+# Classificação do status de produção dos itens, usada por todas as telas,
+# pelo painel, pela importação/exportação e pelo endpoint JSON.
+#
+# Uma aba inteira é classificada de uma vez: cada campo (aço, programa,
+# máquinas 1 a 6) vira uma coluna de bytes 0/1, uma posição por linha. As
+# colunas são convertidas em inteiros e combinadas com operações de bits
+# (um byte por linha), o que dá um código de 0 a 7 por linha; o código vira o
+# status com bytes.translate. Todo o trabalho pesado roda em C, sem laço em
+# Python por linha.
+
+from .metricas import medir
+
+# Status possíveis de um item, na ordem do fluxo de produção
+STATUS = (
+    "Aguardando aço e programa",
+    "Aguardando aço",
+    "Aguardando programa",
+    "Pronto para usinar",
+    "Usinando",
+)
+
+# Campos de máquina, na ordem das colunas F a K
+CAMPOS_MAQUINAS = tuple(f'maquina_{n}' for n in range(1, 7))
+
+# Bits do código de cada linha
+ACO = 1
+PROGRAMA = 2
+MAQUINA = 4
+
+
+# A regra de negócio, escrita uma única vez: código da linha -> status
+def _regra(codigo):
+    aco = bool(codigo & ACO)
+    programa = bool(codigo & PROGRAMA)
+    em_maquina = bool(codigo & MAQUINA)
+    if aco and programa and not em_maquina:
+        return "Pronto para usinar"
+    elif aco and programa and em_maquina:
+        return "Usinando"
+    elif aco and not programa:
+        return "Aguardando programa"
+    elif programa and not aco:
+        return "Aguardando aço"
+    return "Aguardando aço e programa"
+
+
+# Tabela para bytes.translate: código (0 a 7) -> posição em STATUS
+TABELA = bytes(STATUS.index(_regra(codigo & 7)) for codigo in range(256))
+
+
+# Status de um único item (qualquer objeto com os campos de checkbox)
+def calcular_status(linha):
+    codigo = (ACO if linha.chegada_aco else 0) | (PROGRAMA if linha.programa else 0)
+    if any(getattr(linha, campo) for campo in CAMPOS_MAQUINAS):
+        codigo |= MAQUINA
+    return STATUS[TABELA[codigo]]
+
+
+# Campos de checkbox de uma aba inteira em colunas de bytes 0/1
+class Colunas:
+    def __init__(self, chegada_aco, programa, maquinas):
+        self.chegada_aco = chegada_aco
+        self.programa = programa
+        # Uma coluna por máquina, na ordem de CAMPOS_MAQUINAS
+        self.maquinas = maquinas
+        self.tamanho = len(chegada_aco)
+
+    # Monta as colunas a partir das linhas (LinhaMolde ou Item)
+    @classmethod
+    def de_linhas(cls, linhas):
+        linhas = list(linhas)
+        return cls(
+            bytes(bool(linha.chegada_aco) for linha in linhas),
+            bytes(bool(linha.programa) for linha in linhas),
+            [bytes(bool(getattr(linha, campo)) for linha in linhas) for campo in CAMPOS_MAQUINAS],
+        )
+
+    # Código de cada linha (um byte por linha), calculado com operações de bits
+    # sobre a aba inteira
+    def codigos(self):
+        if not self.tamanho:
+            return b''
+        em_maquina = 0
+        for coluna in self.maquinas:
+            em_maquina |= _inteiro(coluna)
+        codigo = _inteiro(self.chegada_aco) | (_inteiro(self.programa) << 1) | (em_maquina << 2)
+        return codigo.to_bytes(self.tamanho, 'little')
+
+    # Posição em STATUS de cada linha (um byte por linha)
+    def indices(self):
+        return self.codigos().translate(TABELA)
+
+    # Status de cada linha, na ordem das linhas
+    def status(self):
+        return [STATUS[indice] for indice in self.indices()]
+
+    # Quantidade de linhas em cada status e marcadas em cada máquina
+    def contagens(self):
+        indices = self.indices()
+        contagens = {status: indices.count(posicao) for posicao, status in enumerate(STATUS)}
+        for campo, coluna in zip(CAMPOS_MAQUINAS, self.maquinas):
+            contagens[campo] = _inteiro(coluna).bit_count()
+        return {chave: quantidade for chave, quantidade in contagens.items() if quantidade}
+
+
+def _inteiro(coluna):
+    return int.from_bytes(coluna, 'little')
+
+
+# Classifica as linhas de uma vez e grava o status em cada uma (no atributo
+# indicado). Devolve as colunas, para quem ainda precisar contar.
+def classificar(linhas, atributo='status_custom'):
+    with medir('status'):
+        linhas = list(linhas)
+        colunas = Colunas.de_linhas(linhas)
+        for linha, status in zip(linhas, colunas.status()):
+            setattr(linha, atributo, status)
+    return colunas
@@ -0,0 +1,47 @@
+import os
+from urllib.parse import quote
+from django import template
+from django.conf import settings
+from django.utils.html import format_html
+from webapp.pastas import chave_item
+
+register = template.Library()
+
+
+# Monta o <picture> de um preview com as versões WebP/JPEG geradas pelo
+# serviço de renderização, para o navegador baixar só o tamanho que vai exibir.
+# nome: imagem ou arquivo .stp, relativo à pasta de modelos; largura: largura
+# exibida em px; versao: versão do preview (fila_render.versao_preview), que
+# vai na URL para o navegador guardar a imagem sem revalidar
+@register.simple_tag
+def imagem_preview(nome, largura, classe='', versao=''):
+    base = settings.MEDIA_URL + 'modelos/previews/' + quote(os.path.splitext(str(nome))[0])
+    larguras = sorted(settings.PREVIEWS_RENDER['larguras'])
+    sufixo = f'?v={versao}' if versao else ''
+
+    srcset_webp = ', '.join(f'{base}-{l}.webp{sufixo} {l}w' for l in larguras)
+    srcset_jpg = ', '.join(f'{base}-{l}.jpg{sufixo} {l}w' for l in larguras)
+    # Navegadores sem srcset recebem a menor versão que cobre a largura exibida
+    padrao = next((l for l in larguras if l >= int(largura)), larguras[-1])
+
+    return format_html(
+        '<picture>'
+        '<source type="image/webp" srcset="{}" sizes="{}px">'
+        '<img src="{}-{}.jpg{}" srcset="{}" sizes="{}px" width="{}" class="{}" alt="{}" '
+        'loading="lazy" decoding="async">'
+        '</picture>',
+        srcset_webp, largura,
+        base, padrao, sufixo, srcset_jpg, largura, largura, classe, nome,
+    )
+
+
+# Preview do item de uma página de molde. previews é o dicionário
+# {código do item: (imagem, versão)} montado pela view (pastas.previews_do_molde);
+# itens sem preview pronto mostram só um aviso no lugar da imagem.
+@register.simple_tag
+def preview_do_item(previews, codigo, largura, classe=''):
+    preview = previews.get(chave_item(codigo))
+    if preview is None:
+        return format_html('<span class="sem-preview">Sem preview</span>')
+    imagem, versao = preview
+    return imagem_preview(imagem, largura, classe, versao)
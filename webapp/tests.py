@@ -1,3 +1,375 @@
-from django.test import TestCase
+import json
+import os
+import shutil
+import stat
+import tempfile
+import unittest
+from django.test import SimpleTestCase, TestCase, override_settings
+from openpyxl import Workbook, load_workbook
+from . import fila_render, historico, sincronizacao
+from .armazenamento import ArmazenamentoBanco, ArmazenamentoFragmentos, ArmazenamentoPlanilha
+from .consulta import Filtro
+from .diario import DiarioOcupado, DiarioPlanilha, diario_da_planilha
+from .disco import travar
+from .fragmentos import fragmentar_planilha
+from .models import CAMPOS_CHECKBOX
+from .pastas import previews_do_molde
+from .sincronizacao import MARCADO, importar_planilha
 
-# Create your tests here.
+CABECALHO = ['#', 'Item', 'Descrição', 'Aço', 'Programa', 'M1', 'M2', 'M3', 'M4', 'M5', 'M6']
+
+
+# Planilha pequena: {aba: [(código, aço, programa, máquina 1)]}
+def criar_planilha(caminho, abas):
+    wb = Workbook()
+    wb.remove(wb.active)
+    for nome, itens in abas.items():
+        ws = wb.create_sheet(nome)
+        ws.append(CABECALHO)
+        for numero, (codigo, aco, programa, maquina) in enumerate(itens, start=1):
+            ws.append([numero, codigo, f'Peça {codigo}',
+                       MARCADO if aco else None, MARCADO if programa else None,
+                       MARCADO if maquina else None, None, None, None, None, None])
+    wb.save(caminho)
+
+
+# Cada teste com uma pasta media/ própria (planilha, modelos e fila de renderização)
+class ComPastaTemporaria:
+    def setUp(self):
+        super().setUp()
+        self.pasta = tempfile.mkdtemp(prefix='simoldes_testes_')
+        self.addCleanup(shutil.rmtree, self.pasta, ignore_errors=True)
+        configuracao = override_settings(
+            MEDIA_ROOT=self.pasta,
+            PREVIEWS_FILA=os.path.join(self.pasta, 'modelos', 'previews', 'fila_render.sqlite3'),
+            EXPORTACAO_PLANILHA_ATRASO=3600,
+        )
+        configuracao.enable()
+        self.addCleanup(configuracao.disable)
+        os.makedirs(os.path.join(self.pasta, 'modelos', 'previews'))
+        self.planilha = os.path.join(self.pasta, 'moldes.xlsx')
+
+
+class DiarioTests(ComPastaTemporaria, SimpleTestCase):
+    def setUp(self):
+        super().setUp()
+        criar_planilha(self.planilha, {'A': [('1001', False, False, False), ('1002', True, False, False)]})
+
+    def diario(self):
+        diario = DiarioPlanilha(self.planilha)
+        self.addCleanup(diario.encerrar)
+        return diario
+
+    def escrever_diario(self, *entradas, sobra=''):
+        with open(self.planilha + '.diario', 'w', encoding='utf-8') as f:
+            for entrada in entradas:
+                f.write(json.dumps(entrada) + '\n')
+            f.write(sobra)
+
+    def test_recuperar_reaplica_o_que_ficou_no_diario(self):
+        self.escrever_diario(
+            {'aba': 'A', 'linha': 2, 'campo': 'programa', 'valor': True},
+            {'aba': 'A', 'linha': 3, 'campo': 'chegada_aco', 'valor': False},
+            {'aba': 'A', 'linha': 2, 'campo': 'programa', 'valor': False},
+            {'aba': 'A', 'linha': 2, 'campo': 'programa', 'valor': True},
+            # Linha cortada por uma queda no meio da escrita
+            sobra='{"aba": "A", "lin',
+        )
+        diario = self.diario()
+        diario.recuperar()
+        self.assertEqual(diario.pendentes('A'), {2: {'programa': True}, 3: {'chegada_aco': False}})
+
+        self.assertEqual(diario.gravar(), 4)
+        ws = load_workbook(self.planilha)['A']
+        self.assertEqual(ws['E2'].value, MARCADO)
+        self.assertIn(ws['D3'].value, ('', None))
+        self.assertFalse(os.path.exists(self.planilha + '.diario'))
+        self.assertEqual(diario.pendentes('A'), {})
+
+    def test_so_o_dono_do_diario_recupera_e_grava(self):
+        entrada = {'aba': 'A', 'linha': 2, 'campo': 'programa', 'valor': True}
+        self.escrever_diario(entrada)
+        outro_processo = travar(self.planilha + '.diario.trava')
+        self.addCleanup(outro_processo.close)
+
+        diario = self.diario()
+        with self.assertLogs('webapp.diario', 'WARNING'):
+            diario.recuperar()
+        self.assertEqual(diario.pendentes('A'), {})
+        with self.assertRaises(DiarioOcupado):
+            diario.registrar('A', {3: {'programa': True}})
+        diario.encerrar()
+        with open(self.planilha + '.diario', encoding='utf-8') as f:
+            self.assertEqual([json.loads(linha) for linha in f], [entrada])
+
+    @override_settings(ARMAZENAMENTO_MOLDES='planilha')
+    def test_outro_processo_com_o_diario_responde_503(self):
+        outro_processo = travar(self.planilha + '.diario.trava')
+        self.addCleanup(outro_processo.close)
+        self.addCleanup(diario_da_planilha(self.planilha).encerrar)
+
+        corpo = {'aba': 'A', 'alteracoes': [{'linha': 2, 'campo': 'programa', 'valor': True}]}
+        resposta = self.client.post('/alternar/', json.dumps(corpo), content_type='application/json')
+        self.assertEqual(resposta.status_code, 503)
+        self.assertIn('único processo', resposta.json()['erro'])
+
+    @unittest.skipIf(os.name == 'nt', "permissões POSIX")
+    def test_gravar_mantem_as_permissoes_da_planilha(self):
+        os.chmod(self.planilha, 0o664)
+        diario = self.diario()
+        diario.registrar('A', {2: {'programa': True}})
+        diario.gravar()
+        self.assertEqual(stat.S_IMODE(os.stat(self.planilha).st_mode), 0o664)
+
+
+class FilaRenderTests(ComPastaTemporaria, SimpleTestCase):
+    def concluir(self, arquivo, tamanho):
+        fila_render.concluir(arquivo, fila_render.nome_imagem(arquivo),
+                             fila_render.chave_preview('hash', tamanho), {'renderizar': 0.1})
+
+    def test_novos_passam_na_frente_e_concluido_fica_em_dia(self):
+        fila_render.enfileirar([
+            ('A/velho.stp', 10, 1.0, fila_render.PRIORIDADE_ATUALIZACAO),
+            ('A/novo.stp', 20, 2.0, fila_render.PRIORIDADE_NOVO),
+        ])
+        job = fila_render.reservar(pid=1)
+        self.assertEqual(job['arquivo'], 'A/novo.stp')
+        self.assertEqual(fila_render.estados()['A/novo.stp']['estado'], fila_render.PROCESSANDO)
+
+        self.concluir('A/novo.stp', 20)
+        job = fila_render.estados()['A/novo.stp']
+        self.assertEqual(job['estado'], fila_render.PRONTO)
+        self.assertTrue(fila_render.em_dia(job, 20, 2.0))
+        self.assertIsNone(fila_render.prioridade_na_fila(job, 20, 2.0))
+        self.assertEqual(fila_render.prioridade_na_fila(job, 21, 3.0), fila_render.PRIORIDADE_ATUALIZACAO)
+        self.assertEqual(fila_render.contadores()['previews_renderizados_total'], 1)
+
+    def test_arquivo_alterado_durante_a_renderizacao_volta_para_a_fila(self):
+        fila_render.enfileirar([('A/1.stp', 10, 1.0, fila_render.PRIORIDADE_NOVO)])
+        fila_render.reservar(pid=1)
+        fila_render.enfileirar([('A/1.stp', 30, 5.0, fila_render.PRIORIDADE_ATUALIZACAO)])
+        job = fila_render.estados()['A/1.stp']
+        self.assertEqual((job['estado'], job['tamanho'], job['mtime']), (fila_render.PROCESSANDO, 10, 1.0))
+
+        self.concluir('A/1.stp', 10)
+        job = fila_render.estados()['A/1.stp']
+        self.assertIsNotNone(fila_render.prioridade_na_fila(job, 30, 5.0))
+
+    def test_abandonar_devolver_e_recuperar(self):
+        fila_render.enfileirar([(f'A/{n}.stp', n, 1.0, 0) for n in range(3)])
+        fila_render.reservar(pid=1)
+        fila_render.reservar(pid=2)
+        fila_render.reservar(pid=3)
+
+        fila_render.abandonar(1)
+        fila_render.devolver(2)
+        self.assertEqual(fila_render.quantidades_por_estado(), {
+            fila_render.ERRO: 1, fila_render.PENDENTE: 1, fila_render.PROCESSANDO: 1,
+        })
+        self.assertEqual(fila_render.contadores()['previews_erros_total'], 1)
+        # Arquivo com erro só volta para a fila se for alterado
+        com_erro = next(job for job in fila_render.estados().values() if job['estado'] == fila_render.ERRO)
+        self.assertIsNone(fila_render.prioridade_na_fila(com_erro, com_erro['tamanho'], 1.0))
+        self.assertIsNotNone(fila_render.prioridade_na_fila(com_erro, com_erro['tamanho'], 2.0))
+
+        fila_render.recuperar_interrompidos()
+        self.assertEqual(fila_render.quantidades_por_estado(), {fila_render.ERRO: 1, fila_render.PENDENTE: 2})
+
+    def test_limpeza_so_apaga_imagens_soltas(self):
+        pasta_previews = os.path.join(self.pasta, 'modelos', 'previews')
+        fila_render.enfileirar([('A/1.stp', 10, 1.0, fila_render.PRIORIDADE_NOVO)])
+        fila_render.reservar(pid=1)
+        self.concluir('A/1.stp', 10)
+        os.makedirs(os.path.join(pasta_previews, 'A'))
+        nomes = ['A/1.png', 'A/2.png', 'A/2-160.webp', 'preaquecer.lock', 'preaquecer.json']
+        for nome in nomes:
+            open(os.path.join(pasta_previews, nome), 'w').close()
+        trava = travar(os.path.join(pasta_previews, 'preaquecer.lock'))
+        self.addCleanup(trava.close)
+
+        _, apagadas = fila_render.coletar_orfaos(['A/1.stp'], pasta_previews, apagar_soltos=True)
+        self.assertEqual(sorted(apagadas), ['A/2-160.webp', 'A/2.png'])
+        for nome in ('A/1.png', 'preaquecer.lock', 'preaquecer.json', 'fila_render.sqlite3'):
+            self.assertTrue(os.path.exists(os.path.join(pasta_previews, nome)), nome)
+
+
+# Sem watchdog: o índice confere as datas das pastas e dos modelos
+@override_settings(PASTAS_MODELOS_NOTIFICACOES=False, PASTAS_MODELOS_INTERVALO=0)
+class PreviewsDoMoldeTests(ComPastaTemporaria, SimpleTestCase):
+    def criar(self, relativo, conteudo, mtime):
+        caminho = os.path.join(self.pasta, 'modelos', *relativo.split('/'))
+        os.makedirs(os.path.dirname(caminho), exist_ok=True)
+        with open(caminho, 'w') as f:
+            f.write(conteudo)
+        os.utime(caminho, (mtime, mtime))
+
+    def test_so_os_codigos_da_pagina_e_modelo_sobrescrito_volta_para_a_fila(self):
+        self.criar('A/1001.stp', 'um', 1000)
+        self.criar('A/1002.stp', 'dois', 1000)
+        self.assertEqual(previews_do_molde('A', ['1001', 9999]), {})
+        self.assertEqual(list(fila_render.estados()), ['A/1001.stp'])
+
+        fila_render.reservar(pid=1)
+        fila_render.concluir('A/1001.stp', 'A/1001.png', fila_render.chave_preview('hash', 2))
+        self.assertEqual(previews_do_molde('A', ['1001'])['1001'][0], 'A/1001.png')
+        self.assertEqual(fila_render.quantidades_por_estado(), {fila_render.PRONTO: 1})
+
+        # Sobrescrito no lugar: a data da pasta não muda
+        pasta_molde = os.path.join(self.pasta, 'modelos', 'A')
+        data_pasta = os.stat(pasta_molde).st_mtime
+        self.criar('A/1001.stp', 'um alterado', 2000)
+        os.utime(pasta_molde, (data_pasta, data_pasta))
+        previews_do_molde('A', ['1001'])
+        self.assertEqual(fila_render.estados()['A/1001.stp']['estado'], fila_render.PENDENTE)
+
+
+@override_settings(DEBUG=False)
+class MediaTests(ComPastaTemporaria, SimpleTestCase):
+    def criar(self, relativo, conteudo=b'conteudo'):
+        caminho = os.path.join(self.pasta, *relativo.split('/'))
+        os.makedirs(os.path.dirname(caminho), exist_ok=True)
+        with open(caminho, 'wb') as f:
+            f.write(conteudo)
+
+    def test_so_modelos_e_previews_sao_entregues(self):
+        for relativo in ('modelos/A/1001.stp', 'modelos/A/sub/1002.STEP', 'modelos/solto.stp',
+                         'modelos/previews/A/1001.png', 'modelos/previews/A/1001-160.webp',
+                         'modelos/previews/A/1001-320.jpg'):
+            self.criar(relativo)
+            self.assertEqual(self.client.get('/media/' + relativo).status_code, 200, relativo)
+
+        for relativo in ('moldes.xlsx', 'moldes.xlsx.diario', 'moldes.xlsx.diario.trava',
+                         'modelos/A.molde.json', 'modelos/previews/fila_render.sqlite3',
+                         'modelos/previews/preaquecer.json', 'modelos/A/notas.txt'):
+            self.criar(relativo)
+            self.assertEqual(self.client.get('/media/' + relativo).status_code, 404, relativo)
+        self.assertEqual(self.client.get('/media/modelos/A/../../moldes.xlsx').status_code, 404)
+
+    def test_etag_e_304(self):
+        self.criar('modelos/A/1001.stp')
+        resposta = self.client.get('/media/modelos/A/1001.stp')
+        self.assertEqual(resposta['Cache-Control'], 'no-cache')
+        resposta = self.client.get('/media/modelos/A/1001.stp', HTTP_IF_NONE_MATCH=resposta['ETag'])
+        self.assertEqual(resposta.status_code, 304)
+
+        self.criar('modelos/A/1001.stp', b'outro conteudo')
+        resposta = self.client.get('/media/modelos/A/1001.stp', HTTP_IF_NONE_MATCH=resposta['ETag'])
+        self.assertEqual(resposta.status_code, 200)
+
+    def test_immutable_so_com_a_versao_atual(self):
+        self.criar('modelos/previews/A/1001-160.webp', b'imagem')
+        chave = fila_render.chave_preview('hash', 10)
+        fila_render.enfileirar([('A/1001.stp', 10, 1.0, fila_render.PRIORIDADE_NOVO)])
+        fila_render.reservar()
+        fila_render.concluir('A/1001.stp', 'A/1001.png', chave)
+
+        url = '/media/modelos/previews/A/1001-160.webp?v='
+        self.assertIn('immutable', self.client.get(url + fila_render.versao_preview(chave))['Cache-Control'])
+        self.assertEqual(self.client.get(url + 'inventada')['Cache-Control'], 'no-cache')
+
+
+# As mesmas alterações nos três armazenamentos dão o mesmo resultado
+@override_settings(ITENS_POR_PAGINA=50)
+class ArmazenamentosTests(ComPastaTemporaria, TestCase):
+    ITENS = {
+        'MOLDE A': [('1001', True, True, True), ('1002', True, False, False), ('1003', False, False, False)],
+        'MOLDE B': [('2001', False, True, False), ('2002', True, True, False)],
+    }
+    ALTERACOES = [
+        ('MOLDE A', {2: {'maquina_1': False}, 4: {'chegada_aco': True, 'programa': True}}),
+        ('MOLDE B', {2: {'chegada_aco': True, 'maquina_2': True}}),
+        # Linha que não existe é ignorada
+        ('MOLDE B', {99: {'programa': True}}),
+    ]
+
+    def setUp(self):
+        super().setUp()
+        criar_planilha(self.planilha, self.ITENS)
+        importar_planilha(self.planilha)
+        fragmentar_planilha(self.planilha, os.path.join(self.pasta, 'modelos'))
+        self.addCleanup(self.cancelar_exportacao)
+
+        planilha = ArmazenamentoPlanilha(self.planilha)
+        self.addCleanup(planilha.diario.encerrar)
+        self.armazenamentos = {
+            'banco': ArmazenamentoBanco(),
+            'planilha': planilha,
+            'fragmentos': ArmazenamentoFragmentos(os.path.join(self.pasta, 'modelos')),
+        }
+
+    def cancelar_exportacao(self):
+        if sincronizacao._exportacao_timer is not None:
+            sincronizacao._exportacao_timer.cancel()
+
+    def estado(self, armazenamento):
+        return {
+            aba: [
+                (linha.linha, str(linha.item), linha.status_custom,
+                 tuple(bool(getattr(linha, campo)) for campo in CAMPOS_CHECKBOX))
+                for linha in armazenamento.linhas(aba)
+            ]
+            for aba in sorted(armazenamento.abas())
+        }
+
+    def test_mesmos_dados_status_e_contagens(self):
+        estados = {modo: self.estado(armazenamento) for modo, armazenamento in self.armazenamentos.items()}
+        self.assertEqual(estados['planilha'], estados['banco'])
+        self.assertEqual(estados['fragmentos'], estados['banco'])
+
+        status = {}
+        for modo, armazenamento in self.armazenamentos.items():
+            status[modo] = [armazenamento.salvar(aba, alteracoes) for aba, alteracoes in self.ALTERACOES]
+        self.assertEqual(status['planilha'], status['banco'])
+        self.assertEqual(status['fragmentos'], status['banco'])
+        self.assertEqual(status['banco'][2], {})
+
+        estados = {modo: self.estado(armazenamento) for modo, armazenamento in self.armazenamentos.items()}
+        self.assertEqual(estados['planilha'], estados['banco'])
+        self.assertEqual(estados['fragmentos'], estados['banco'])
+        # O banco guarda também as contagens que voltaram a zero
+        contagens = {
+            modo: {
+                aba: {chave: quantidade for chave, quantidade in valores.items() if quantidade}
+                for aba, valores in armazenamento.contagens().items()
+            }
+            for modo, armazenamento in self.armazenamentos.items()
+        }
+        self.assertEqual(contagens['planilha'], contagens['banco'])
+        self.assertEqual(contagens['fragmentos'], contagens['banco'])
+
+    def test_alteracoes_chegam_em_disco(self):
+        for armazenamento in self.armazenamentos.values():
+            for aba, alteracoes in self.ALTERACOES:
+                armazenamento.salvar(aba, alteracoes)
+        esperado = self.estado(self.armazenamentos['banco'])
+
+        # Planilha gravada pelo diário e arquivos dos moldes relidos do zero
+        self.armazenamentos['planilha'].diario.gravar()
+        ws = load_workbook(self.planilha)['MOLDE B']
+        self.assertEqual((ws['D2'].value, ws['G2'].value), (MARCADO, MARCADO))
+        fragmentos = ArmazenamentoFragmentos(os.path.join(self.pasta, 'modelos'))
+        fragmentos.cache._fragmentos.clear()
+        self.assertEqual(self.estado(fragmentos), esperado)
+
+    def test_paginas_filtradas_iguais(self):
+        filtro = Filtro(maquina=1, ordem='-linha')
+        paginas = {
+            modo: [linha.linha for linha in armazenamento.pagina('MOLDE A', filtro)]
+            for modo, armazenamento in self.armazenamentos.items()
+        }
+        self.assertEqual(paginas['banco'], [2])
+        self.assertEqual(paginas['planilha'], paginas['banco'])
+        self.assertEqual(paginas['fragmentos'], paginas['banco'])
+
+    def test_historico_manda_so_as_alteracoes_novas(self):
+        banco = self.armazenamentos['banco']
+        versao = historico.versao_atual('MOLDE A')
+        self.assertIsNone(historico.alteracoes_desde('MOLDE A', versao))
+
+        banco.salvar('MOLDE A', {2: {'maquina_1': False}})
+        banco.salvar('MOLDE A', {2: {'programa': False}})
+        delta = historico.alteracoes_desde('MOLDE A', versao)
+        self.assertFalse(delta['recarregar'])
+        self.assertEqual(len(delta['alteracoes']), 1)
+        self.assertFalse(delta['alteracoes'][0]['valores']['programa'])
+        self.assertIsNone(historico.alteracoes_desde('MOLDE A', delta['versao']))
@@ -1,95 +1,149 @@
+import asyncio
+import json
 import os
+import time
+from urllib.parse import quote
+from asgiref.sync import sync_to_async
 from django.conf import settings
+from django.http import HttpResponse, HttpResponseNotModified, JsonResponse, StreamingHttpResponse
 from django.shortcuts import render, redirect
+from django.views.decorators.http import require_POST
 from django.contrib import messages
-from multiprocessing import Pool, cpu_count
 from .dict import USUARIOS
-from openpyxl import load_workbook
-# Bibliotecas da OCC (OpenCascade) para ler arquivos STEP e renderizar imagens
-from OCC.Core.STEPControl import STEPControl_Reader
-from OCC.Core.IFSelect import IFSelect_RetDone
-from OCC.Display.OCCViewer import OffscreenRenderer
-
-# Variaveis globais
-caminho_base = r'media\modelos'
-caminho_arquivo = r'media\moldes.xlsx'
-
-# Função responsável por gerar a imagem (preview) a partir de um arquivo .stp
-def gerar_preview_stp_para_png(caminho_stp, caminho_png):
-    # Cria o leitor para arquivos STEP
-    reader = STEPControl_Reader()
-    status = reader.ReadFile(caminho_stp)
-    
-    # Verifica se o arquivo foi lido com sucesso
-    if status != IFSelect_RetDone:
-        raise Exception(f"Erro ao ler o arquivo STEP: {caminho_stp}")
-    
-    # Transfere o conteúdo do arquivo STEP para a variável shape (forma 3D)
-    reader.TransferRoot()
-    shape = reader.Shape()
-
-    # Inicializa o renderizador offscreen (sem janela gráfica)
-    renderer = OffscreenRenderer(screen_size=(640, 480))
-
-    # Exibe o modelo 3D e salva a imagem no caminho indicado
-    renderer.DisplayShape(
-        shapes=shape,
-        transparency=0.7,
-        dump_image=True,
-        dump_image_path=os.path.dirname(caminho_png),
-        dump_image_filename=os.path.basename(caminho_png)
-    )
-
-# Função chamada em paralelo para cada arquivo STEP
-def processar_preview(arquivo_info):
-    # Desempacota os dados
-    pasta_modelos, pasta_previews, arquivo = arquivo_info
-
-    # Define os caminhos para o arquivo STEP e a imagem JPEG correspondente
-    caminho_stp = os.path.join(pasta_modelos, arquivo)
-    nome_imagem = arquivo.replace('.stp', '.jpeg')
-    caminho_png = os.path.join(pasta_previews, nome_imagem)
-
-    try:
-        # Só gera nova imagem se não existir ou se o arquivo .stp foi modificado mais recentemente
-        if not os.path.exists(caminho_png) or os.path.getmtime(caminho_stp) > os.path.getmtime(caminho_png):
-            gerar_preview_stp_para_png(caminho_stp, caminho_png)
-
-        # Retorna um dicionário com as informações que serão exibidas no HTML
-        return {
-            'nome': arquivo,
-            'imagem_url': f"/media/modelos/previews/{nome_imagem}"
-        }
-
-    except Exception as e:
-        # Caso algo dê errado, mostra o erro no terminal e retorna None
-        print(f"Erro ao gerar preview para {arquivo}: {e}")
-        return None
-
-# View do Django que lista os modelos e seus previews
+from . import fila_render
+from . import armazenamento
+from . import arquivos
+from . import executores
+from . import historico
+from . import metricas
+from .metricas import medir
+from .executores import recusar_se_sobrecarregado
+from .consulta import ORDENS, Filtro
+from .diario import DiarioOcupado
+from .painel import NOMES_MAQUINAS, montar_resumo
+from .status import STATUS
+from .templatetags.miniaturas import imagem_preview
+from .pastas import indice_de_pastas, listar_modelos, previews_do_molde
+
+# View do Django que lista os modelos e seus previews.
+# Não renderiza nada: só coloca na fila do serviço de renderização os modelos
+# sem preview (ou com preview desatualizado) e responde na hora, com os
+# previews prontos e um aviso no lugar dos que ainda estão na fila. A página
+# acompanha a fila por eventos_modelos (SSE) ou estado_modelos (JSON).
 def listar_modelos_step(request):
     # Define o caminho para a pasta com os modelos (.stp)
     pasta_modelos = os.path.join(settings.MEDIA_ROOT, 'modelos')
-    
-    # Pasta onde serão salvas as imagens (previews)
-    pasta_previews = os.path.join(pasta_modelos, 'previews')
-    os.makedirs(pasta_previews, exist_ok=True)  # Cria se não existir
 
-    # Lista todos os arquivos .stp na pasta
-    arquivos_stp = [f for f in os.listdir(pasta_modelos) if f.lower().endswith('.stp')]
-
-    # Prepara os dados que serão enviados para cada processo (arquivo + pastas)
-    args = [(pasta_modelos, pasta_previews, arquivo) for arquivo in arquivos_stp]
-
-    # Cria um pool de processos para acelerar o processamento usando múltiplos núcleos
-    with Pool(processes=cpu_count()) as pool:
-        resultados = pool.map(processar_preview, args)
+    # Pasta onde são salvas as imagens (previews)
+    pasta_previews = os.path.join(pasta_modelos, 'previews')
 
-    # Remove da lista os arquivos que falharam (None)
-    previews = [r for r in resultados if r]
+    # Lista os modelos da pasta e das pastas de cada molde, com tamanho e data
+    # de modificação (chave: caminho relativo, ex.: "MOLDE A/1001.stp")
+    arquivos_stp = listar_modelos(pasta_modelos)
+
+    # Manifesto dos previews (e estado da fila) em uma única consulta
+    jobs = fila_render.estados()
+    # Alterações na fila depois deste instante são enviadas pela página
+    desde = max((job['atualizado_em'] for job in jobs.values()), default=0)
+
+    previews = []
+    novos_jobs = []
+    for arquivo, (tamanho, mtime) in sorted(arquivos_stp.items()):
+        job = jobs.get(arquivo)
+
+        # Novos ou desatualizados: o serviço confere o hash do conteúdo e só
+        # renderiza de novo se a geometria mudou
+        prioridade = fila_render.prioridade_na_fila(job, tamanho, mtime)
+        if prioridade is not None:
+            novos_jobs.append((arquivo, tamanho, mtime, prioridade))
+        if job is None:
+            previews.append({'nome': arquivo, 'estado': fila_render.PENDENTE, 'imagem': None})
+            continue
 
-    # Renderiza a página HTML com as imagens geradas
-    return render(request, 'visualizador/preview.html', {'previews': previews})
+        # Retorna um dicionário com as informações que serão exibidas no HTML
+        previews.append(estado_do_preview(job))
+
+    # Modelos apagados saem do manifesto junto com os previews
+    if any(arquivo not in arquivos_stp for arquivo in jobs):
+        fila_render.coletar_orfaos(arquivos_stp, pasta_previews)
+
+    if novos_jobs:
+        fila_render.enfileirar(novos_jobs)
+
+    # Renderiza a página HTML com as imagens já geradas
+    with medir('template'):
+        return render(request, 'visualizador/preview.html', {'previews': previews, 'desde': desde})
+
+
+# Estado de um modelo na fila de renderização, no formato usado pela página
+# e pelos endpoints que a atualizam
+def estado_do_preview(job):
+    versao = fila_render.versao_preview(job['chave'])
+    return {
+        'nome': job['arquivo'],
+        'estado': job['estado'],
+        'erro': job.get('erro'),
+        'imagem': job['imagem'],
+        'versao': versao,
+        'imagem_url': (settings.MEDIA_URL + 'modelos/previews/' + quote(job['imagem']) + f'?v={versao}'
+                       if job['imagem'] else None),
+    }
+
+
+# Alterações na fila depois do instante "desde", em JSON:
+#   {"desde": 1718000000.5, "modelos": [{"nome": ..., "estado": ..., "html": ...}]}
+# "html" é a miniatura pronta para colocar na página (só quando há imagem).
+def mudancas_na_fila(desde):
+    jobs, desde = fila_render.alterados_desde(desde)
+    modelos = []
+    for job in jobs:
+        preview = estado_do_preview(job)
+        preview['html'] = imagem_preview(preview['nome'], 200, versao=preview['versao']) if preview['imagem'] else None
+        modelos.append(preview)
+    return {'desde': desde, 'modelos': modelos}
+
+
+def _instante(valor):
+    try:
+        return float(valor or 0)
+    except ValueError:
+        return 0.0
+
+
+# Endpoint de consulta periódica (polling) da página de modelos
+def estado_modelos(request):
+    return JsonResponse(mudancas_na_fila(_instante(request.GET.get('desde'))))
+
+
+# Mesmas alterações da fila enviadas por server-sent events. A conexão fica
+# aberta por PREVIEWS_EVENTOS_DURACAO segundos e o navegador reconecta
+# sozinho, mandando o último instante recebido em Last-Event-ID. Fora do
+# ASGI a resposta só sairia no fim da duração (e prenderia um worker até lá):
+# responde 204, e a página passa a consultar estado_modelos.
+async def eventos_modelos(request):
+    if not executores.pelo_asgi(request):
+        return HttpResponse(status=204)
+    desde = _instante(request.headers.get('Last-Event-ID') or request.GET.get('desde'))
+    intervalo = getattr(settings, 'PREVIEWS_EVENTOS_INTERVALO', 1)
+    duracao = getattr(settings, 'PREVIEWS_EVENTOS_DURACAO', 300)
+
+    async def eventos():
+        nonlocal desde
+        fim = time.monotonic() + duracao
+        while time.monotonic() < fim:
+            mudancas = await sync_to_async(mudancas_na_fila)(desde)
+            if mudancas['modelos']:
+                desde = mudancas['desde']
+                yield f"id: {desde!r}\ndata: {json.dumps(mudancas)}\n\n"
+            else:
+                # Comentário SSE: mantém a conexão viva em proxies
+                yield ": \n\n"
+            await asyncio.sleep(intervalo)
+
+    resposta = StreamingHttpResponse(eventos(), content_type='text/event-stream')
+    resposta['Cache-Control'] = 'no-cache'
+    resposta['X-Accel-Buffering'] = 'no'
+    return resposta
 
 # Metodo de Login
 def login(request):
@@ -110,222 +164,211 @@ def login(request):
 
 
 
-def pagina_principal(request, nome_aba=None):
-    elementos = []
-    dados = []
-    mensagem = None
-    abas_excel = []
-
-    # Lista todas as pastas do diretório
+# Página de itens de um molde que passam no filtro, lida do armazenamento
+# configurado (banco ou planilha). Devolve (pagina, mensagem); pagina é None
+# e mensagem explica o motivo quando não há o que mostrar.
+def carregar_dados(nome_aba, filtro):
+    dados_moldes = armazenamento.obter()
+    if not dados_moldes.disponivel():
+        return None, "Arquivo moldes.xlsx não encontrado."
+    if not nome_aba:
+        return None, None
     try:
-        for nome in os.listdir(caminho_base):
-            caminho_completo = os.path.join(caminho_base, nome)
-            if os.path.isdir(caminho_completo):
-                elementos.append({'tipo': 'pasta', 'nome': nome})
+        if nome_aba not in dados_moldes.abas():
+            return None, f"Não apresenta dados do molde '{nome_aba}'."
+        return dados_moldes.pagina(nome_aba, filtro), None
     except Exception as e:
-        elementos = [{'tipo': 'erro', 'nome': f"Erro: {str(e)}"}]
+        return None, f"Erro ao abrir o Excel: {e}"
 
-    # Verifica e carrega abas do Excel
-    if os.path.exists(caminho_arquivo):
-        try:
-            wb = load_workbook(caminho_arquivo, data_only=True)
-            abas_excel = wb.sheetnames
-
-            if nome_aba:
-                if nome_aba in abas_excel:
-                    aba = wb[nome_aba]
-                        # Itera pelas linhas a partir da 1ª (ou 2ª se quiser pular cabeçalho)
-                    for row in aba.iter_rows(min_row=2, max_col=11):  
-                        linha_num = row[0].row  # pega o número da linha
-                        item = row[1].value
-                        chegada_aco = bool(row[4].value)
-                        programa = bool(row[4].value)
-                        maquina_1 = bool(row[5].value)
-                        maquina_2 = bool(row[6].value)
-                        maquina_3 = bool(row[7].value)
-                        maquina_4 = bool(row[8].value)
-                        maquina_5 = bool(row[9].value)  
-                        maquina_6 = bool(row[10].value)
-                        em_maquina = any([
-                            maquina_1, maquina_2, maquina_3, 
-                            maquina_4, maquina_5, maquina_6
-                        ])
-                        # Força valores booleanos para evitar erros
-                        chegada_aco = bool(row[3].value)
-                        programa = bool(row[4].value)
-
-                        # Lógica para determinar o status customizado
-                        if chegada_aco and programa and not em_maquina:
-                            status_custom = "Pronto para usinar"
-                        elif chegada_aco and programa and em_maquina:
-                            status_custom = "Usinando"
-                        elif chegada_aco and not programa:
-                            status_custom = "Aguardando programa"
-                        elif programa and not chegada_aco:
-                            status_custom = "Aguardando aço"
-                        else:
-                            status_custom = "Aguardando aço e programa"
-                        dados.append({
-                            'linha': linha_num,
-                            'item': item, 
-                            'chegada_aco': bool(chegada_aco), 
-                            'programa': bool(programa),
-                            'status_custom': status_custom
-                        })
-                else:
-                    mensagem = f"Não apresenta dados do molde '{nome_aba}'."
-        except Exception as e:
-            mensagem = f"Erro ao abrir o Excel: {e}"
-    else:
-        mensagem = "Arquivo moldes.xlsx não encontrado."
 
-    return render(request, 'tela_principal/principal.html', {
-        'elementos': elementos,
-        'dados': dados,
-        'aba': nome_aba,
-        'mensagem': mensagem,
-        'permissao': request.session.get('permissao')
-    })
+# Páginas de um molde. As views são assíncronas: rodando pelo asgi.py, a
+# leitura da planilha/banco e a montagem do HTML ficam nas threads de
+# executores.py e o processo continua atendendo outras requisições.
+@recusar_se_sobrecarregado
+async def pagina_principal(request, nome_aba=None):
+    permissao = await request.session.aget('permissao')
+    return await executores.ler(
+        pagina_do_molde, request, 'tela_principal/principal.html', nome_aba, permissao=permissao
+    )
+
 
-def atualizar_status(request):
+# Monta a página de um molde (roda em uma thread de leitura)
+def pagina_do_molde(request, template, nome_aba, **contexto):
+    # Pastas dos moldes (índice em memória, atualizado quando a pasta muda)
+    elementos = indice_de_pastas().elementos()
+
+    # Versão lida antes dos dados: o que for alterado no meio chega depois
+    # pelo alteracoes_do_molde, no máximo repetido
+    versao = historico.versao_atual(nome_aba) if nome_aba else 0
+
+    # Carrega só a página pedida dos itens do molde, já filtrada e ordenada
+    filtro = Filtro.da_url(request.GET)
+    with medir('dados'):
+        pagina, mensagem = carregar_dados(nome_aba, filtro)
+
+    previews = previews_do_molde(nome_aba, [linha.item for linha in pagina.object_list]) if pagina else {}
+
+    with medir('template'):
+        return render(request, template, {
+            'elementos': elementos,
+            'pagina': pagina,
+            'dados': pagina.object_list if pagina else [],
+            'filtro': filtro,
+            'opcoes_status': STATUS,
+            'opcoes_maquinas': list(enumerate(NOMES_MAQUINAS, start=1)),
+            'opcoes_ordem': ORDENS.items(),
+            'previews': previews,
+            'versao': versao,
+            'intervalo_alteracoes': getattr(settings, 'ALTERACOES_INTERVALO', 5),
+            'aba': nome_aba,
+            'mensagem': mensagem,
+            **contexto,
+        })
+
+# Alterações de um molde depois da versão ?desde=N, em JSON:
+#   {"versao": 120, "recarregar": false,
+#    "alteracoes": [{"linha": 3, "status": "Usinando", "valores": {"chegada_aco": true, ...}}]}
+# Sem nada novo responde 304, sem corpo. As páginas abertas consultam a cada
+# ALTERACOES_INTERVALO segundos e atualizam só as linhas alteradas
+# (static/script/alteracoes.js).
+@recusar_se_sobrecarregado
+async def alteracoes_do_molde(request, nome_aba):
+    try:
+        versao = int(request.GET.get('desde') or 0)
+    except ValueError:
+        return JsonResponse({'erro': "Parâmetro 'desde' inválido."}, status=400)
+    resultado = await executores.ler(historico.alteracoes_desde, nome_aba, versao)
+    resposta = HttpResponseNotModified() if resultado is None else JsonResponse(resultado)
+    resposta['Cache-Control'] = 'no-store'
+    return resposta
+
+
+@recusar_se_sobrecarregado
+async def atualizar_status(request):
+    if request.method == 'POST':
+        nome_aba = request.POST.get('nome_aba')
+        try:
+            await executores.gravar(salvar_formulario, nome_aba, ('chegada_aco', 'programa'), request.POST)
+        except DiarioOcupado as e:
+            messages.error(request, f"Mudanças não salvas: {e}")
+        else:
+            messages.success(request, 'Mudanças salvas com sucesso.')
+        return redirect(_com_filtros(f'/pagina/{nome_aba}', request.POST))
+
+
+# Grava os checkboxes do formulário de um molde; só as linhas que mudaram
+# são enviadas para o armazenamento. Com a paginação o formulário só tem
+# parte das linhas; elas vêm listadas nos campos "linha".
+def salvar_formulario(nome_aba, campos, post):
+    dados_moldes = armazenamento.obter()
+    if not nome_aba or nome_aba not in dados_moldes.abas():
+        return
+    linhas = dados_moldes.linhas(nome_aba)
+    if 'linha' in post:
+        no_formulario = set(post.getlist('linha'))
+        linhas = [linha for linha in linhas if str(linha.linha) in no_formulario]
+    alteracoes = armazenamento.alteracoes_do_formulario(linhas, campos, post)
+    if alteracoes:
+        with medir('salvar'):
+            dados_moldes.salvar(nome_aba, alteracoes)
+
+
+@recusar_se_sobrecarregado
+async def checklist(request, nome_aba=None):
+    return await executores.ler(pagina_do_molde, request, 'checklist/checklist.html', nome_aba)
+
+@recusar_se_sobrecarregado
+async def atualizar_status_checklist(request):
     if request.method == 'POST':
         nome_aba = request.POST.get('nome_aba')
-        wb = load_workbook(caminho_arquivo)
-        if nome_aba and nome_aba in wb.sheetnames:
-            ws = wb[nome_aba]  # Atualiza na aba correta
+        campos = ('maquina_1', 'maquina_2', 'maquina_3', 'maquina_4', 'maquina_5', 'maquina_6')
+        try:
+            await executores.gravar(salvar_formulario, nome_aba, campos, request.POST)
+        except DiarioOcupado as e:
+            messages.error(request, f"Mudanças não salvas: {e}")
         else:
-            ws = wb.active  # Fallback se algo der errado
-            
-        for row in ws.iter_rows(min_row=2, max_col=6):  # base para pegar linha
-            linha_num = row[0].row
-            #Campos e colunas de cada item
-            campos = {
-                'chegada_aco': 4,
-                'programa': 5,
-            }
-            #Um for para inserir no excel a informação 
-            for campo_nome, col_num in campos.items():
-                campo_form = f'{campo_nome}_{linha_num}'
-                valor_checkbox = '☑' if request.POST.get(campo_form) == 'on' else ''
-                ws.cell(row=linha_num, column=col_num).value = valor_checkbox
-
-        # Salva em um caminho
-        wb.save(caminho_arquivo)
-
-        messages.success(request, 'Mudanças salvas com sucesso.')
-        return redirect(f'/pagina/{nome_aba}')
-
-
-def checklist(request, nome_aba=None):
-    elementos = []
-    dados = []
-    mensagem = None
-    abas_excel = []
+            messages.success(request, 'Mudanças salvas com sucesso.')
+    return redirect(_com_filtros(f'/checklist/{nome_aba}', request.POST))
 
-    # Lista todas as pastas do diretório
-    try:
-        for nome in os.listdir(caminho_base):
-            caminho_completo = os.path.join(caminho_base, nome)
-            if os.path.isdir(caminho_completo):
-                elementos.append({'tipo': 'pasta', 'nome': nome})
-    except Exception as e:
-        elementos = [{'tipo': 'erro', 'nome': f"Erro: {str(e)}"}]
 
-    # Verifica e carrega abas do Excel
-    if os.path.exists(caminho_arquivo):
+# Volta para a mesma página/filtro de onde o formulário foi enviado
+def _com_filtros(url, post):
+    filtros = post.get('filtros', '')
+    return f'{url}?{filtros}' if filtros else url
+
+
+# Painel geral: quantidade de itens em cada status por molde e na fábrica,
+# e carga de cada máquina. As contagens já vêm prontas do armazenamento.
+def painel(request):
+    dados_moldes = armazenamento.obter()
+    resumo = None
+    mensagem = None
+    if not dados_moldes.disponivel():
+        mensagem = "Arquivo moldes.xlsx não encontrado."
+    else:
         try:
-            wb = load_workbook(caminho_arquivo, data_only=True)
-            abas_excel = wb.sheetnames
-
-            if nome_aba:
-                if nome_aba in abas_excel:
-                    aba = wb[nome_aba]
-                        # Itera pelas linhas a partir da 1ª (ou 2ª se quiser pular cabeçalho)
-                    for row in aba.iter_rows(min_row=2, max_col=11):  
-                        linha_num = row[0].row  # pega o número da linha
-                        item = row[1].value
-                        chegada_aco = bool(row[4].value)
-                        programa = bool(row[4].value)
-                        maquina_1 = bool(row[5].value)
-                        maquina_2 = bool(row[6].value)
-                        maquina_3 = bool(row[7].value)
-                        maquina_4 = bool(row[8].value)
-                        maquina_5 = bool(row[9].value)  
-                        maquina_6 = bool(row[10].value)
-                        em_maquina = any([
-                            maquina_1, maquina_2, maquina_3, 
-                            maquina_4, maquina_5, maquina_6
-                        ])
-                        # Força valores booleanos para evitar erros
-                        chegada_aco = bool(row[3].value)
-                        programa = bool(row[4].value)
-
-                        # Lógica para determinar o status customizado
-                        if chegada_aco and programa and not em_maquina:
-                            status_custom = "Pronto para usinar"
-                        elif chegada_aco and programa and em_maquina:
-                            status_custom = "Usinando"
-                        elif chegada_aco and not programa:
-                            status_custom = "Aguardando programa"
-                        elif programa and not chegada_aco:
-                            status_custom = "Aguardando aço"
-                        else:
-                            status_custom = "Indefinido"
-                        dados.append({
-                            'linha': linha_num,
-                            'item': item,
-                            'maquina_1': bool(maquina_1),  
-                            'maquina_2': bool(maquina_2),  
-                            'maquina_3': bool(maquina_3),  
-                            'maquina_4': bool(maquina_4),  
-                            'maquina_5': bool(maquina_5),  
-                            'maquina_6': bool(maquina_6),  
-                            'status_custom': status_custom
-                        })
-                        print(status_custom)
-                else:
-                    mensagem = f"Não apresenta dados do molde '{nome_aba}'."
+            resumo = montar_resumo(dados_moldes.contagens(), dados_moldes.abas())
         except Exception as e:
             mensagem = f"Erro ao abrir o Excel: {e}"
-    else:
-        mensagem = "Arquivo moldes.xlsx não encontrado."
 
-    return render(request, 'checklist/checklist.html', {
-        'elementos': elementos,
-        'dados': dados,
-        'aba': nome_aba,
-        'mensagem': mensagem
-    })
+    with medir('template'):
+        return render(request, 'painel/painel.html', {
+            'resumo': resumo,
+            'mensagem': mensagem,
+        })
 
-def atualizar_status_checklist(request):
-    if request.method == 'POST':
-        nome_aba = request.POST.get('nome_aba')
-        wb = load_workbook(caminho_arquivo)
-        if nome_aba and nome_aba in wb.sheetnames:
-            ws = wb[nome_aba]  # Atualiza na aba correta
-        else:
-            ws = wb.active  # Fallback se algo der errado
-            
-        for row in ws.iter_rows(min_row=2, max_col=11):  # base para pegar linha
-            linha_num = row[0].row
-            #Campos e colunas de cada item
-            campos = {
-                'maquina_1': 6,
-                'maquina_2': 7,
-                'maquina_3': 8,
-                'maquina_4': 9,
-                'maquina_5': 10,
-                'maquina_6': 11,
-            }
-            #Um for para inserir no excel a informação 
-            for campo_nome, col_num in campos.items():
-                campo_form = f'{campo_nome}_{linha_num}'
-                print(campo_form)
-                valor_checkbox = '☑' if request.POST.get(campo_form) == 'on' else ''
-                ws.cell(row=linha_num, column=col_num).value = valor_checkbox
-
-        # Salva em um novo caminho se quiser manter cópia
-        wb.save(caminho_arquivo)
-        
-    messages.success(request, 'Mudanças salvas com sucesso.')
-    return redirect(f'/checklist/{nome_aba}')
\ No newline at end of file
+
+# Métricas de desempenho no formato texto do Prometheus
+def exportar_metricas(request):
+    return HttpResponse(metricas.exportar(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+# Endpoint chamado pelas páginas a cada checkbox marcado ou desmarcado.
+# Recebe só o que mudou, em JSON:
+#   {"aba": "M1", "alteracoes": [{"linha": 3, "campo": "programa", "valor": true}]}
+# e devolve o novo status de cada linha alterada:
+#   {"status_custom": {"3": "Pronto para usinar"}}
+@require_POST
+@recusar_se_sobrecarregado
+async def alternar_campos(request):
+    try:
+        corpo = json.loads(request.body)
+        nome_aba = corpo['aba']
+        alteracoes = armazenamento.alteracoes_do_json(corpo['alteracoes'])
+    except (ValueError, KeyError, TypeError) as e:
+        return JsonResponse({'erro': f"Requisição inválida: {e}"}, status=400)
+
+    try:
+        with medir('salvar'):
+            status = await executores.gravar(salvar_alternancia, nome_aba, alteracoes)
+    except DiarioOcupado as e:
+        # Outro processo é o dono do diário da planilha (veja diario.py)
+        return JsonResponse({'erro': str(e)}, status=503)
+    if status is None:
+        return JsonResponse({'erro': f"Não apresenta dados do molde '{nome_aba}'."}, status=404)
+    return JsonResponse({'status_custom': {str(linha): valor for linha, valor in status.items()}})
+
+
+# Grava as alterações do endpoint JSON (roda na thread de gravação); devolve
+# None se o molde não existe
+def salvar_alternancia(nome_aba, alteracoes):
+    dados_moldes = armazenamento.obter()
+    if nome_aba not in dados_moldes.abas():
+        return None
+    return dados_moldes.salvar(nome_aba, alteracoes) if alteracoes else {}
+
+
+# Arquivos de /media/ (previews e modelos) e estáticos, com ETag, 304 e
+# cabeçalhos de cache (veja arquivos.py). Substituem o static() do Django,
+# que só funciona com DEBUG; da mídia só saem os modelos e os previews.
+def servir_media(request, caminho):
+    return arquivos.servir(
+        request, arquivos.caminho_media(caminho), versoes=arquivos.versoes_da_media(caminho),
+    )
+
+
+def servir_estatico(request, caminho):
+    return arquivos.servir(
+        request, arquivos.caminho_estatico(caminho),
+        max_age=getattr(settings, 'ARQUIVOS_ESTATICOS_MAX_AGE', 3600),
+    )